@@ -0,0 +1,226 @@
+"""Benchmark of the crop price index calculation in utils/weap_ames.py
+
+Compares crop_price_indices(), which works on a (country, crop) x year grid of NumPy arrays, with the previous
+implementation in weap_to_ames_processing(), which aligned crop production and prices with helper "key" columns and
+merges, and added earlier years one row at a time. Both are run on synthetic data for one AMES region, and the
+results are checked to agree to floating-point tolerance.
+
+Usage (from the repository folder):
+    python benchmarks/crop_price_index.py [--countries 5] [--crops 100] [--years 80] [--repeat 5]
+"""
+import os
+import sys
+import time
+import gettext
+import argparse
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+gettext.install('wave_integration')
+from utils.weap_ames import crop_price_indices
+
+def synthetic_data(ncountries, ncrops, nyears, ncategories = 10, seed = 0):
+    """Return [crop production, crop prices, crop categories by crop, AMES sectors, AMES products] for synthetic crops"""
+    rng = np.random.default_rng(seed)
+    countries = ["C{i:02d}".format(i = i) for i in range(ncountries)]
+    crops = ["Crop {i:03d}".format(i = i) for i in range(ncrops)]
+    years = [str(y) for y in range(2015, 2015 + nyears)]
+    index = pd.MultiIndex.from_product([countries, crops], names = ['country', 'crop'])
+    production = pd.DataFrame(rng.uniform(0, 1e5, (len(index), nyears)), index = index, columns = years)
+    growth = rng.normal(0.02, 0.05, (len(index), nyears))
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(growth, axis = 1)), index = index, columns = years)
+    weap_joint_crop_map = {c: "Category {k}".format(k = i % ncategories) for i, c in enumerate(crops)}
+    categories = sorted(set(weap_joint_crop_map.values()))
+    ames_joint_agsec_map = {"S_" + c: c for c in categories}
+    ames_joint_agprod_map = {"P_" + c: c for c in categories}
+    return [production, prices, weap_joint_crop_map, ames_joint_agsec_map, ames_joint_agprod_map]
+
+def reference_price_indices(crop_production, crop_prices, countries, weap_joint_crop_map, ames_joint_agsec_map, ames_joint_agprod_map):
+    """The previous implementation, from weap_to_ames_processing()"""
+    dfcropsecgrp = crop_production[crop_production.index.get_level_values('country').isin(countries)].reset_index()
+    dfcropsecgrp['crop category'] = dfcropsecgrp['crop'].map(weap_joint_crop_map)
+    dfcropsecgrp = dfcropsecgrp[dfcropsecgrp['crop category'].notna()]
+    # Add crop categories to crop prices
+    dfcropprice_local = crop_prices.reset_index()
+    dfcropprice_local['crop category'] = dfcropprice_local['crop'].map(weap_joint_crop_map)
+
+    # ***** Rows
+    # Sector crop production: Create a "helper column" called "key"
+    dfcropsecgrp['key'] = dfcropsecgrp['country']+dfcropsecgrp['crop'] # helper column
+    # Crop price: Create a "helper column" and called "key"
+    dfcropprice_local['key'] = dfcropprice_local['country']+dfcropprice_local['crop'] # helper column
+    # Delete any rows that don't match
+    dfcropprice_local = dfcropprice_local[dfcropprice_local['key'].isin(dfcropsecgrp['key'])]
+    # Sort on the (identical) helper columns & then drop, since no longer needed
+    dfcropsecgrp = dfcropsecgrp.sort_values('key')
+    dfcropprice_local = dfcropprice_local.sort_values('key')
+    dfcropsecgrp = dfcropsecgrp.drop(columns = 'key')
+    dfcropprice_local = dfcropprice_local.drop(columns = 'key')
+    # Reset index columns (country x crop x crop category)
+    dfcropsecgrp.set_index(['country', 'crop', 'crop category'], inplace=True)
+    dfcropprice_local.set_index(['country', 'crop', 'crop category'], inplace=True)
+
+    #------------------------------------
+    # price inflation (growth rate of crop price)
+    #------------------------------------
+    dfinflation = dfcropprice_local.drop(columns = min(dfcropprice_local.columns))
+    dfinflation_lag = dfcropprice_local.drop(columns = max(dfcropprice_local.columns))
+    dfinflation = dfinflation/dfinflation_lag.values - 1.0
+ 
+    #------------------------------------
+    # share of production by joint crop category
+    #------------------------------------
+    # Numerator
+    dfnum = dfcropsecgrp * dfcropprice_local
+    # Denominator
+    dfdom = dfnum.groupby(['country', 'crop category']).sum()
+    # Associate denominator with numerator by merging -- will assign "_x" and "_y" for the year columns in dfnum & dfdom
+    dfnum = dfnum.reset_index()
+    dfdom = dfnum.merge(dfdom, left_on=['country','crop category'], right_on=['country','crop category'], how='right')
+    # Get rid of dfnum columns & get rid of "_y" so same denom for all country/crop combinations
+    dfdom = dfdom[dfdom.columns.drop(list(dfdom.filter(regex='x')))]
+    dfdom.columns = dfdom.columns.str.replace('_y', '')
+    # Assign dfnum & dfdom identically structured indices
+    dfnum.set_index(['country', 'crop', 'crop category'], inplace=True)
+    dfdom.set_index(['country', 'crop', 'crop category'], inplace=True)
+    # Divide numerator by denominator
+    dfshare = dfnum.div(dfdom)
+    # Drop first year because it's not present in the growth rate data frames
+    dfshare = dfshare.drop(columns = min(crop_production.columns))
+
+    #------------------------------------
+    # price growth indices (by sector & by product)
+    #------------------------------------
+    pricegrowth_jointcrop = dfinflation * dfshare
+    pricegrowth_jointcrop = pricegrowth_jointcrop.droplevel('country')
+    pricegrowth_jointcrop = pricegrowth_jointcrop.groupby(['crop category']).sum()
+    
+    #--- By AMES ag sector
+    # Create dataframe with no entries
+    pricegrowth_ames_agsec = pd.DataFrame.from_dict(ames_joint_agsec_map, columns=['crop category'], orient='index')
+    pricegrowth_ames_agsec.reset_index(inplace = True)
+    pricegrowth_ames_agsec = pricegrowth_ames_agsec.rename(columns = {'index':'ames_agsec'})
+    
+    # Merge with pricegrowth_jointcrop to assign values, then drop crop categories column
+    pricegrowth_ames_agsec = pricegrowth_ames_agsec.merge(pricegrowth_jointcrop,
+                                                              left_on=['crop category'],
+                                                              right_on=['crop category'],
+                                                              how='left')
+    pricegrowth_ames_agsec.drop('crop category', axis=1, inplace=True)
+    pricegrowth_ames_agsec.set_index('ames_agsec', inplace=True)
+    
+    # Convert from growth rate to index
+    pricendx_ames_agsec = (1.0 + pricegrowth_ames_agsec).cumprod(axis = 1)
+    # Insert index = 1 in first year position
+    pricendx_ames_agsec.insert(0, int(min(pricendx_ames_agsec)) - 1, 1.0)
+    
+    #--- By AMES ag product
+    # Create dataframe with no entries
+    pricegrowth_ames_agprod = pd.DataFrame.from_dict(ames_joint_agprod_map, columns=['crop category'], orient='index')
+    pricegrowth_ames_agprod.reset_index(inplace = True)
+    pricegrowth_ames_agprod = pricegrowth_ames_agprod.rename(columns = {'index':'ames_agprod'})
+    
+    # Merge with pricegrowth_jointcrop to assign values, then drop crop categories column
+    pricegrowth_ames_agprod = pricegrowth_ames_agprod.merge(pricegrowth_jointcrop,
+                                                              left_on=['crop category'],
+                                                              right_on=['crop category'],
+                                                              how='left')
+    pricegrowth_ames_agprod.drop('crop category', axis=1, inplace=True)
+    pricegrowth_ames_agprod.set_index('ames_agprod', inplace=True)
+    
+    # Convert from growth rate to index
+    pricendx_ames_agprod = (1.0 + pricegrowth_ames_agprod).cumprod(axis = 1)
+    # Insert index = 1 in first year position
+    pricendx_ames_agprod.insert(0, int(min(pricendx_ames_agprod)) - 1, 1.0)
+
+    #------------------------------------
+    # nominal output index
+    #------------------------------------
+    # Create a value index by joint product
+    valndx_joint = dfcropsecgrp.groupby('crop category').sum()
+    valndx_joint = valndx_joint.div(valndx_joint[min(valndx_joint)], axis=0)
+    
+    # Assign to AMES ag products
+    # Create dataframe with no entries
+    valndx_ames_agsec = pd.DataFrame.from_dict(ames_joint_agsec_map, columns=['crop category'], orient='index')
+    valndx_ames_agsec.reset_index(inplace = True)
+    valndx_ames_agsec = valndx_ames_agsec.rename(columns = {'index':'ames_agsec'})
+    
+    # Merge with valndx_joint to assign values, then drop crop categories column
+    valndx_ames_agsec = valndx_ames_agsec.merge(valndx_joint,
+                                                    left_on=['crop category'],
+                                                    right_on=['crop category'],
+                                                    how='left')
+    valndx_ames_agsec.drop('crop category', axis=1, inplace=True)
+    valndx_ames_agsec.set_index('ames_agsec', inplace=True)
+    
+    # Calculate real index by dividing value index by price index
+    realndx_ames_agsec = valndx_ames_agsec/pricendx_ames_agsec.values
+    
+    #------------------------------------
+    # Backcast
+    #------------------------------------
+    # Note: Must add some values to get to earlier years: go back to 2010 (only 2014 actually needed, for UZB)
+    firstyear = int(min(realndx_ames_agsec))
+    realndx_ames_agsec = realndx_ames_agsec.T
+    realndx_ames_agsec.index = realndx_ames_agsec.index.astype('int64') # After transpose, the index is years
+    val = 1
+    factor = 1/realndx_ames_agsec.loc[firstyear+1]
+    for y in range(firstyear,2009,-1):
+        realndx_ames_agsec.loc[y] = val
+        val *= factor
+    realndx_ames_agsec.sort_index(inplace=True)
+
+    pricendx_ames_agprod = pricendx_ames_agprod.T
+    pricendx_ames_agprod.index = pricendx_ames_agprod.index.astype('int64') # After transpose, the index is years
+    val = 1
+    factor = 1/pricendx_ames_agprod.loc[firstyear+1]
+    for y in range(firstyear,2009,-1):
+        pricendx_ames_agprod.loc[y] = val
+        val *= factor
+    pricendx_ames_agprod.sort_index(inplace=True)
+    return [realndx_ames_agsec, pricendx_ames_agprod]
+
+def vectorized_price_indices(crop_production, crop_prices, countries, weap_joint_crop_map, ames_joint_agsec_map, ames_joint_agprod_map):
+    """The current implementation, as called by weap_to_ames_processing()"""
+    categories = crop_production.index.get_level_values('crop').map(weap_joint_crop_map)
+    rows = crop_production.index.get_level_values('country').isin(countries) & categories.notna()
+    return crop_price_indices(crop_production.to_numpy(dtype = np.float64)[rows],
+                              crop_prices.reindex(crop_production.index).to_numpy(dtype = np.float64)[rows],
+                              crop_production.index.get_level_values('country')[rows],
+                              categories[rows],
+                              ames_joint_agsec_map, ames_joint_agprod_map,
+                              [int(y) for y in crop_production.columns])
+
+def best_time(f, repeat):
+    """Return [result of f(), shortest time of repeat calls in seconds]"""
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    return [result, min(times)]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark the crop price index calculation for AMES")
+    parser.add_argument("--countries", type = int, default = 5)
+    parser.add_argument("--crops", type = int, default = 100)
+    parser.add_argument("--years", type = int, default = 80)
+    parser.add_argument("--repeat", type = int, default = 5)
+    args = parser.parse_args()
+
+    production, prices, crop_map, agsec_map, agprod_map = synthetic_data(args.countries, args.crops, args.years)
+    countries = list(production.index.get_level_values('country').unique())
+    reference, t_reference = best_time(lambda: reference_price_indices(production, prices, countries, crop_map, agsec_map, agprod_map), args.repeat)
+    vectorized, t_vectorized = best_time(lambda: vectorized_price_indices(production, prices, countries, crop_map, agsec_map, agprod_map), args.repeat)
+
+    for name, a, b in zip(["Real output index", "Price index"], reference, vectorized):
+        if list(a.index) != list(b.index) or list(a.columns) != list(b.columns):
+            sys.exit("{n}: years or AMES names differ".format(n = name))
+        np.testing.assert_allclose(b.to_numpy(dtype = np.float64), a.to_numpy(dtype = np.float64), rtol = 1e-10, equal_nan = True, err_msg = name)
+        print("{n}: {r} years x {c} columns agree (largest relative difference {d:.2e})".format(
+            n = name, r = a.shape[0], c = a.shape[1], d = np.nanmax(np.abs(b.to_numpy(dtype = np.float64)/a.to_numpy(dtype = np.float64) - 1))))
+    print("{c} countries x {k} crops x {y} years, best of {n}:".format(c = args.countries, k = args.crops, y = args.years, n = args.repeat))
+    print("  previous implementation: {t:8.2f} ms".format(t = 1000 * t_reference))
+    print("  crop_price_indices():    {t:8.2f} ms ({s:.1f}x faster)".format(t = 1000 * t_vectorized, s = t_reference/t_vectorized))
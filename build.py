@@ -12,3 +12,4 @@ if os.path.exists('dist') and os.path.isdir('dist'):
     os.system('copy scenarios.yml dist')
     os.system('xcopy data dist\\data\\ /E')
     os.system('xcopy locale dist\\locale\\ /E')
+    os.system('xcopy scripts dist\\scripts\\ /E')
@@ -1,14 +1,16 @@
 import sys
-from errno import WSAEDQUOT
 from ntpath import altsep
-import win32com.client as win32
-import win32gui
+try:
+    import win32com.client as win32
+    import win32gui
+    from winreg import *
+except ImportError:
+    # LEAP and WEAP require Windows: elsewhere, only the simulated stand-ins can be used (see "Simulation" in config.yml)
+    win32 = None
 import yaml
 import time
-from winreg import *
 from calendar import monthrange
 import os # os.path, os.system
-from sys import float_info
 import psutil
 import numpy as np
 import re
@@ -17,8 +19,6 @@ import datetime
 import logging
 from collections import OrderedDict # Not necessary with Python 3.7+
 import xlsxwriter
-import csv
-import pandas as pd
 import gettext, locale, ctypes
 #import shutil
 #import zipfile
@@ -28,8 +28,10 @@ if os.environ.get('LANG') is not None:
     language = os.environ['LANG']
 elif os.environ.get('LANGUAGE') is not None:
     language = os.environ['LANGUAGE']
-else:
+elif hasattr(ctypes, 'windll'):
     language = locale.windows_locale[ctypes.windll.kernel32.GetUserDefaultUILanguage()]
+else:
+    language = 'en'
 if gettext.find('wave_integration', localedir='locale', languages=[language]) is not None:
     transl = gettext.translation('wave_integration', localedir='locale', languages=[language])
     transl.install()
@@ -39,8 +41,24 @@ _ = gettext.gettext
 
 # Load gettext and install translator before importing other local scripts
 from utils.julia import get_julia_path
-from utils.leap_weap import add_leap_data_to_weap_interp, get_leap_timeslice_info, export_leap_hpp_to_weap
-from utils.weap_ames import get_weap_ag_results, weap_to_ames_processing
+from utils.ames_worker import ames_runner
+from utils.ames_jobs import AmesJob, AmesJobPool
+from utils.ames_cache import AmesCache
+from utils.leap_weap import add_leap_data_to_weap_interp, get_leap_timeslice_info, export_leap_hpp_to_weap, index_leap_columns, read_leap_export_header, read_leap_export_chunks, LEAP_EXPORT_MEMORY_MB
+from utils.weap_ames import get_weap_ag_results, aggregate_weap_results, weap_to_ames_processing
+from utils.com_cache import CachedApp
+from utils.leap_capacity import LeapCapacityProvider
+from utils.weap_tags import WeapTagIndex
+from utils.weap_results import WeapResultsFetcher
+from utils.context_scheduler import ContextScheduler
+from utils.expression_sink import ExpressionSink
+from utils.com_profiler import ComProfiler
+from utils.convergence import ConvergenceEngine, DamConvergence
+from utils.acceleration import FixedPointAccelerator
+from utils.simulated_apps import simulated_apps, SimulatedShell
+from utils.com_recorder import ComRecorder, ComReplayer
+from utils.checkpoint import Checkpoint, CHECKPOINT_FILE
+from utils.warm_start import max_availability_fname, write_max_availabilities, read_max_availabilities, save_hpp_demand, load_hpp_demand
 
 #==================================================================================================#
 # Script for integrating WAVE WEAP and LEAP models.
@@ -79,6 +97,9 @@ def windowEnumerationHandler(hwnd, top_windows):
     top_windows.append((hwnd, win32gui.GetWindowText(hwnd)))
 
 def get_list_separator():
+    # The Windows registry is not available with simulated LEAP and WEAP on other platforms
+    if win32 is None:
+        return ","
     aReg = ConnectRegistry(None, HKEY_CURRENT_USER)
     aKey = OpenKey(aReg, r"Control Panel\International")
     val = QueryValueEx(aKey, "sList")[0]
@@ -200,7 +221,7 @@ def kill_excel():
             continue
 
 # Reopens the currently active WEAP area by temporarily activating another area, then re-activating the original area. This can
-#   work around a WEAP bug that causes weap.Branches calls to fail.
+#   work around a WEAP bug that causes weap.Branches calls to fail. If weap is a CachedApp, setting ActiveArea also clears its cached handles.
 def reopen_weap_area(weap):
     original_area_name = weap.ActiveArea.Name  # Name of WEAP area that was active when this function was called
     area_changed = False  # Indicates whether function changed active WEAP area
@@ -275,15 +296,53 @@ def main_integration():
                 restart_iteration = config_params['Integrated model']['Restart after iteration']
                 logging.info(_("Restarting from iteration : {i}").format(i = restart_iteration))
 
+    # Memory ceiling for reading large LEAP exports
+    leap_export_memory_mb = config_params['Integrated model'].get('LEAP export memory (MB)') or LEAP_EXPORT_MEMORY_MB
+
+    # Optionally record timings of calls to LEAP and WEAP
+    com_profiler = ComProfiler(config_params['Integrated model'].get('Profile COM calls', False) == True)
+    com_profiler.phase = "Initialize"
+
+    # Check whether LEAP and WEAP are replaced by a recording of an earlier run or by simulated stand-ins
+    record_file = config_params['Integrated model'].get('Record COM calls')
+    replay_file = config_params['Integrated model'].get('Replay COM calls')
+    using_simulation = 'Simulation' in config_params.keys()
+    if replay_file:
+        com_replayer = ComReplayer(replay_file, config_params['Integrated model'].get('Replay time scale', 1))
+        leap_app = com_replayer.app("LEAP")
+        weap_app = com_replayer.app("WEAP")
+        shell = SimulatedShell()
+    elif using_simulation:
+        leap_app, weap_app, shell = simulated_apps(config_params, scenarios)
+    elif win32 is None:
+        msg = _('LEAP and WEAP require Windows. To run the integration procedure without them, add a "Simulation" entry to config.yml or set "Replay COM calls". Exiting...')
+        logging.error(msg)
+        sys.exit(msg)
+    else:
+        leap_app = win32.Dispatch('LEAP.LEAPApplication') # will open Freedonia
+        weap_app = win32.Dispatch('WEAP.WEAPApplication') # will open last area
+        shell = win32.Dispatch("WScript.Shell")
+
+    # Optionally record calls to LEAP and WEAP so that this run can be replayed
+    if record_file:
+        com_recorder = ComRecorder(record_file)
+        leap_app = com_recorder.wrap(leap_app, "LEAP")
+        weap_app = com_recorder.wrap(weap_app, "WEAP")
+
     # Ensure both LEAP and WEAP are open
-    leap = win32.Dispatch('LEAP.LEAPApplication') # will open Freedonia
+    # Branch and Variable handles are cached to avoid repeated COM calls
+    leap = CachedApp(com_profiler.wrap(leap_app, "LEAP"), "LEAP")
     runfrom_app = "LEAP"
     leap.Visible = True
-    weap = win32.Dispatch('WEAP.WEAPApplication') # will open last area
+    weap = CachedApp(com_profiler.wrap(weap_app, "WEAP"), "WEAP")
     weap.Visible = True
     weap.Verbose = 0
     other_app = "WEAP"
     wait_apps(weap, leap)
+    # Expression writes and scenario/region switches are grouped to minimize context switches; unchanged expressions are not rewritten
+    expression_sink = ExpressionSink()
+    leap_writes = ContextScheduler(leap, "LEAP", True, expression_sink)
+    weap_writes = ContextScheduler(weap, "WEAP", False, expression_sink)
 
     if not leap or not weap:
         leap.CloseProgressBar()
@@ -300,7 +359,6 @@ def main_integration():
 
 
     # Bring LEAP to front to enable showing progress bar to increase chances of showing progress bar
-    shell = win32.Dispatch("WScript.Shell")
     shell.AppActivate("LEAP: ")
 
     # Check whether AMES is being run
@@ -316,20 +374,106 @@ def main_integration():
     logging.info(_('Maximum number of iterations: {i} ').format(i = max_iterations))
 
     if using_ames:
-        # get Julia install location path
+        ames_worker_setting = config_params['AMES'].get('Worker', True)
+        ames_stub = isinstance(ames_worker_setting, str) and ames_worker_setting.lower() == "stub"
+        # get Julia install location path (not needed if AMES runs are only recorded by a stub)
         juliapath = get_julia_path(shell)
-        if juliapath == None:
+        if juliapath == None and not ames_stub:
             leap.CloseProgressBar()
             msg = _('Could not locate the Julia executable. Try adding the path to the executable to the Windows PATH environment variable.')
             logging.error(msg)
             sys.exit(msg)
         # Get AMES models folder path and create it if it doesn't exist
-        amesmodelspath = os.path.normpath(os.path.join(leap.ActiveArea.Directory, "..\\..", config_params['AMES']['Folder']))
+        amesmodelspath = os.path.normpath(os.path.join(leap.ActiveArea.Directory, "..", "..", config_params['AMES']['Folder']))
         if not os.path.exists(amesmodelspath):
             os.makedirs(amesmodelspath)
+        # Output of each AMES run is saved in a log file
+        ameslogpath = os.path.join(amesmodelspath, "Logs")
+        if not os.path.exists(ameslogpath):
+            os.makedirs(ameslogpath)
+        # By default, AMES runs in a Julia worker started once for the whole integration run. Every AMES run loads results from and
+        # pushes results to the running LEAP instance, so runs cannot overlap: they are calculated one at a time, while the
+        # integration program goes on (e.g., exporting WEAP results for the next scenario)
+        ames = AmesJobPool(lambda: ames_runner(ames_worker_setting, juliapath), 1)
+        # Optionally keep the results of AMES runs, so that a run with the same inputs is not repeated (e.g., in a later integration run);
+        # runs recorded by the stub are never cached
+        ames_cache = AmesCache(os.path.join(amesmodelspath, "Cache"), 0 if ames_stub else config_params['AMES'].get('Cache size (MB)', 0))
+        # LEAP variables written by AMES, restored from the cache on a cache hit, and LEAP results loaded by AMES, which are part of the key of
+        # cached runs; both must be listed when the cache is used, since a cached run could otherwise leave LEAP with stale values
+        ames_leap_variables = config_params['AMES']['LEAP'].get('pushed_variables')
+        ames_leap_results = config_params['AMES']['LEAP'].get('loaded_results')
+        if ames_cache.enabled and (not ames_leap_variables or not ames_leap_results):
+            leap.CloseProgressBar()
+            msg = _('The cache of AMES results requires "pushed_variables" and "loaded_results" in the LEAP part of the AMES section of config.yml. Exiting...')
+            logging.error(msg)
+            sys.exit(msg)
+        # Expressions restored from the cache are not written through leap_writes: AMES changes them without the expression sink knowing
+        ames_leap_writes = ContextScheduler(leap, "LEAP", True)
+        # Runs found in the cache and runs to add to it, as [key, scenario, region, rinfo, log file]; handled in wait_for_ames()
+        ames_cache_hits = []
+        ames_cache_stores = []
+
+        # Read the LEAP results listed in loaded_results for scenario s in region r, as lists of values by year (for the key of cached AMES runs)
+        def read_ames_leap_results(s, r):
+            values = []
+            with ames_leap_writes:
+                ames_leap_writes.activate(scenario = s, region = leap_region_ids[r])
+                for entry in ames_leap_results:
+                    leap_var = leap.Branches(entry['path']).Variables(entry['variable'])
+                    values.append(None if leap_var is None else [leap_var.Value(y) for y in leap_calc_years])
+            return values
+
+        # Start AMES for scenario s in region r with command-line arguments args (after the scenario); exits if an earlier run failed.
+        # leap_results are the LEAP results loaded by AMES, as returned by read_ames_leap_results(), for runs with --load-leap-first
+        def submit_ames(s, r, rinfo, args, run_number, leap_results = None):
+            check_ames()
+            amesdir = os.path.join(amesmodelspath,  rinfo['directory_name'], rinfo['script'])
+            args = [s] + (["-i"] if rinfo['use_existing_input_files'] else []) + args
+            log_fname = os.path.join(ameslogpath, "{s}_{r}_run_{n}.log".format(s = s, r = r, n = run_number))
+            if ames_cache.enabled:
+                key = ames_cache.run_key(s, r, amesdir, args, list(leap_scenario_ids.keys()), leap_results)
+                if ames_cache.lookup(key):
+                    logging.info('\t' + _('AMES results for scenario {s} in region {r} found in the cache; AMES will not be run').format(s = s, r = r))
+                    ames_cache_hits.append([key, s, r, rinfo, log_fname])
+                    return
+                ames_cache_stores.append([key, s, r, rinfo, log_fname])
+            logging.info('\t' + _('Executing: {e}').format(e = " ".join(['"' + amesdir + '"'] + ['"' + a + '"' if ' ' in a else a for a in args])))
+            # runames.jl rewrites the configuration file in the region's folder, and AMES drives LEAP during the run
+            ames.submit(AmesJob(_('scenario {s}, region {r}').format(s = s, r = r), [rinfo['directory_name'], "LEAP"], amesdir, args, log_fname))
+
+        # Exit if an AMES run reported an error, once the runs still in progress have been stopped
+        def check_ames():
+            if ames.failure is not None:
+                wait_for_ames()
+
+        # Wait for the AMES runs started by submit_ames(); exits if AMES reports an error
+        def wait_for_ames():
+            job = ames.wait()
+            if job is not None:
+                leap.CloseProgressBar()
+                msg = _('AMES exited with an error')
+                logging.error(msg + ' (' + job.name + ')\n' + _('Output of AMES ({f}):').format(f = job.log_fname) + '\n' + job.output)
+                sys.exit(msg)
+            # LEAP is only read and written once no AMES run is using it
+            with ames_leap_writes:
+                for key, s, r, rinfo, log_fname in ames_cache_hits:
+                    output_dir = os.path.join(amesmodelspath, rinfo['directory_name'], s)
+                    for branch_path, variable, expression in ames_cache.restore(key, output_dir, log_fname):
+                        ames_leap_writes.set_expression(branch_path, variable, expression, scenario = s, region = leap_region_ids[r])
+                for key, s, r, rinfo, log_fname in ames_cache_stores:
+                    ames_leap_writes.activate(scenario = s, region = leap_region_ids[r])
+                    leap_expressions = []
+                    for e in ames_leap_variables:
+                        branch_path = config_params['LEAP']['Branches'][e]['path']
+                        variable = config_params['LEAP']['Branches'][e]['variable']
+                        leap_expressions.append([branch_path, variable, leap.Branches(branch_path).Variables(variable).Expression])
+                    ames_cache.store(key, os.path.join(amesmodelspath, rinfo['directory_name'], s), log_fname, leap_expressions)
+            ames_cache_hits.clear()
+            ames_cache_stores.clear()
+            ames_cache.forget_folders()
 
     # Get path for storing Excel files and create it if it doesn't exist
-    hydroexcelpath = os.path.normpath(os.path.join(leap.ActiveArea.Directory, "..\\..", config_params['LEAP']['Folder']))
+    hydroexcelpath = os.path.normpath(os.path.join(leap.ActiveArea.Directory, "..", "..", config_params['LEAP']['Folder']))
     if not os.path.exists(hydroexcelpath):
         os.makedirs(hydroexcelpath)
 
@@ -340,6 +484,8 @@ def main_integration():
     
     # Clear any filters that might have been applied
     weap.Filter = ""
+    # Tagged catchments and demand sites for the water pumping transfer; rebuilt whenever the WEAP area is reopened
+    weap_tags = WeapTagIndex(weap, config_params)
 
     leap_ts_info = get_leap_timeslice_info(leap, config_params['LEAP']['Months'])
     leap_region_ids = get_leap_region_ids(leap)
@@ -394,6 +540,15 @@ def main_integration():
         logging.info('\t' + b)
         check_branch_var(leap, entry['leap_path'], "Maximum Availability", "Percent")
 
+    # validate LEAP results loaded by AMES, which are read for the cache of AMES results
+    if using_ames and ames_cache.enabled:
+        for entry in ames_leap_results:
+            if not (leap.Branches.Exists(entry['path']) and leap.Branches(entry['path']).VariableExists(entry['variable'])):
+                leap.CloseProgressBar()
+                msg = _('The active LEAP area does not contain the variable {b}:{v} listed in "loaded_results" for AMES. Please check the area and try again. Exiting...').format(b = entry['path'], v = entry['variable'])
+                logging.error(msg)
+                sys.exit(msg)
+
     # validate hydropower reservoirs in WEAP
     logging.info(_('Including WEAP hydropower reservoirs:'))
     for b, entry in config_params['WEAP']['Hydropower_plants']['dams'].items() :
@@ -491,22 +646,71 @@ def main_integration():
     # Align LEAP and WEAP End-years
     weap.EndYear = leap_calc_years[-1]
 
+    # Resume from the checkpoint of an interrupted run of the same models, if there is one
+    checkpoint_key = {
+        'LEAP area': config_params['LEAP']['Area'],
+        'WEAP area': config_params['WEAP']['Area'],
+        'LEAP plants': list(config_params['LEAP']['Hydropower_plants']['plants'].keys()),
+        'WEAP dams': list(config_params['WEAP']['Hydropower_plants']['dams'].keys()),
+        'LEAP years': list(leap_calc_years),
+        'WEAP years': [weap.BaseYear, weap.EndYear],
+        'AMES': config_params['AMES']['LEAP']['target_variables'] + list(config_params['AMES']['Regions'].keys()) if using_ames else None,
+    }
+    checkpoint = Checkpoint(os.path.join(hydroexcelpath, CHECKPOINT_FILE), checkpoint_key, config_params['Integrated model'].get('Checkpoint', True) != False)
+    resume_state = checkpoint.load()
+    if resume_state is not None and not set(scenarios_map.items()) <= set(resume_state['all_scenarios_map'].items()):
+        logging.warning(_('Checkpoint {f} was written for other scenarios; starting a new run').format(f = checkpoint.fname))
+        checkpoint.resume_position = None
+        resume_state = None
+    if resume_state is not None:
+        logging.info(_('Resuming interrupted run from checkpoint {f}: {p}').format(f = checkpoint.fname, p = checkpoint.describe()))
+        restart = resume_state['restart']
+        restart_iteration = resume_state['restart_iteration']
+        # Scenarios that converged before the run was interrupted stay hidden
+        scenarios_map = dict(resume_state['scenarios_map'])
+        for sl, sw in resume_state['all_scenarios_map'].items():
+            leap.Scenarios(sl).ResultsShown = sl in scenarios_map
+            weap.Scenarios(sw).ResultsShown = sl in scenarios_map
+        leap_scenarios = list(scenarios_map.keys())
+        weap_scenarios = list(scenarios_map.values())
+    # Number of completed iterations when the iteration loop starts
+    first_iteration = restart_iteration if restart else 0
+
+    # Last maximum availabilities written to LEAP, by LEAP scenario and (plant, month), and last hydropower energy demand file read by WEAP, by WEAP scenario;
+    # saved at the end of the run for warm starts of later runs
+    max_availabilities = {} if resume_state is None else resume_state['max_availabilities']
+    hpp_demand_files = {} if resume_state is None else resume_state['hpp_demand_files']
+    # A resumed run keeps the identifier of the interrupted run in version comments, which AMES uses to load LEAP results
+    version_run_id = run_uuid if resume_state is None else resume_state['run_id']
+
+    # Optionally start from the values passed between LEAP and WEAP at the end of an earlier run
+    warm_start_path = config_params['Integrated model'].get('Warm start from')
+    if warm_start_path and not os.path.isdir(warm_start_path):
+        leap.CloseProgressBar()
+        msg = _('Folder "{f}" given in "Warm start from" does not exist. Exiting...').format(f = warm_start_path)
+        logging.error(msg)
+        sys.exit(msg)
 
     # if not restarting, clear hydropower reservoir energy demand from WEAP scenarios
-    if restart is None:
-        # Clearing hydropower reservoir energy demand from WEAP scenarios 
+    if checkpoint.completed(first_iteration, "Prepare"):
+        logging.info(_('RESUME: Keeping the hydropower reservoir energy demand and maximum availabilities set before the run was interrupted.'))
+    elif restart is None:
+        # Clearing hydropower reservoir energy demand from WEAP scenarios, unless an earlier run saved it for a warm start
         logging.info(_('Clearing hydropower reservoir energy demand from WEAP scenarios to avoid forcing model with results from past integration runs.'))
         weap_hydro_branches = config_params['WEAP']['Hydropower_plants']['dams'].keys()
-        for s in weap_scenarios:
-            weap.ActiveScenario = s
-            for wb in weap_hydro_branches:
-                weap_path = config_params['WEAP']['Hydropower_plants']['dams'][wb]['weap_path']
-                if not 'Run of River' in weap_path:
-                    try:
-                        weap.Branch(weap_path).Variable('Energy Demand').Expression = ""
-                    except AttributeError as e:
-                        msg = _('For branch "{b}" encountered the following error: {e}').format(b = weap_path, e = str(e))
-                        logging.warning(msg)
+        weap_folder_path = os.path.normpath(os.path.join(weap.ActiveArea.Directory, config_params['WEAP']['Folder']))
+        with weap_writes:
+            for s in weap_scenarios:
+                warm_start = load_hpp_demand(warm_start_path, s, weap_folder_path) if warm_start_path else None
+                if warm_start is not None:
+                    hpp_demand_files[s] = os.path.join(weap_folder_path, warm_start[0])
+                for wb in weap_hydro_branches:
+                    weap_path = config_params['WEAP']['Hydropower_plants']['dams'][wb]['weap_path']
+                    if not 'Run of River' in weap_path:
+                        if warm_start is not None and wb in warm_start[1]:
+                            weap_writes.set_expression(weap_path, 'Energy Demand', "ReadFromFile(\"" + os.path.join(config_params['WEAP']['Folder'], warm_start[0]) + "\", \"" + wb + "\")", scenario = s)
+                        else:
+                            weap_writes.set_expression(weap_path, 'Energy Demand', "", scenario = s)
     # check that Maximum Avaiability variable in LEAP points to monthly availability variables
     else : 
         logging.info(_('RESTART: Ensuring "Maximum Availability"-variable in LEAP points to user variables containing monthly estimates from WEAP.'))
@@ -537,31 +741,22 @@ def main_integration():
                         sys.exit(msg)
 
     # Initial AMES run, to provide macroeconomic variables to LEAP
-    if using_ames:
+    if using_ames and not checkpoint.completed(first_iteration, "Prepare"):
         for s in leap_scenarios:
             logging.info(_('Running AMES for scenario: {s}').format(s = s))
             for r, rinfo in config_params['AMES']['Regions'].items():
                 logging.info('\t' + _('Region: {r}').format(r = r))
-                if rinfo['use_existing_input_files']:
-                    i_flag = "-i"
-                else:
-                    i_flag = ""
-                amesdir = os.path.join(amesmodelspath,  rinfo['directory_name'], rinfo['script'])
-                exec_string = juliapath + " \"" + amesdir + "\" \"" + s + "\" " + i_flag + " -c -p -v -y " + str(leap_calc_years[-1])
-                logging.info('\t' + _('Executing: {e}').format(e = exec_string))
-                errorcode= os.system(exec_string)
-                if errorcode != 0:
-                    leap.CloseProgressBar()
-                    msg = _('AMES exited with an error')
-                    logging.error(msg)
-                    sys.exit(msg)
+                submit_ames(s, r, rinfo, ["-c", "-p", "-v", "-y", str(leap_calc_years[-1])], 0)
+        wait_for_ames()
 
     #------------------------------------------------------------------------------------------------------------------------
     #
     # Start iterations
     #
     #------------------------------------------------------------------------------------------------------------------------
-    if restart :
+    if resume_state is not None:
+        completed_iterations = checkpoint.resume_position[0]
+    elif restart :
         completed_iterations = restart_iteration
         logging.info(_("Restarting from iteration : {i}").format(i = completed_iterations))
     else :
@@ -569,416 +764,483 @@ def main_integration():
     results_converged = False
     
     # This only needs to be evaluated once
-    weap_pump_var = ":" + config_params['WEAP']['Water pumping']['variable'] + "[" + config_params['WEAP']['Water pumping']['unit'] + "]"
+    weap_pump_variable = config_params['WEAP']['Water pumping']['variable']
+    weap_pump_unit = config_params['WEAP']['Water pumping']['unit']
 
     # Initialize target results for convergence checks during iterative calculations, by scenario
     target_leap_results = list(config_params['LEAP']['Hydropower_plants']['plants'].keys())
     target_weap_results = list(config_params['WEAP']['Hydropower_plants']['dams'].keys())
     if using_ames:
         target_ames_results = config_params['AMES']['LEAP']['target_variables']
+    # Target results are compared between successive iterations by ConvergenceEngine, keyed by LEAP scenario (WEAP scenario for WEAP results)
+    top_n_deviations = config_params['Integrated model'].get('Largest deviations reported')
+    if top_n_deviations is None:
+        top_n_deviations = 5
+    if isinstance(top_n_deviations, bool) or not isinstance(top_n_deviations, int) or top_n_deviations < 0:
+        leap.CloseProgressBar()
+        msg = _('"Largest deviations reported" in config.yml must be a whole number, at least 0 (received {n}). Exiting...').format(n = top_n_deviations)
+        logging.error(msg)
+        sys.exit(msg)
+    leap_convergence = ConvergenceEngine([target_leap_results, leap_calc_years], tolerance, top_n_deviations, ['Plant', 'Year'])
+    weap_convergence = ConvergenceEngine([target_weap_results, list(range(weap.BaseYear, weap.EndYear + 1))], tolerance, top_n_deviations, ['Dam', 'Year'])
+    if using_ames:
+        ames_convergence = ConvergenceEngine([target_ames_results, list(config_params['AMES']['Regions'].keys()), leap_calc_years], tolerance, top_n_deviations, ['Variable', 'Region', 'Year'])
+    # Scenarios calculated at the start of the run; converged scenarios are taken out of the calculation sets, and put back at the end
+    all_scenarios_map = dict(scenarios_map)
+    # Dams whose exchanges between LEAP and WEAP have converged are frozen within each scenario
+    dam_convergence = DamConvergence(tolerance, config_params['Integrated model'].get('Freeze converged dams', True) != False)
+    # Optional acceleration of the values passed between LEAP and WEAP (maximum availabilities and hydropower energy demand)
+    accelerator = FixedPointAccelerator(config_params['Integrated model'].get('Acceleration'), config_params['Integrated model'].get('Acceleration memory') or 2)
+    # Generation potentials of hydropower dams by WEAP scenario, calculated when moving availabilities from WEAP to LEAP
+    weap_branch_generation_potential = {}
+    # Capacities of LEAP hydropower plants, fetched from LEAP once per scenario and year for the whole run
+    leap_capacity = LeapCapacityProvider(leap, config_params, leap_region_ids, leap.BaseYear, leap.EndYear)
+
+    # With a warm start, the final results of the earlier run take the place of the results of the iteration before the first one
+    if warm_start_path and resume_state is None and restart is None:
+        engines = [[leap_convergence, "LEAP_final_results.csv", leap_scenarios], [weap_convergence, "WEAP_final_results.csv", weap_scenarios]]
+        if using_ames:
+            engines.append([ames_convergence, "AMES_final_results.csv", leap_scenarios])
+        for engine, fname, engine_scenarios in engines:
+            if os.path.isfile(os.path.join(warm_start_path, fname)):
+                read = engine.read_csv(os.path.join(warm_start_path, fname), engine_scenarios)
+                logging.info('\t' + _('Warm start: results for comparison with the first iteration read from {f} for scenario(s): {s}').format(f = os.path.join(warm_start_path, fname), s = ", ".join(read)))
+        # Maximum availabilities written at the end of the earlier run are only used as the values last written for acceleration: they would be
+        # replaced by the values calculated from WEAP results before LEAP is calculated
+        if accelerator.enabled:
+            for sl in leap_scenarios:
+                warm_start = read_max_availabilities(max_availability_fname(warm_start_path, sl))
+                if warm_start is None: continue
+                years, series = warm_start
+                if years != list(range(weap.BaseYear, weap.EndYear + 1)):
+                    logging.info('\t' + _('Warm start: maximum availabilities in {f} are for other years; not used for acceleration').format(f = max_availability_fname(warm_start_path, sl)))
+                    continue
+                for (lb, month), values in series.items():
+                    accelerator.seed(("MaxAvail", sl, lb, month), values)
+                logging.info('\t' + _('Warm start: maximum availabilities for LEAP scenario {s} read from {f} for acceleration').format(s = sl, f = max_availability_fname(warm_start_path, sl)))
+
+    if resume_state is not None:
+        all_scenarios_map = dict(resume_state['all_scenarios_map'])
+        results_converged = resume_state['results_converged']
+        leap_convergence.restore(resume_state['leap_convergence'])
+        weap_convergence.restore(resume_state['weap_convergence'])
+        if using_ames: ames_convergence.restore(resume_state['ames_convergence'])
+        weap_branch_generation_potential = resume_state['weap_branch_generation_potential']
+        dam_convergence.restore(resume_state['dam_convergence'])
+        accelerator.restore(resume_state['accelerator'])
+        expression_sink.restore(resume_state['expressions'])
+
+    # Save the LEAP and WEAP areas (unless just saved) and write a checkpoint after completing phase in the pass through the iteration loop starting after iteration
+    def save_checkpoint(iteration, phase, save_areas = True):
+        if not checkpoint.enabled:
+            return
+        if save_areas:
+            leap.SaveArea()
+            weap.SaveArea()
+        checkpoint.save(iteration, phase, {
+            'restart': restart,
+            'restart_iteration': restart_iteration if restart else None,
+            'scenarios_map': scenarios_map,
+            'all_scenarios_map': all_scenarios_map,
+            'results_converged': results_converged,
+            'leap_convergence': leap_convergence.state(),
+            'weap_convergence': weap_convergence.state(),
+            'ames_convergence': ames_convergence.state() if using_ames else None,
+            'weap_branch_generation_potential': weap_branch_generation_potential,
+            'dam_convergence': dam_convergence.state(),
+            'accelerator': accelerator.state(),
+            'expressions': expression_sink.state(),
+            'max_availabilities': max_availabilities,
+            'hpp_demand_files': hpp_demand_files,
+            'run_id': version_run_id,
+        })
+
+    if not checkpoint.completed(first_iteration, "Prepare"):
+        save_checkpoint(first_iteration, "Prepare")
 
     while completed_iterations <= max_iterations :
         logging.info(_("Completed iterations: {i}").format(i = completed_iterations))
+        accelerator.start_iteration(completed_iterations)
+        dam_convergence.start_iteration(completed_iterations)
+        # Cached COM handles are only kept for the lifetime of an iteration
+        leap.invalidate()
+        weap.invalidate()
         #------------------------------------------------------------------------------------------------------------------------
         # Push demographic and macroeconomic key assumptions from LEAP to WEAP
         #------------------------------------------------------------------------------------------------------------------------
         # dont bother pushing demographic and macroeconomic info again, unless AMES is running and they are getting updated
-        if not using_ames and completed_iterations >= (restart_iteration-1 if restart else 1):
+        if checkpoint.completed(completed_iterations, "Push LEAP drivers to WEAP"):
+            logging.info(_('RESUME: Demographic and macroeconomic assumptions were moved from LEAP to WEAP before the run was interrupted.'))
+        elif not using_ames and completed_iterations >= (restart_iteration-1 if restart else 1):
             logging.info(_("This is not a first iteration and AMES is not being used, skipping moving demographic and macroeconomic assumptions from LEAP to WEAP as they have not changed."))
         else :
+            com_profiler.phase = "Push LEAP drivers to WEAP"
             msg = _('Moving demographic and macroeconomic assumptions from LEAP to WEAP (iteration {i})').format(i = completed_iterations+1)
             leap.ShowProgressBar(procedure_title, "".join(msg))
             leap.SetProgressBar(20)
             # Values from LEAP base year to end year are embedded in WEAP Interp expressions
             count = 0
             logging.info(_('Pushing demographic and macroeconomic drivers from LEAP to WEAP'))
-            for k in config_params['WEAP']['Branches'].keys():
-                logging.info('\t' + k)
-                leap_path = config_params['LEAP']['Branches'][config_params['WEAP']['Branches'][k]['leap_branch']]['path']
-                leap_variable = config_params['LEAP']['Branches'][config_params['WEAP']['Branches'][k]['leap_branch']]['variable']
-                leap_region = config_params['WEAP']['Branches'][k]['leap_region']
-                if config_params['WEAP']['Branches'][k]['leap_branch'] == 'Population':
-                    unit_multiplier = 1
-                elif config_params['WEAP']['Branches'][k]['leap_branch'] == 'GDP':
-                    unit_multiplier = 1e-9
-                elif config_params['WEAP']['Branches'][k]['leap_branch'] == 'Industrial_VA_fraction':
-                    unit_multiplier = 100
-                else:
-                    leap.CloseProgressBar()
-                    msg = _('Unit multiplier for variable "{v}" is unknown. Exiting...').format(v = leap_variable)
-                    logging.error(msg)
-                    sys.exit(msg)
-                add_leap_data_to_weap_interp(weap, leap, weap_scenarios, leap_scenarios, config_params['WEAP']['Branches'][k]['path'], config_params['WEAP']['Branches'][k]['variable'],  leap_path, leap_variable, leap_region, unit_multiplier, LIST_SEPARATOR)
+            with weap_writes, leap_writes:
+                for k in config_params['WEAP']['Branches'].keys():
+                    logging.info('\t' + k)
+                    leap_path = config_params['LEAP']['Branches'][config_params['WEAP']['Branches'][k]['leap_branch']]['path']
+                    leap_variable = config_params['LEAP']['Branches'][config_params['WEAP']['Branches'][k]['leap_branch']]['variable']
+                    leap_region = config_params['WEAP']['Branches'][k]['leap_region']
+                    if config_params['WEAP']['Branches'][k]['leap_branch'] == 'Population':
+                        unit_multiplier = 1
+                    elif config_params['WEAP']['Branches'][k]['leap_branch'] == 'GDP':
+                        unit_multiplier = 1e-9
+                    elif config_params['WEAP']['Branches'][k]['leap_branch'] == 'Industrial_VA_fraction':
+                        unit_multiplier = 100
+                    else:
+                        leap.CloseProgressBar()
+                        msg = _('Unit multiplier for variable "{v}" is unknown. Exiting...').format(v = leap_variable)
+                        logging.error(msg)
+                        sys.exit(msg)
+                    add_leap_data_to_weap_interp(weap, leap, weap_scenarios, leap_scenarios, config_params['WEAP']['Branches'][k]['path'], config_params['WEAP']['Branches'][k]['variable'],  leap_path, leap_variable, leap_region, unit_multiplier, LIST_SEPARATOR, weap_writes, leap_writes)
 
-                count += 1
+                    count += 1
             
             logging.info(_('Pushed {n} variable(s) to WEAP').format(n = count))
+            save_checkpoint(completed_iterations, "Push LEAP drivers to WEAP")
             
         #------------------------------------------------------------------------------------------------------------------------
         # Calculate WEAP
         #------------------------------------------------------------------------------------------------------------------------
-        msg = _('Calculating WEAP (iteration {i})').format(i = completed_iterations+1)
-        leap.ShowProgressBar(procedure_title, msg)
-        leap.SetProgressBar(30)
-
-        logging.info(_('Calculating WEAP (iteration {i})').format(i = completed_iterations + 1))
-        weap.Calculate(0, 0, False, False, int(os.cpu_count() / 2)) # Only calculate what needs calculation; use parallel calculations with NumWorkers = 1/2 # of logical processors
-        while weap.IsCalculating :
-           leap.Sleep(1000)
-
-        all_weap_scenarios_calculated = True  # Indicates whether all scenarios in weap_scenarios successfully calculated
-
-        for s in weap_scenarios:
-            if weap.Scenarios(s).NeedsCalculation:
-                all_weap_scenarios_calculated = False
-                break
+        if not checkpoint.completed(completed_iterations, "Calculate WEAP"):
+            com_profiler.phase = "Calculate WEAP"
+            msg = _('Calculating WEAP (iteration {i})').format(i = completed_iterations+1)
+            leap.ShowProgressBar(procedure_title, msg)
+            leap.SetProgressBar(30)
 
-        if not all_weap_scenarios_calculated:
-            logging.info(('Some WEAP scenarios did not calculate successfully. Recalculating all scenarios...'))
-            weap.Calculate(0, 0, True, False, int(os.cpu_count() / 2)) # Force calculation of all scenarios; use parallel calculations with NumWorkers = 1/2 # of logical processors
+            logging.info(_('Calculating WEAP (iteration {i})').format(i = completed_iterations + 1))
+            weap.Calculate(0, 0, False, False, int(os.cpu_count() / 2)) # Only calculate what needs calculation; use parallel calculations with NumWorkers = 1/2 # of logical processors
             while weap.IsCalculating :
-                leap.Sleep(1000)
+               leap.Sleep(1000)
 
-            all_weap_scenarios_calculated = True
+            all_weap_scenarios_calculated = True  # Indicates whether all scenarios in weap_scenarios successfully calculated
 
             for s in weap_scenarios:
                 if weap.Scenarios(s).NeedsCalculation:
                     all_weap_scenarios_calculated = False
                     break
-            
+
             if not all_weap_scenarios_calculated:
-                leap.CloseProgressBar()
-                msg = "Could not get all WEAP scenarios to calculate despite running calculations twice. Exiting..."
-                logging.error(msg)
-                sys.exit(msg)
+                logging.info(('Some WEAP scenarios did not calculate successfully. Recalculating all scenarios...'))
+                weap.Calculate(0, 0, True, False, int(os.cpu_count() / 2)) # Force calculation of all scenarios; use parallel calculations with NumWorkers = 1/2 # of logical processors
+                while weap.IsCalculating :
+                    leap.Sleep(1000)
 
-        logging.info(('Finished calculating WEAP. Moving hydropower maximum availabilities from WEAP to LEAP....'))
+                all_weap_scenarios_calculated = True
 
-        #------------------------------------------------------------------------------------------------------------------------
-        # Move hydropower availability information from WEAP to LEAP.
-        #------------------------------------------------------------------------------------------------------------------------
-        # Availability information saved to Excel files specific to WEAP branches and LEAP scenarios.
-        #   Note: Excel used since LEAP's performance is extremely poor when reading from text files.
-        msg = _('Moving hydropower availability from WEAP to LEAP (iteration {i})').format(i = completed_iterations+1)
-        leap.ShowProgressBar(procedure_title, msg)
-        leap.SetProgressBar(40)
-        
-        weap_hydro_branches = config_params['WEAP']['Hydropower_plants']['dams'].keys()
-        # Initialize the nested dictionary to store results if this is the first iteration (else old generation potentials will be referenced)
-        if restart is None:
-            if completed_iterations == 0 :
-                weap_branch_generation_potential = {}
-        else:
-            if completed_iterations == restart_iteration:
-                weap_branch_generation_potential = {}
-    
-        for i in range(0, len(weap_scenarios)):
-            logging.info(_('WEAP scenario: {s}').format(s = weap_scenarios[i]))
-            leap_scenario_id = leap_scenario_ids[leap_scenarios[i]]
-            scenario = weap_scenarios[i]
-            # Make sure we are in the correct scenario
-            leap.ActiveScenario = leap_scenario_id
-            leap_base_year = leap.BaseYear
-            leap_end_year = leap.EndYear
-        
-            # Add nested dictionary to store weap_branch_generation_potential for this scenario branch 
-            if scenario not in weap_branch_generation_potential:
-                weap_branch_generation_potential[scenario] = {}
-
-            for wb in weap_hydro_branches:
-                logging.info('\t' + _('WEAP hydropower reservoir: {r}').format(r = wb))
-                weap_hpp = weap.Branches(config_params['WEAP']['Hydropower_plants']['dams'][wb]['weap_path'])
-                # It is possible that the plant does not appear in this scenario
-                if weap_hpp is None: continue
-                #add nested dictionary to store weap_branch_generation_potential for this weap branch
-                if wb not in (weap_branch_generation_potential[scenario]):
-                    weap_branch_generation_potential[scenario][wb] = {}
-                # check unit in weap
-                weap_unit= weap_hpp.Variables('Hydropower Generation').Unit
-                if not weap_unit == 'GJ':
-                    leap.CloseProgressBar()
-                    msg = _('Energy Generation in WEAP has to be in Gigajoules. Exiting...')
-                    logging.error(msg)
-                    sys.exit(msg)
-
-                #  pull weap values from weap baseyear to endyear,and remove first item)
-                weap_hpp_gen = weap_hpp.Variables('Hydropower Generation').ResultValues(weap.BaseYear, weap.EndYear, weap_scenarios[i])[1:]
-                if not len(weap_hpp_gen)%12 == 0:
+                for s in weap_scenarios:
+                    if weap.Scenarios(s).NeedsCalculation:
+                        all_weap_scenarios_calculated = False
+                        break
+            
+                if not all_weap_scenarios_calculated:
                     leap.CloseProgressBar()
-                    msg = _('Energy generation in WEAP is not monthly or not available for every simulation month. Exiting...')
+                    msg = "Could not get all WEAP scenarios to calculate despite running calculations twice. Exiting..."
                     logging.error(msg)
                     sys.exit(msg)
 
-                y_range = range(weap.BaseYear, weap.EndYear+1)
-                weap_branch_generation_potential[scenario][wb] = [0, ] * len(y_range) * 12 # empty vector of len number of years x months per year
-                yi=0   
-                for y in y_range:
-                    # ------- Begin extra debug logging ------------------------------------------------------------------------------------------------------#
-                    #logging.info(_('Year: {y}').format(y = y))
-                    # ------- End extra debug logging ------------------------------------------------------------------------------------------------------#
-                    leap_capacity_year = y
-                    if leap_base_year > y :
-                        leap_capacity_year = leap_base_year
-                    if leap_end_year < y :
-                        leap_capacity_year = leap_end_year
-                    weap_branch_capacity = 0  # Capacity in LEAP corresponding to WEAP branch [MW]
-                    leap_hpps = config_params['WEAP']['Hydropower_plants']['dams'][wb]['leap_hpps'] 
-                    for lb in leap_hpps: # there might be multiple corresponding to this WEAP HPP
-                        leap_path = config_params['LEAP']['Hydropower_plants']['plants'][lb]['leap_path']
-                        #logging.info(_('Max Avail calculated for: {y}').format(y = leap_path))
-                        leap_region = config_params['LEAP']['Hydropower_plants']['plants'][lb]['leap_region']
-                        leap_region_id = leap_region_ids[leap_region]
-                        # TODO: Find the unit using Variable.DataUnitID, convert using Unit.ConversionFactor; set a target unit and store its conversion factor
-                        # Can't specify unit when querying data variables, but unit for Exogenous Capacity is MW
-                        # Find capacity for that branch and year
-                        # Check whether branch "Minimum Capacity" exists (only available in optimized scenarios). Use exogenous capacity when not available
-                        if leap.Branches(leap_path).Variable("Minimum Capacity") is not None:
-                            leap_exog_capacity = leap.Branches(leap_path).Variable("Exogenous Capacity").ValueR(leap_region_id, leap_capacity_year, "", "")
-                            leap_minimum_capacity = leap.Branches(leap_path).Variable("Minimum Capacity").ValueR(leap_region_id, leap_capacity_year, "", "")
-                            weap_branch_capacity += max(leap_exog_capacity, leap_minimum_capacity)
-                        else:
-                            leap_exog_capacity = leap.Branches(leap_path).Variable("Exogenous Capacity").ValueR(leap_region_id, leap_capacity_year, "", "")
-                            weap_branch_capacity +=leap_exog_capacity 
-                        # ------- Begin extra debug logging ------------------------------------------------------------------------------------------------------#
-                        #logging.info(_('{year} WEAP branch capacity for {hpp}: {y} MW').format(year=y, hpp=lb, y = weap_branch_capacity))    
-                        # ------- End extra debug logging --------------------------------------------------------------------------------------------------------#        
-
-                    # Calculate monthly generation potential for this scenario and store for future iterations (units MWh)
-                    # Note : should be made flexible to different time slice set up on the LEAP side at some point - at the moment expects monthly timeslices
-                    for r in range(1,12+1):
-                        #logging.info(_('WEAP branch capacity across cascade: {y}').format(y = weap_branch_capacity))     
-                        if weap_branch_capacity > 0 :
-                            weap_branch_generation_potential[scenario][wb][yi] = weap_branch_capacity * monthrange(y, r)[1] * 24
-                            yi = yi+1
-                        else: 
-                            weap_branch_generation_potential[scenario][wb][yi] = 0.000001 #set to very small number to avoid divison by 0 error
-                            yi = yi+1
-
-                #Dont bother writing Maximum Availability if capacity is 0 in all years
-                if sum(weap_branch_generation_potential[scenario][wb]) == 0: 
-                    logging.info(_('WEAP branch {s} has generation potential 0. Not writing maximimum availabilities').format(s = wb)) 
-                    continue
-                
-                # Now iterate over leap HPPs again and add capacity
-                for lb in leap_hpps: # there might be multiple corresponding to this WEAP HPP
-                    leap_path = config_params['LEAP']['Hydropower_plants']['plants'][lb]['leap_path']
-                    leap_region = config_params['LEAP']['Hydropower_plants']['plants'][lb]['leap_region']
-                    leap_region_id = leap_region_ids[leap_region]
-                    
-                    # Make sure we are in the correct region 
-                    if leap.ActiveRegion != leap_region:
-                        leap.ActiveRegion = leap_region
+            logging.info(('Finished calculating WEAP. Moving hydropower maximum availabilities from WEAP to LEAP....'))
+            save_checkpoint(completed_iterations, "Calculate WEAP")
 
-                    if leap.Branches(leap_path).Variable("Minimum Capacity") is None: 
-                        if leap.Branches(leap_path).Variable("Exogenous Capacity").Expression == "0": continue
+        # WEAP results for the pumping transfer and the convergence check, fetched as full-horizon series
+        weap_results = WeapResultsFetcher(weap, weap.BaseYear, weap.EndYear)
 
-                    # check that for this region and scenario HPP maximum availability points to monthly user variables of Maximum Availabilities
-                    if restart is None:
-                        if completed_iterations == 0 :
-                            if leap.Branches(leap_path).Variable("Maximum Availability").ExpressionRS(leap_region, leap_scenarios[i]) != SeasonalValue_expression :
-                                logging.info(('Updating "Maximum Availability"-variable for this power plant to use SeasonalValue()-function to point to user variables'))
-                                leap.Branches(leap_path).Variable("Maximum Availability").Expression = SeasonalValue_expression
-                    #else : 
-                    #     if completed_iterations == restart_iteration:
-                    #        if leap.Branches(leap_path).Variable("Maximum Availability").ExpressionRS(leap_region, leap_scenarios[i]) != SeasonalValue_expression :
-                    #            logging.info(('Updating "Maximum Availability"-variable for this power plant to use SeasonalValue()-function to point to user variables'))
-                    #            leap.Branches(leap_path).Variable("Maximum Availability").Expression = SeasonalValue_expression
-
-                    # calculate maximum availability for each series of monthly values   
-                    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-                    years =  list(range(weap.BaseYear, weap.EndYear + 1))
-                    for m in range(0, len(months)): 
-                        # write values into monthly user variables for maximum availability
-                        uservariable_this_month = "MaxAvail_" + months[m]
-
-                        # Extract values for this particular month
-                        weap_hpp_gen_this_month = list(weap_hpp_gen[m::12])
-                        weap_branch_capacity_this_month = weap_branch_generation_potential[scenario][wb][m::12] # maximum generation at full utilization
-                        # ------- Begin extra debug logging ------------------------------------------------------------------------------------------------------#
-                        #logging.info(_('Month: {y}').format(y =  months[m])) 
-                        #logging.info(_('WEAP branch actual generation [GJ]: {y}').format(y =  weap_hpp_gen_this_month)) 
-                        #logging.info(_('WEAP branch generation potential at capacity [MWh]: {y}').format(y =  weap_branch_capacity_this_month))   
-                        # ------- End extra debug logging --------------------------------------------------------------------------------------------------------#
-                        
-                        # dont bother writing maximum availabilities, if capacity in month m is 0 in every year
-                        if sum(weap_branch_capacity_this_month)==0 : 
-                            logging.info(_('Month {s} has generation potential 0. Not writing maximimum availabilities.').format(s = months[m])) 
+        #------------------------------------------------------------------------------------------------------------------------
+        # Move hydropower availability information from WEAP to LEAP.
+        #------------------------------------------------------------------------------------------------------------------------
+        # Availability information saved to Excel files specific to WEAP branches and LEAP scenarios.
+        #   Note: Excel used since LEAP's performance is extremely poor when reading from text files.
+        if not checkpoint.completed(completed_iterations, "WEAP to LEAP availability"):
+            com_profiler.phase = "WEAP to LEAP availability"
+            msg = _('Moving hydropower availability from WEAP to LEAP (iteration {i})').format(i = completed_iterations+1)
+            leap.ShowProgressBar(procedure_title, msg)
+            leap.SetProgressBar(40)
+        
+            weap_hydro_branches = config_params['WEAP']['Hydropower_plants']['dams'].keys()
+
+            with leap_writes:
+                for i in range(0, len(weap_scenarios)):
+                    logging.info(_('WEAP scenario: {s}').format(s = weap_scenarios[i]))
+                    leap_scenario_id = leap_scenario_ids[leap_scenarios[i]]
+                    scenario = weap_scenarios[i]
+                    # Make sure we are in the correct scenario
+                    leap_writes.activate(scenario = leap_scenario_id)
+            
+                    # Add nested dictionary to store weap_branch_generation_potential for this scenario branch 
+                    if scenario not in weap_branch_generation_potential:
+                        weap_branch_generation_potential[scenario] = {}
+
+                    for wb in weap_hydro_branches:
+                        # Maximum availabilities are left as they are for dams that have converged
+                        if dam_convergence.is_frozen(leap_scenarios[i], wb): continue
+                        logging.info('\t' + _('WEAP hydropower reservoir: {r}').format(r = wb))
+                        weap_hpp = weap.Branches(config_params['WEAP']['Hydropower_plants']['dams'][wb]['weap_path'])
+                        # It is possible that the plant does not appear in this scenario
+                        if weap_hpp is None: continue
+                        #add nested dictionary to store weap_branch_generation_potential for this weap branch
+                        if wb not in (weap_branch_generation_potential[scenario]):
+                            weap_branch_generation_potential[scenario][wb] = {}
+                        # check unit in weap
+                        weap_unit= weap_hpp.Variables('Hydropower Generation').Unit
+                        if not weap_unit == 'GJ':
+                            leap.CloseProgressBar()
+                            msg = _('Energy Generation in WEAP has to be in Gigajoules. Exiting...')
+                            logging.error(msg)
+                            sys.exit(msg)
+
+                        #  pull weap values from weap baseyear to endyear,and remove first item)
+                        weap_hpp_gen = weap_hpp.Variables('Hydropower Generation').ResultValues(weap.BaseYear, weap.EndYear, weap_scenarios[i])[1:]
+                        if not len(weap_hpp_gen)%12 == 0:
+                            leap.CloseProgressBar()
+                            msg = _('Energy generation in WEAP is not monthly or not available for every simulation month. Exiting...')
+                            logging.error(msg)
+                            sys.exit(msg)
+                        if dam_convergence.observe("WEAP to LEAP", leap_scenarios[i], wb, weap_hpp_gen): continue
+
+                        y_range = range(weap.BaseYear, weap.EndYear+1)
+                        leap_hpps = config_params['WEAP']['Hydropower_plants']['dams'][wb]['leap_hpps']
+                        # Capacity in LEAP corresponding to WEAP branch [MW], by year; there might be multiple LEAP HPPs corresponding to this WEAP HPP
+                        weap_branch_capacity = np.zeros(len(y_range))
+                        for lb in leap_hpps:
+                            weap_branch_capacity += leap_capacity.capacities(leap_scenarios[i], lb, y_range)
+                            # ------- Begin extra debug logging ------------------------------------------------------------------------------------------------------#
+                            #logging.info(_('WEAP branch capacity for {hpp}: {y} MW').format(hpp=lb, y = weap_branch_capacity))
+                            # ------- End extra debug logging --------------------------------------------------------------------------------------------------------#
+
+                        # Calculate monthly generation potential for this scenario and store for future iterations (units MWh)
+                        # Note : should be made flexible to different time slice set up on the LEAP side at some point - at the moment expects monthly timeslices
+                        monthly_capacity = np.repeat(weap_branch_capacity, 12)
+                        hours_in_month = 24 * np.array([monthrange(y, r)[1] for y in y_range for r in range(1,12+1)])
+                        # Where capacity is zero, set to very small number to avoid divison by 0 error
+                        weap_branch_generation_potential[scenario][wb] = np.where(monthly_capacity > 0, monthly_capacity * hours_in_month, 0.000001)
+
+                        #Dont bother writing Maximum Availability if capacity is 0 in all years
+                        if sum(weap_branch_generation_potential[scenario][wb]) == 0: 
+                            logging.info(_('WEAP branch {s} has generation potential 0. Not writing maximimum availabilities').format(s = wb)) 
                             continue
-
-                        # calculate time series of maxiumum availabilities using element-wise division
-                        # TODO: Find the unit using Variable.DataUnitID, convert using Unit.ConversionFactor; set a target unit and store its conversion factor
-                        # Can't specify unit when querying data variables, but unit for Exogenous Capacity is MW
-                        weap_max_avail_this_month = [round(hpp / 3.6 / capacity * 100, 1) for hpp, capacity in zip(weap_hpp_gen_this_month, weap_branch_capacity_this_month)]
-                        # ------- Begin extra debug logging ------------------------------------------------------------------------------------------------------#
-                        #logging.info(_('Maximum availability: {y}').format(y =  weap_max_avail_this_month)) 
-                        # ------- End extra debug logging --------------------------------------------------------------------------------------------------------#
-
-                        # Replace values less than 0.001 with 0, and values greater 100 with 100 using list comprehension
-                        weap_max_avail_this_month = [0 if value < 0.001 else value for value in weap_max_avail_this_month]
-                        weap_max_avail_this_month = [100 if value >100 else value for value in weap_max_avail_this_month]
-
-                        # Set LEAP user variable to WEAP generation
-                        leap.Branches(leap_path).Variable(uservariable_this_month).Expression = "interp(" + ", ".join(f"{year}, {value}" for year, value in zip(years, weap_max_avail_this_month)) + ")"
-                        # # Note: Would be more error proof with ExpressionRS(), and would avoid slow leap.ActiveRegion call, but ExpressionRS doesnt allow setting expression via the API
+                    
+                        # Now iterate over leap HPPs again and add capacity
+                        for lb in leap_hpps: # there might be multiple corresponding to this WEAP HPP
+                            leap_path = config_params['LEAP']['Hydropower_plants']['plants'][lb]['leap_path']
+                            leap_region = config_params['LEAP']['Hydropower_plants']['plants'][lb]['leap_region']
+                            leap_region_id = leap_region_ids[leap_region]
+
+                            # Reads use ExpressionRS(), so the region only needs to be made active when writes are applied
+                            if leap.Branches(leap_path).Variable("Minimum Capacity") is None: 
+                                if leap.Branches(leap_path).Variable("Exogenous Capacity").ExpressionRS(leap_region, leap_scenarios[i]) == "0": continue
+
+                            # check that for this region and scenario HPP maximum availability points to monthly user variables of Maximum Availabilities
+                            if restart is None:
+                                if completed_iterations == 0 :
+                                    if leap.Branches(leap_path).Variable("Maximum Availability").ExpressionRS(leap_region, leap_scenarios[i]) != SeasonalValue_expression :
+                                        logging.info(('Updating "Maximum Availability"-variable for this power plant to use SeasonalValue()-function to point to user variables'))
+                                        leap_writes.set_expression(leap_path, "Maximum Availability", SeasonalValue_expression, scenario = leap_scenario_id, region = leap_region)
+                            #else : 
+                            #     if completed_iterations == restart_iteration:
+                            #        if leap.Branches(leap_path).Variable("Maximum Availability").ExpressionRS(leap_region, leap_scenarios[i]) != SeasonalValue_expression :
+                            #            logging.info(('Updating "Maximum Availability"-variable for this power plant to use SeasonalValue()-function to point to user variables'))
+                            #            leap.Branches(leap_path).Variable("Maximum Availability").Expression = SeasonalValue_expression
+
+                            # calculate maximum availability for each series of monthly values   
+                            months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+                            years =  list(range(weap.BaseYear, weap.EndYear + 1))
+                            for m in range(0, len(months)): 
+                                # write values into monthly user variables for maximum availability
+                                uservariable_this_month = "MaxAvail_" + months[m]
+
+                                # Extract values for this particular month
+                                weap_hpp_gen_this_month = list(weap_hpp_gen[m::12])
+                                weap_branch_capacity_this_month = weap_branch_generation_potential[scenario][wb][m::12] # maximum generation at full utilization
+                                # ------- Begin extra debug logging ------------------------------------------------------------------------------------------------------#
+                                #logging.info(_('Month: {y}').format(y =  months[m])) 
+                                #logging.info(_('WEAP branch actual generation [GJ]: {y}').format(y =  weap_hpp_gen_this_month)) 
+                                #logging.info(_('WEAP branch generation potential at capacity [MWh]: {y}').format(y =  weap_branch_capacity_this_month))   
+                                # ------- End extra debug logging --------------------------------------------------------------------------------------------------------#
+                            
+                                # dont bother writing maximum availabilities, if capacity in month m is 0 in every year
+                                if sum(weap_branch_capacity_this_month)==0 : 
+                                    logging.info(_('Month {s} has generation potential 0. Not writing maximimum availabilities.').format(s = months[m])) 
+                                    continue
+
+                                # calculate time series of maxiumum availabilities using element-wise division
+                                # TODO: Find the unit using Variable.DataUnitID, convert using Unit.ConversionFactor; set a target unit and store its conversion factor
+                                # Can't specify unit when querying data variables, but unit for Exogenous Capacity is MW
+                                weap_max_avail_this_month = [round(hpp / 3.6 / capacity * 100, 1) for hpp, capacity in zip(weap_hpp_gen_this_month, weap_branch_capacity_this_month)]
+                                # ------- Begin extra debug logging ------------------------------------------------------------------------------------------------------#
+                                #logging.info(_('Maximum availability: {y}').format(y =  weap_max_avail_this_month)) 
+                                # ------- End extra debug logging --------------------------------------------------------------------------------------------------------#
+
+                                # Replace values less than 0.001 with 0, and values greater 100 with 100 using list comprehension
+                                weap_max_avail_this_month = [0 if value < 0.001 else value for value in weap_max_avail_this_month]
+                                weap_max_avail_this_month = [100 if value >100 else value for value in weap_max_avail_this_month]
+
+                                # Optionally accelerate convergence, combining with values written in earlier iterations
+                                accelerated = accelerator.accelerate(("MaxAvail", leap_scenarios[i], lb, months[m]), weap_max_avail_this_month, 0, 100)
+                                if accelerated is not weap_max_avail_this_month:
+                                    weap_max_avail_this_month = [round(value, 1) for value in accelerated.tolist()]
+                                    accelerator.written(("MaxAvail", leap_scenarios[i], lb, months[m]), weap_max_avail_this_month)
+
+                                # Set LEAP user variable to WEAP generation
+                                leap_writes.set_expression(leap_path, uservariable_this_month, "interp(" + ", ".join(f"{year}, {value}" for year, value in zip(years, weap_max_avail_this_month)) + ")", scenario = leap_scenario_id, region = leap_region)
+                                max_availabilities.setdefault(leap_scenarios[i], {})[(lb, months[m])] = weap_max_avail_this_month
+                                # # Note: Would be more error proof with ExpressionRS(), and would avoid slow leap.ActiveRegion call, but ExpressionRS doesnt allow setting expression via the API
+                                # # Writes are grouped by scenario and region in leap_writes, so each region is made active once per scenario
+
+            leap_capacity.log_stats()
+            save_checkpoint(completed_iterations, "WEAP to LEAP availability")
         # END: Move hydropower availability information from WEAP to LEAP.
 
         #------------------------------------------------------------------------------------------------------------------------
         # Move pumping water requirements from WEAP to LEAP.
         #------------------------------------------------------------------------------------------------------------------------
-        msg = _('Moving water pumping information from WEAP to LEAP (iteration {i})').format(i = completed_iterations+1)
-        leap.ShowProgressBar(procedure_title, "".join(msg))
-        leap.SetProgressBar(50)
+        if not checkpoint.completed(completed_iterations, "WEAP to LEAP pumping"):
+            com_profiler.phase = "WEAP to LEAP pumping"
+            msg = _('Moving water pumping information from WEAP to LEAP (iteration {i})').format(i = completed_iterations+1)
+            leap.ShowProgressBar(procedure_title, "".join(msg))
+            leap.SetProgressBar(50)
 
-        logging.info(_('Moving water pumping information from WEAP to LEAP'))
+            logging.info(_('Moving water pumping information from WEAP to LEAP'))
         
-        for i in range(0, len(weap_scenarios)):
-            logging.info('\t' + _('Scenario: {w} (WEAP)/{l} (LEAP)').format(w = weap_scenarios[i], l = leap_scenarios[i]))
-            for weap_basin, leap_basin in config_params['WEAP']['Water pumping']['basin_map'].items():
-                logging.info('\t' + _('{b} basin: Agriculture').format(b = leap_basin))
-                leap_branch = "Demand\\Agriculture\\" + leap_basin + "\\Water demand"
-                for wr, lr in config_params['WEAP']['Water pumping']['region_map'].items():
-                    expr = "Interp("  # Expression that will be set in LEAP
-                    for y in range(weap.BaseYear, weap.EndYear+1):
-                        val = 0  # Value that will be written into expr for y
-                        for wb in weap.Catchments.FilterByTag("Agriculture").FilterByTag(weap_basin):
-                            if re.search(wr, wb.FullName) is None:
-                                continue
-                            val += weap.ResultValue("".join([wb.FullName, weap_pump_var]), y, 1, weap_scenarios[i], y, 12, 'Total')
-                        expr = "".join([expr,str(y),LIST_SEPARATOR,str(val),LIST_SEPARATOR])
-                    expr = "".join([expr[0:-1], ")"])
-                    leap.ActiveRegion = lr
-                    leap.ActiveScenario = leap_scenarios[i]
-                    logging.info('\t\t' + _('Region: {r}').format(r = lr))
-                    leap.Branches(leap_branch).Variables("Activity Level").Expression = expr
-
-                logging.info('\t' + _('{b} basin: Industrial and domestic').format(b = leap_basin))
-                leap_branch = None
-                for entry in config_params['LEAP']['Branches'].values():
-                    if all(term in entry.get('path', '') for term in ["Industry", leap_basin, "Water Pumping"]):
-                        leap_branch = entry['path']
-                        break
-
-                for wr, lr in config_params['WEAP']['Water pumping']['region_map'].items():
-                    expr = "Interp("  # Expression that will be set in LEAP
-                    for y in range(weap.BaseYear, weap.EndYear+1):
-                        val = 0  # Value that will be written into expr for y
-                        # Combine industrial and domestic
-                        for wb in weap.DemandSites.FilterByTag("Industrial").FilterByTag(weap_basin):
-                            if re.search(wr, wb.FullName) is None:
-                                continue
-                            val += weap.ResultValue("".join([wb.FullName, weap_pump_var]), y, 1, weap_scenarios[i], y, 12, 'Total')
-                        for wb in weap.DemandSites.FilterByTag("Domestic").FilterByTag(weap_basin):
-                            if re.search(wr, wb.FullName) is None:
-                                continue
-                            val += weap.ResultValue("".join([wb.FullName, weap_pump_var]), y, 1, weap_scenarios[i], y, 12, 'Total')
-                        expr = "".join([expr,str(y),LIST_SEPARATOR,str(val),LIST_SEPARATOR])
-                    expr = "".join([expr[0:-1], ")"])
-                    leap.ActiveRegion = lr
-                    leap.ActiveScenario = leap_scenarios[i]
-                    logging.info('\t\t' + _('Region: {r}').format(r = lr))
-                    leap.Branches(leap_branch).Variables("Activity Level").Expression = expr
+            with leap_writes:
+                for i in range(0, len(weap_scenarios)):
+                    logging.info('\t' + _('Scenario: {w} (WEAP)/{l} (LEAP)').format(w = weap_scenarios[i], l = leap_scenarios[i]))
+                    for weap_basin, leap_basin in config_params['WEAP']['Water pumping']['basin_map'].items():
+                        logging.info('\t' + _('{b} basin: Agriculture').format(b = leap_basin))
+                        leap_branch = "Demand\\Agriculture\\" + leap_basin + "\\Water demand"
+                        for wr, lr in config_params['WEAP']['Water pumping']['region_map'].items():
+                            vals = np.zeros(len(weap_results.years))  # Values that will be written into expr, by year
+                            for wb_name in weap_tags.full_names("Agriculture", weap_basin, wr):
+                                vals += weap_results.annual(wb_name, weap_pump_variable, weap_pump_unit, weap_scenarios[i])
+                            expr = "Interp(" + LIST_SEPARATOR.join([str(y) + LIST_SEPARATOR + str(val) for y, val in zip(weap_results.years, vals)]) + ")"  # Expression that will be set in LEAP
+                            logging.info('\t\t' + _('Region: {r}').format(r = lr))
+                            leap_writes.set_expression(leap_branch, "Activity Level", expr, scenario = leap_scenarios[i], region = lr)
+
+                        logging.info('\t' + _('{b} basin: Industrial and domestic').format(b = leap_basin))
+                        leap_branch = None
+                        for entry in config_params['LEAP']['Branches'].values():
+                            if all(term in entry.get('path', '') for term in ["Industry", leap_basin, "Water Pumping"]):
+                                leap_branch = entry['path']
+                                break
+
+                        for wr, lr in config_params['WEAP']['Water pumping']['region_map'].items():
+                            vals = np.zeros(len(weap_results.years))  # Values that will be written into expr, by year
+                            # Combine industrial and domestic
+                            for wb_name in weap_tags.full_names("Industrial", weap_basin, wr) + weap_tags.full_names("Domestic", weap_basin, wr):
+                                vals += weap_results.annual(wb_name, weap_pump_variable, weap_pump_unit, weap_scenarios[i])
+                            expr = "Interp(" + LIST_SEPARATOR.join([str(y) + LIST_SEPARATOR + str(val) for y, val in zip(weap_results.years, vals)]) + ")"  # Expression that will be set in LEAP
+                            logging.info('\t\t' + _('Region: {r}').format(r = lr))
+                            leap_writes.set_expression(leap_branch, "Activity Level", expr, scenario = leap_scenarios[i], region = lr)
+            save_checkpoint(completed_iterations, "WEAP to LEAP pumping")
 		# END: Move agricultural water requirements from WEAP to LEAP.
 
         #------------------------------------------------------------------------------------------------------------------------
         # Calculate LEAP
         #------------------------------------------------------------------------------------------------------------------------
-        msg = _('Calculating LEAP area (iteration {i})').format(i = completed_iterations+1)
-        leap.ShowProgressBar(procedure_title, msg)
-        leap.SetProgressBar(50)
+        if not checkpoint.completed(completed_iterations, "Calculate LEAP"):
+            com_profiler.phase = "Calculate LEAP"
+            msg = _('Calculating LEAP area (iteration {i})').format(i = completed_iterations+1)
+            leap.ShowProgressBar(procedure_title, msg)
+            leap.SetProgressBar(50)
 
-        logging.info(msg)
-        kill_excel()
+            logging.info(msg)
+            kill_excel()
 
-        # Unless the config file specifies otherwise, temporarily add a before scenario script that kills all Excel processes. This can help avoid errors when calculating multiple scenarios.
-        set_beforescenariocalc = False  # Indicates if integration procedure has set LEAP area's before scenario script
+            # Unless the config file specifies otherwise, temporarily add a before scenario script that kills all Excel processes. This can help avoid errors when calculating multiple scenarios.
+            set_beforescenariocalc = False  # Indicates if integration procedure has set LEAP area's before scenario script
 
-        if config_params['LEAP']['Custom before scenario script'] == "True":
-            logging.info("Using LEAP area's pre-existing before scenario script. Note: it's advisable to integrate contents of kill_excel.vbs into this script.")
-        else:
-            if leap.BeforeScenarioCalc != "":
-                leap.CloseProgressBar()
-                msg = "LEAP area has a before scenario script; this is incompatible with integration procedure unless 'Custom before scenario script' is set to True in config.yml."
-                logging.error(msg)
-                sys.exit(msg)
+            if config_params['LEAP']['Custom before scenario script'] == "True":
+                logging.info("Using LEAP area's pre-existing before scenario script. Note: it's advisable to integrate contents of kill_excel.vbs into this script.")
+            else:
+                if leap.BeforeScenarioCalc != "":
+                    leap.CloseProgressBar()
+                    msg = "LEAP area has a before scenario script; this is incompatible with integration procedure unless 'Custom before scenario script' is set to True in config.yml."
+                    logging.error(msg)
+                    sys.exit(msg)
             
-            leap.BeforeScenarioCalc = os.path.join(os.getcwd(), "kill_excel.vbs")
-            set_beforescenariocalc = True
-
-        try:        
-            leap.Calculate(False)
-        finally:
-            if set_beforescenariocalc:
-                leap.BeforeScenarioCalc = ""
-
-        logging.info('Finished calculating LEAP.')
-
-        # Ensure that areas are saved
-        logging.info(_('Saving LEAP and WEAP areas'))
-        leap.SaveArea()
-        weap.SaveArea()
+                leap.BeforeScenarioCalc = os.path.join(os.getcwd(), "kill_excel.vbs")
+                set_beforescenariocalc = True
+
+            try:        
+                leap.Calculate(False)
+            finally:
+                if set_beforescenariocalc:
+                    leap.BeforeScenarioCalc = ""
+
+            logging.info('Finished calculating LEAP.')
+
+            # Ensure that areas are saved
+            logging.info(_('Saving LEAP and WEAP areas'))
+            leap.SaveArea()
+            weap.SaveArea()
+            save_checkpoint(completed_iterations, "Calculate LEAP", save_areas = False)
         logging.info(_('Saving versions for iteration {i}').format(i = completed_iterations + 1))
-        version_comment = _('Iteration {i} - {u}').format(i = completed_iterations + 1, u = run_uuid)
+        version_comment = _('Iteration {i} - {u}').format(i = completed_iterations + 1, u = version_run_id)
         #leap.SaveVersion(version_comment, True) # Save results
         #weap.SaveVersion(version_comment, True) # Save results
 
         #------------------------------------------------------------------------------------------------------------------------
         # Store target results used in the convergence check
         #------------------------------------------------------------------------------------------------------------------------
-        msg = _('Recording results and checking for convergence (iteration {i})').format(i = completed_iterations+1)
-        leap.ShowProgressBar(procedure_title, msg)
-        leap.SetProgressBar(80)
+        if not checkpoint.completed(completed_iterations, "Record results"):
+            com_profiler.phase = "Record results"
+            msg = _('Recording results and checking for convergence (iteration {i})').format(i = completed_iterations+1)
+            leap.ShowProgressBar(procedure_title, msg)
+            leap.SetProgressBar(80)
         
-        this_iteration_leap_results = {}
-        this_iteration_ames_results = {}
-        this_iteration_weap_results = {}
-
-        # Activate favorite
-        #leap.ActiveView = "Results"
-        leap.Favorites("9 HPP Energy Generation").Activate()
-        leap.ActiveUnit ='Gigawatt-Hour'
-        # Write results from favorite to excel
-        leap_results_filepath = os.path.join(hydroexcelpath,f"LEAP_results_iteration_{completed_iterations+1}.csv")
-        leap.ExportResultsCSV(leap_results_filepath)
-        leap.ActiveView = "Analysis"
-
-        # Read excel to dataframe
-        with open(leap_results_filepath) as csv_file:
-            csv_reader = csv.reader(csv_file, delimiter=',')
-            # Search for header row
-            for hdr in csv_reader:
-                if hdr[0] == "Scenario":
-                    header = hdr
-                    break
-            # Read the rest of the file into a DataFrame
-            df = pd.DataFrame(csv_reader, columns=header)
-            current_index = 0
+            # Activate favorite
+            #leap.ActiveView = "Results"
+            leap.Favorites("9 HPP Energy Generation").Activate()
+            leap.ActiveUnit ='Gigawatt-Hour'
+            # Write results from favorite to excel
+            leap_results_filepath = os.path.join(hydroexcelpath,f"LEAP_results_iteration_{completed_iterations+1}.csv")
+            leap.ExportResultsCSV(leap_results_filepath)
+            leap.ActiveView = "Analysis"
+
+            # Parse the header once into the position of each (plant, year) among the columns read, or -1 if LEAP did not export it
+            hdr_row, header = read_leap_export_header(leap_results_filepath, "Scenario")
+            leap_results_index = index_leap_columns(header[1:], config_params['LEAP']['Hydropower_plants']['plants'])
+            target_cols = sorted(set(c for t in target_leap_results for c in leap_results_index[t]['cols']))
+            col_pos = {c: i for i, c in enumerate(target_cols)}
+            year_pos = {y: j for j, y in enumerate(leap_calc_years)}
+            target_pos = np.full((len(target_leap_results), len(leap_calc_years)), -1)
+            for i, t in enumerate(target_leap_results):
+                for c, y in zip(leap_results_index[t]['cols'], leap_results_index[t]['years']):
+                    if y in year_pos and target_pos[i, year_pos[y]] < 0:
+                        target_pos[i, year_pos[y]] = col_pos[c]
+            # Read those columns for the calculated scenarios, in chunks of rows
+            leap_scenario_rows = {}
+            for labels, data in read_leap_export_chunks(leap_results_filepath, hdr_row, header, target_cols, leap_export_memory_mb):
+                for l, row in zip(labels, data):
+                    if l in leap_scenarios and l not in leap_scenario_rows:
+                        leap_scenario_rows[l] = row
             for sl in  leap_scenarios:
-                this_iteration_leap_results[sl] = {}
-                filtered_scenario = df[df.iloc[:, 0] == sl]
                 sw = scenarios_map[sl]
                 logging.info(_('Checking results for scenario: {w} (WEAP)/{l} (LEAP)').format(w = sw, l = sl))
-            
+        
                 logging.info('\t' + _('Checking LEAP results...'))
-                # Extract results for each hydropower plant
-                for t in target_leap_results:
-                    for y in leap_calc_years:
-                        # Extract result for this hydropower plant and year
-                        val = filtered_scenario.loc[:, filtered_scenario.columns.str.contains(t) & filtered_scenario.columns.str.contains(str(y))]
-                        # Ensure all values are numeric, converting non-numeric ones to 0
-                        val = val.apply(pd.to_numeric, errors='coerce').fillna(0)
-                        if val is None:
-                            logging.error(_('LEAP did not return a value for "{t}" in year {y} of scenario {s}').format(e = t, y = y, s = sl))
-
-                        this_iteration_leap_results[sl][current_index] = val
-                        current_index += 1
+                # Array of target LEAP results by hydropower plant and year, in the order of index_to_elements(); missing values are set to 0
+                row = leap_scenario_rows.get(sl, np.zeros(len(target_cols)))
+                leap_convergence.record(sl, np.append(row, 0.0)[target_pos])
+                if sl in leap_scenario_rows:
+                    missing = target_pos < 0
+                else:
+                    missing = np.ones(target_pos.shape, dtype = bool)
+                for i, j in zip(*np.nonzero(missing)):
+                    logging.error(_('LEAP did not return a value for "{e}" in year {y} of scenario {s}').format(e = target_leap_results[i], y = leap_calc_years[j], s = sl))
 
 
                 if using_ames:
                     logging.info('\t' + _('Checking AMES results...'))
                     # Create an array of target AMES result values obtained in this iteration and stored in LEAP
                     ames_results_size = len(target_ames_results) * len(config_params['AMES']['Regions'].keys()) * len(leap_calc_years)
-                    this_iteration_ames_results[sl] = np.empty(ames_results_size, dtype=object)
-                    
+                    ames_vals = np.empty(ames_results_size, dtype=np.float64)
+                
                     current_index = 0
                     for e in target_ames_results:
                         leap_var = leap.Branches(config_params['LEAP']['Branches'][e]['path']).Variables(config_params['LEAP']['Branches'][e]['variable'])
@@ -989,26 +1251,28 @@ def main_integration():
                                 val = leap_var.Value(y)
                                 if val is None:
                                     logging.error(_('LEAP did not return a value for AMES result "{e}" in year {y} of scenario {s} for {r}').format(e = e, y = y, s = sl, r = r))
-                                this_iteration_ames_results[sl][current_index] = val
+                                ames_vals[current_index] = np.nan if val is None else val
                                 current_index += 1
+                    ames_convergence.record(sl, ames_vals)
 
                 logging.info('\t' + _('Checking WEAP results...'))
                 # Create an array of target WEAP result values obtained in this iteration
                 weap_results_size = len(target_weap_results) * (weap.EndYear - weap.BaseYear + 1)
-                this_iteration_weap_results[sw] = np.empty(weap_results_size, dtype=object)
-                
+                weap_vals = np.empty(weap_results_size, dtype=np.float64)
+            
                 current_index = 0
-                weap_varname = ":" + config_params['WEAP']['Hydropower_plants']['convergence_check']['weap_variable']
-                weap_unitname = "[" + config_params['WEAP']['Hydropower_plants']['convergence_check']['weap_unit'] + "]"
+                weap_varname = config_params['WEAP']['Hydropower_plants']['convergence_check']['weap_variable']
+                weap_unitname = config_params['WEAP']['Hydropower_plants']['convergence_check']['weap_unit']
                 for e in target_weap_results:
-                    weap_pathvar = "".join([config_params['WEAP']['Hydropower_plants']['dams'][e]['weap_path'], weap_varname, weap_unitname])
-                    for y in range(weap.BaseYear, weap.EndYear + 1):
-                        val = weap.ResultValue(weap_pathvar, y, 1, sw, y, 12, 'Total')
-                        if val is None:
+                    vals = weap_results.annual(config_params['WEAP']['Hydropower_plants']['dams'][e]['weap_path'], weap_varname, weap_unitname, sw)
+                    for y, val in zip(weap_results.years, vals):
+                        if np.isnan(val):
                             logging.error(_('WEAP did not return a value for "{e}" in year {y} of scenario {s}').format(e = e, y = y, s = sw))
-                        this_iteration_weap_results[sw][current_index] = val
-                        current_index += 1
-        del csv_file
+                    weap_vals[current_index:current_index + len(vals)] = vals
+                    current_index += len(vals)
+                weap_convergence.record(sw, weap_vals)
+            weap_results.log_stats()
+            save_checkpoint(completed_iterations, "Record results")
 
         #------------------------------------------------------------------------------------------------------------------------
         # Check for convergence (after initial run)
@@ -1019,14 +1283,25 @@ def main_integration():
         else:
             threshold_for_convergence_check = 0
             
-        # check whether this is not the first iteration in this particular run
+        # check whether this is not the first iteration in this particular run, and whether the check was made before the run was interrupted;
+        # in the first iteration, only scenarios with results from a warm start are checked
         if completed_iterations > threshold_for_convergence_check:
+            checked_scenarios = leap_scenarios
+        else:
+            checked_scenarios = [sl for sl in leap_scenarios if sl in leap_convergence.previous and scenarios_map[sl] in weap_convergence.previous and (not using_ames or sl in ames_convergence.previous)]
+        if checked_scenarios and not checkpoint.completed(completed_iterations, "Check convergence"):
             logging.info(_('Checking whether calculations converged...'))
             msg = _('Recording results and checking for convergence (iteration {i})').format(i = completed_iterations+1)
             leap.ShowProgressBar(procedure_title, msg)
             leap.SetProgressBar(95)
 
-            for sl in leap_scenarios:
+            # Compare all checked scenarios at once
+            leap_checks = leap_convergence.check(checked_scenarios)
+            weap_checks = weap_convergence.check([scenarios_map[sl] for sl in checked_scenarios])
+            if using_ames:
+                ames_checks = ames_convergence.check(checked_scenarios)
+
+            for sl in checked_scenarios:
                 sw = scenarios_map[sl]
                 
                 logging.info('\t' + _('Checking convergence for scenario: {w} (WEAP)/{l} (LEAP)').format(w = sw, l = sl))
@@ -1036,32 +1311,31 @@ def main_integration():
                 results_converged = True
                 
                 # LEAP
-                num = np.abs(np.array(list(this_iteration_leap_results[sl].values())) - np.array(list(last_iteration_leap_results[sl].values()))).ravel().ravel()
-                # This formulation avoids divide by zero
-                den = 0.5 * np.maximum(np.abs((np.array(list(this_iteration_leap_results[sl].values())) + np.array(list(last_iteration_leap_results[sl].values()))).ravel().ravel()), float_info.epsilon)
-                test_value = np.sqrt(sum((num/den)**2)/len(den))
-                if test_value > tolerance:
-                    diff_loc = index_to_elements(np.argmax(num/den), target_leap_results, leap_calc_years)
-                    logging.info('\t\t' + _('Difference exceeded tolerance for LEAP ({t:.2%} > {t0:.2%}); Maximum deviation for {e} in {y}').format(t = test_value, t0 = tolerance, e = diff_loc[0], y = diff_loc[1]))
+                check = leap_checks[sl]
+                if not check.converged:
+                    diff_loc = check.largest[0]
+                    logging.info('\t\t' + _('Difference exceeded tolerance for LEAP ({t:.2%} > {t0:.2%}); Maximum deviation for {e} in {y}').format(t = check.test_value, t0 = tolerance, e = diff_loc[0], y = diff_loc[1]))
+                    if check.offenders:
+                        logging.info('\t\t\t' + _('Largest deviations: {d}').format(d = check.describe_offenders()))
                     results_converged = False
                 
                 # WEAP
-                num = np.abs(this_iteration_weap_results[sw] - last_iteration_weap_results[sw])
-                den = 0.5 * np.maximum(np.abs(this_iteration_weap_results[sw] + last_iteration_weap_results[sw]), float_info.epsilon)
-                test_value = np.sqrt(sum((num/den)**2)/len(den))
-                if test_value > tolerance:
-                    diff_loc = index_to_elements(np.argmax(num/den), target_weap_results, list(range(weap.BaseYear, weap.EndYear+1)))
-                    logging.info('\t\t' + _('Difference exceeded tolerance for WEAP ({t:.2%} > {t0:.2%}); Maximum deviation for {e} in {y}').format(t = test_value, t0 = tolerance, e = diff_loc[0], y = diff_loc[1]))
+                check = weap_checks[sw]
+                if not check.converged:
+                    diff_loc = check.largest[0]
+                    logging.info('\t\t' + _('Difference exceeded tolerance for WEAP ({t:.2%} > {t0:.2%}); Maximum deviation for {e} in {y}').format(t = check.test_value, t0 = tolerance, e = diff_loc[0], y = diff_loc[1]))
+                    if check.offenders:
+                        logging.info('\t\t\t' + _('Largest deviations: {d}').format(d = check.describe_offenders()))
                     results_converged = False
                     
                 # AMES
                 if using_ames:
-                    num = np.abs(this_iteration_ames_results[sl] - last_iteration_ames_results[sl])
-                    den = 0.5 * np.maximum(np.abs(this_iteration_ames_results[sl] + last_iteration_ames_results[sl]), float_info.epsilon)
-                    test_value = np.sqrt(sum((num/den)**2)/len(den))
-                    if test_value > tolerance:
-                        diff_loc = index_to_elements(np.argmax(num/den), target_ames_results, list(config_params['AMES']['Regions'].keys()), leap_calc_years)
-                        logging.info('\t\t' + _('Difference exceeded tolerance for AMES ({t:.2%} > {t0:.2%}); Maximum deviation for {e} in {r} in {y}').format(t = test_value, t0 = tolerance, e = diff_loc[0], y = diff_loc[2], r = diff_loc[1]))
+                    check = ames_checks[sl]
+                    if not check.converged:
+                        diff_loc = check.largest[0]
+                        logging.info('\t\t' + _('Difference exceeded tolerance for AMES ({t:.2%} > {t0:.2%}); Maximum deviation for {e} in {r} in {y}').format(t = check.test_value, t0 = tolerance, e = diff_loc[0], y = diff_loc[2], r = diff_loc[1]))
+                        if check.offenders:
+                            logging.info('\t\t\t' + _('Largest deviations: {d}').format(d = check.describe_offenders()))
                         results_converged = False
 
                 if results_converged:
@@ -1069,9 +1343,15 @@ def main_integration():
                     logging.info(msg)
                     # Remove this scenario from lists
                     del scenarios_map[sl]
-                    del this_iteration_leap_results[sl]
-                    if using_ames: del this_iteration_ames_results[sl]
-                    del this_iteration_weap_results[sw]
+                    accelerator.forget(("MaxAvail", sl))
+                    accelerator.forget(("HPP demand", sw))
+                    dam_convergence.forget(sl)
+                    # Freeze results for this scenario and stop calculating it in later iterations
+                    leap_convergence.freeze(sl, completed_iterations + 1)
+                    if using_ames: ames_convergence.freeze(sl, completed_iterations + 1)
+                    weap_convergence.freeze(sw, completed_iterations + 1)
+                    leap.Scenarios(sl).ResultsShown = False
+                    weap.Scenarios(sw).ResultsShown = False
                 else:
                     logging.info('\t\t' + _('Results did not converge for scenario {s}.').format(s = sl))
         
@@ -1094,30 +1374,52 @@ def main_integration():
         weap_scenarios = list(scenarios_map.values())
 
         # Update information for next iteration
-        last_iteration_leap_results = this_iteration_leap_results
-        last_iteration_weap_results = this_iteration_weap_results
-        if using_ames: last_iteration_ames_results = this_iteration_ames_results
+        leap_convergence.advance()
+        weap_convergence.advance()
+        if using_ames: ames_convergence.advance()
+        if not checkpoint.completed(completed_iterations, "Check convergence"):
+            save_checkpoint(completed_iterations, "Check convergence")
 
         completed_iterations += 1
-        
-        # Reopen WEAP area to work around a bug that causes weap.Branches to return nothing
-        reopen_weap_area(weap)
 
-        #------------------------------------------------------------------------------------------------------------------------
-        #
-        # Pass LEAP hydropower generation to WEAP hydropower energy demand
-        #
-        #------------------------------------------------------------------------------------------------------------------------
-        logging.info(_('Moving hydropower generation from LEAP to WEAP...'))
+        leap.log_stats()
+        weap.log_stats()
+        leap_writes.log_stats()
+        weap_writes.log_stats()
+        expression_sink.end_iteration(completed_iterations)
+        
+        com_profiler.report(_('iteration {i}').format(i = completed_iterations))
+
+        # The remaining phases belong to the pass through the loop that started before completed_iterations was incremented
+        if not checkpoint.completed(completed_iterations - 1, "LEAP to WEAP hydropower"):
+            # Reopen WEAP area to work around a bug that causes weap.Branches to return nothing
+            com_profiler.phase = "Reopen WEAP area"
+            reopen_weap_area(weap)
+
+            #------------------------------------------------------------------------------------------------------------------------
+            #
+            # Pass LEAP hydropower generation to WEAP hydropower energy demand
+            #
+            #------------------------------------------------------------------------------------------------------------------------
+            com_profiler.phase = "LEAP to WEAP hydropower"
+            logging.info(_('Moving hydropower generation from LEAP to WEAP...'))
 
-        for sl in leap_scenarios:
-            sw = scenarios_map[sl]
-            export_leap_hpp_to_weap(leap, weap, completed_iterations, sl, sw, config_params)
+            for sl in leap_scenarios:
+                sw = scenarios_map[sl]
+                hpp_demand_files[sw] = export_leap_hpp_to_weap(leap, weap, completed_iterations, sl, sw, config_params, leap_ts_info, accelerator, dam_convergence)
+            save_checkpoint(completed_iterations - 1, "LEAP to WEAP hydropower")
 
         #------------------------------------------------------------------------------------------------------------------------
         # Calculate AMES with new results from WEAP and LEAP
         #------------------------------------------------------------------------------------------------------------------------
-        if using_ames:
+        if using_ames and not checkpoint.completed(completed_iterations - 1, "WEAP to AMES"):
+            com_profiler.phase = "WEAP to AMES"
+            # LEAP results loaded by AMES are read for the cache before any AMES run starts, since AMES runs use LEAP
+            leap_results_for_ames = {}
+            if ames_cache.enabled:
+                for leap_scenario in leap_scenarios:
+                    for r in config_params['AMES']['Regions']:
+                        leap_results_for_ames[(leap_scenario, r)] = read_ames_leap_results(leap_scenario, r)
             logging.info(_('Pushing WEAP results to AMES...'))
             for leap_scenario in leap_scenarios:
                 weap_scenario = scenarios_map[leap_scenario]
@@ -1130,6 +1432,8 @@ def main_integration():
                     
                 # export weap data
                 dfcov, dfcovdmd, dfcrop, dfcropprice = get_weap_ag_results(fdirweapoutput, fdirmain, weap_scenario, weap, config_params, CSV_ROW_SKIP)
+                # aggregate by WEAP country once for all regions
+                weap_aggregates = aggregate_weap_results(config_params, dfcov, dfcovdmd, dfcrop, dfcropprice)
                 
                 logging.info(_('Processing for WEAP scenario: {s}').format(s = weap_scenario))
                 for r, rinfo in config_params['AMES']['Regions'].items():  
@@ -1137,32 +1441,40 @@ def main_integration():
                     fdiramesinput = os.path.join(amesmodelspath, rinfo['directory_name'], "inputs")
                         
                     # process WEAP data for AMES
-                    weap_to_ames_processing(weap_scenario, leap_scenario, config_params, r, rinfo['weap_region'], fdiramesinput, fdirweapoutput, dfcov, dfcovdmd, dfcrop, dfcropprice)
+                    weap_to_ames_processing(weap_scenario, leap_scenario, config_params, r, rinfo['weap_region'], fdiramesinput, fdirweapoutput, weap_aggregates)
 
-            # Run AMES
-            for s in leap_scenarios:
-                logging.info(_('Running AMES for scenario: {s}').format(s = s))
+                # Run AMES for this scenario while WEAP results are exported for the next one: AMES only reads the files written above
+                logging.info(_('Running AMES for scenario: {s}').format(s = leap_scenario))
                 for r, rinfo in config_params['AMES']['Regions'].items():
                     logging.info('\t' + _('Region: {r}').format(r = r))
-                    if rinfo['use_existing_input_files']:
-                        i_flag = "-i"
-                    else:
-                        i_flag = ""
-                    amesdir = os.path.join(amesmodelspath,  rinfo['directory_name'], rinfo['script'])
-                    exec_string = juliapath + " \"" + amesdir + "\" \"" + s + "\" " + i_flag + \
-                                    " -c -p -w -v" + \
-                                    " -y " + str(leap_calc_years[-1]) + \
-                                    " -u \"" + version_comment + "\"" + \
-                                    " -r " + str(completed_iterations) + \
-                                    " --load-leap-first"
-                    logging.info('\t' + _('Executing: {e}').format(e = exec_string))
-                    errorcode= os.system(exec_string)
-                    if errorcode != 0:
-                        leap.CloseProgressBar()
-                        msg = _('AMES exited with an error')
-                        logging.error(msg)
-                        sys.exit(msg)
+                    submit_ames(leap_scenario, r, rinfo, ["-c", "-p", "-w", "-v", "-y", str(leap_calc_years[-1]), "-u", version_comment, "-r", str(completed_iterations), "--load-leap-first"], completed_iterations,
+                                leap_results_for_ames.get((leap_scenario, r)))
+
+            # LEAP drivers for the next iteration depend on all AMES results
+            wait_for_ames()
+            save_checkpoint(completed_iterations - 1, "WEAP to AMES")
     
+    # Show results again for scenarios that converged before the end of the run, and save final results for all scenarios
+    for sl, sw in all_scenarios_map.items():
+        leap.Scenarios(sl).ResultsShown = True
+        weap.Scenarios(sw).ResultsShown = True
+    leap_convergence.write_csv(os.path.join(hydroexcelpath, "LEAP_final_results.csv"))
+    weap_convergence.write_csv(os.path.join(hydroexcelpath, "WEAP_final_results.csv"))
+    if using_ames: ames_convergence.write_csv(os.path.join(hydroexcelpath, "AMES_final_results.csv"))
+    # Save the values last passed between LEAP and WEAP, for warm starts of later runs
+    for sl, sw in all_scenarios_map.items():
+        if sl in max_availabilities:
+            write_max_availabilities(max_availability_fname(hydroexcelpath, sl), range(weap.BaseYear, weap.EndYear + 1), max_availabilities[sl])
+        if sw in hpp_demand_files:
+            save_hpp_demand(hydroexcelpath, sw, hpp_demand_files[sw])
+    logging.info(_('Final results for all scenarios saved in {d}').format(d = hydroexcelpath))
+    # The run completed, so a new run should not resume from it
+    checkpoint.remove()
+    if using_ames:
+        ames.close()
+        ames.log_stats()
+        ames_cache.log_stats()
+
     msg = _('Completed WEAP-LEAP integration procedure')
     leap.ShowProgressBar(procedure_title, msg)
     leap.SetProgressBar(100)
@@ -1176,5 +1488,12 @@ def main_integration():
     tet = time.time()
     total_elapsed_time = tet - tst
     logging.info(_('Total elapsed time: {t}').format(t = hms_from_sec(total_elapsed_time)))
+    com_profiler.report_total()
+    accelerator.log_stats()
+    dam_convergence.log_stats()
+    if record_file:
+        com_recorder.close()
+    if replay_file:
+        com_replayer.log_stats()
 
 main_integration()
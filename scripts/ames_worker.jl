@@ -0,0 +1,51 @@
+# script 'ames_worker.jl'
+#
+# Long-lived worker that runs AMES scripts (e.g., runames.jl) for the WAVE integration program, so that
+# Julia, AMES, YAML, and ArgParse are loaded and compiled once per integration run rather than once per
+# AMES run. Requests are read from standard input, one per line, with fields separated by tabs:
+#     RUN  <log file>  <script>  <argument 1>  <argument 2> ...
+#     QUIT
+# For each RUN request, the script is run in a new module with the arguments as its command-line
+# arguments (ARGS) and its output sent to the log file, and "DONE <exit status>" is written to standard
+# output. If a script calls exit(), the worker stops, and the integration program starts a new one.
+using AMES
+using YAML
+using ArgParse
+
+"Run `script` with command-line arguments `args`, sending output to `logfile`; return the exit status"
+function run_script(script::AbstractString, args::Vector{String}, logfile::AbstractString)
+    curr_working_dir = pwd()
+    status = 0
+    open(logfile, "w") do io
+        redirect_stdio(stdout = io, stderr = io) do
+            empty!(ARGS)
+            append!(ARGS, args)
+            try
+                Base.include(Module(), script)
+            catch e
+                if e isa InterruptException
+                    rethrow()
+                end
+                status = 1
+                showerror(io, e, catch_backtrace())
+                println(io)
+            end
+        end
+    end
+    cd(curr_working_dir)
+    return status
+end # run_script
+
+println("READY")
+flush(stdout)
+
+while !eof(stdin)
+    fields = split(readline(stdin), '\t')
+    if fields[1] == "QUIT"
+        break
+    elseif fields[1] == "RUN" && length(fields) >= 3
+        status = run_script(fields[3], String.(fields[4:end]), fields[2])
+        println("DONE\t", status)
+        flush(stdout)
+    end
+end
@@ -0,0 +1,7 @@
+import os
+import sys
+import gettext
+
+# The modules under test use the gettext function _() installed by leap_weap_integration.py, and are imported as utils.<module>
+gettext.install('wave_integration')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
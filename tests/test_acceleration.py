@@ -0,0 +1,112 @@
+import copy
+import numpy as np
+import pytest
+from utils.acceleration import FixedPointAccelerator, AITKEN_RELAXATION_BOUNDS
+
+def linear_map(seed = 0, size = 6):
+    """Return [G, fixed point] for a contraction G(x) = A x + b with eigenvalues of both signs, up to 0.95"""
+    rng = np.random.default_rng(seed)
+    q = np.linalg.qr(rng.normal(size = (size, size)))[0]
+    a = q @ np.diag(np.linspace(-0.5, 0.95, size)) @ q.T
+    b = rng.normal(size = size)
+    return [lambda x: a @ x + b, np.linalg.solve(np.eye(size) - a, b)]
+
+def iterate(accelerator, g, iterations, size = 6):
+    """Iterate from zero, writing the values returned by the accelerator; returns the last values written"""
+    x = np.zeros(size)
+    for i in range(iterations):
+        accelerator.start_iteration(i)
+        x = np.asarray(accelerator.accelerate('key', g(x)), dtype = np.float64)
+    return x
+
+@pytest.mark.parametrize('seed', range(5))
+def test_anderson_converges_faster_than_plain_substitution(seed):
+    g, solution = linear_map(seed)
+    plain = np.linalg.norm(iterate(FixedPointAccelerator(None), g, 10) - solution)
+    anderson = np.linalg.norm(iterate(FixedPointAccelerator("Anderson", 2), g, 10) - solution)
+    assert anderson < 0.1 * plain
+
+@pytest.mark.parametrize('seed', range(5))
+def test_aitken_converges_faster_than_plain_substitution(seed):
+    g, solution = linear_map(seed)
+    plain = np.linalg.norm(iterate(FixedPointAccelerator(None), g, 10) - solution)
+    aitken = np.linalg.norm(iterate(FixedPointAccelerator("Aitken"), g, 10) - solution)
+    assert aitken < plain
+
+def test_aitken_relaxation_stays_bounded_with_noisy_residuals():
+    g, solution = linear_map()
+    errors = []
+    for method in [None, "Aitken"]:
+        rng = np.random.default_rng(1)
+        accelerator = FixedPointAccelerator(method)
+        x = np.zeros(6)
+        for i in range(30):
+            accelerator.start_iteration(i)
+            x = np.asarray(accelerator.accelerate('key', g(x) + 0.05 * rng.normal(size = 6)), dtype = np.float64)
+            if method is not None:
+                assert AITKEN_RELAXATION_BOUNDS[0] <= accelerator.history['key']['omega'] <= AITKEN_RELAXATION_BOUNDS[1]
+        errors.append(np.linalg.norm(x - solution))
+    # Noise limits what acceleration can gain, but the relaxation factor must not make matters much worse
+    assert errors[1] < 1.5 * errors[0]
+
+def test_aitken_relaxation_resets_when_residual_grows():
+    accelerator = FixedPointAccelerator("Aitken")
+    accelerator.accelerate('key', [0.0])
+    accelerator.accelerate('key', [1.0])
+    accelerator.accelerate('key', [1.5])
+    assert accelerator.history['key']['omega'] != 1.0
+    # The residual grows from 0.5 (or less) to 10
+    written = accelerator.history['key']['x'][0]
+    accelerator.accelerate('key', [written + 10.0])
+    assert accelerator.history['key']['omega'] == 1.0
+
+def test_disabled_accelerator_returns_values_unchanged():
+    accelerator = FixedPointAccelerator(None)
+    values = [[1.0, 2.0]]
+    assert accelerator.accelerate('key', values) is values
+    assert accelerator.accelerate('key', values) is values
+    accelerator.seed('key', [0.0, 0.0])
+    assert not accelerator.enabled
+    assert accelerator.history == {}
+
+def test_bounds_are_applied():
+    accelerator = FixedPointAccelerator("Anderson")
+    for values in [[10.0], [5.0], [2.0]]:
+        result = accelerator.accelerate('key', values, lower = 0, upper = 4)
+    assert 0 <= result[0] <= 4
+
+def test_seed_starts_acceleration_one_iteration_earlier():
+    g, _solution = linear_map()
+    seeded = FixedPointAccelerator("Anderson")
+    seeded.seed('key', np.zeros(6))
+    first = g(np.zeros(6))
+    # With seeded values, the first values computed are compared with them instead of starting the history
+    assert seeded.accelerate('key', first) is first
+    assert seeded.history['key']['f'] is not None
+    # A key is only seeded once, so seeding does not replace values already written
+    seeded.seed('key', np.ones(6))
+    assert np.array_equal(seeded.history['key']['x'], first)
+
+def test_written_replaces_values_last_written():
+    accelerator = FixedPointAccelerator("Anderson")
+    accelerator.accelerate('key', [1.0, 2.0])
+    accelerator.written('key', [1.5, 2.5])
+    assert np.array_equal(accelerator.history['key']['x'], [1.5, 2.5])
+    # Keys without history are ignored
+    accelerator.written('other', [1.0])
+    assert 'other' not in accelerator.history
+
+def test_forget_drops_keys_with_prefix():
+    accelerator = FixedPointAccelerator("Anderson")
+    for key in [("MaxAvail", "S1", "TOKTOGUL", 1), ("MaxAvail", "S2", "TOKTOGUL", 1), ("HPP demand", "S1", "Toktogul")]:
+        accelerator.accelerate(key, [1.0])
+    accelerator.forget(("MaxAvail", "S1"))
+    assert sorted(accelerator.history) == [("HPP demand", "S1", "Toktogul"), ("MaxAvail", "S2", "TOKTOGUL", 1)]
+
+def test_state_restore():
+    accelerator = FixedPointAccelerator("Anderson")
+    for values in [[1.0], [2.0], [2.5]]:
+        accelerator.accelerate('key', values)
+    restored = FixedPointAccelerator("Anderson")
+    restored.restore(copy.deepcopy(accelerator.state()))
+    assert np.array_equal(restored.accelerate('key', [2.8]), accelerator.accelerate('key', [2.8]))
@@ -0,0 +1,71 @@
+import os
+import time
+from utils.ames_cache import AmesCache
+
+def make_run(tmp_path, name, size):
+    """Write an output folder of about size bytes and a log for a run; returns [output folder, log file]"""
+    output_dir = tmp_path / "runs" / name
+    output_dir.mkdir(parents = True)
+    (output_dir / "results.csv").write_bytes(b"x" * size)
+    log_fname = tmp_path / "runs" / (name + ".log")
+    log_fname.write_text("log of " + name, encoding = 'utf-8')
+    return [str(output_dir), str(log_fname)]
+
+def test_disabled_cache_does_nothing(tmp_path):
+    cache = AmesCache(str(tmp_path / "Cache"), 0)
+    assert not cache.enabled
+    assert not os.path.exists(tmp_path / "Cache")
+
+def test_store_and_restore(tmp_path):
+    cache = AmesCache(str(tmp_path / "Cache"), 1)
+    output_dir, log_fname = make_run(tmp_path, "S1", 100)
+    expressions = [["Key\\GDP", "Activity Level", "Interp(2020, 1)"]]
+    cache.store("k1", output_dir, log_fname, expressions)
+    assert cache.lookup("k1")
+    assert not cache.lookup("k2")
+    restore_dir = tmp_path / "restored"
+    restored = cache.restore("k1", str(restore_dir), str(tmp_path / "restored.log"))
+    assert restored == expressions
+    assert (restore_dir / "results.csv").read_bytes() == b"x" * 100
+    assert (tmp_path / "restored.log").read_text(encoding = 'utf-8') == "log of S1"
+    assert [cache.hits, cache.misses] == [1, 1]
+
+def test_least_recently_used_entry_is_evicted(tmp_path):
+    # Room for two entries of about 3 kB, but not three
+    cache = AmesCache(str(tmp_path / "Cache"), 7000 / (1024 * 1024))
+    for name in ["k1", "k2"]:
+        cache.store(name, *make_run(tmp_path, name, 3000), [])
+        # Entries are ordered by the time they were last used
+        time.sleep(0.05)
+    # Using k1 makes k2 the least recently used entry
+    cache.restore("k1", str(tmp_path / "restored"), str(tmp_path / "restored.log"))
+    cache.store("k3", *make_run(tmp_path, "k3", 3000), [])
+    assert sorted(cache.index) == ["k1", "k3"]
+    assert not os.path.exists(tmp_path / "Cache" / "k2")
+    assert cache.evicted == 1
+
+def test_index_is_reloaded(tmp_path):
+    cache = AmesCache(str(tmp_path / "Cache"), 1)
+    cache.store("k1", *make_run(tmp_path, "k1", 10), [])
+    cache.store("k2", *make_run(tmp_path, "k2", 10), [])
+    # Entries whose folders were deleted are dropped
+    os.rename(tmp_path / "Cache" / "k2", tmp_path / "k2_removed")
+    reloaded = AmesCache(str(tmp_path / "Cache"), 1)
+    assert sorted(reloaded.index) == ["k1"]
+
+def test_run_key_ignores_leap_version_and_run_number(tmp_path):
+    model_dir = tmp_path / "KAZ_AMES"
+    (model_dir / "inputs").mkdir(parents = True)
+    (model_dir / "runames.jl").write_text("# script", encoding = 'utf-8')
+    (model_dir / "config.yml").write_text("output_folder: S1\nmodel: {max_runs: 0, hide_leap: false}\n", encoding = 'utf-8')
+    cache = AmesCache(str(tmp_path / "Cache"), 1)
+    script = str(model_dir / "runames.jl")
+    def key(version, run_number, leap_results):
+        return cache.run_key("S1", "Kazakhstan", script, ["S1", "-w", "-u", version, "-r", run_number, "--load-leap-first"], ["S1"], leap_results)
+    assert key("Iteration 1 - run A", "1", [[1.0, 2.0]]) == key("Iteration 3 - run B", "3", [[1.0, 2.0]])
+    # The LEAP results loaded by AMES are part of the key
+    assert key("Iteration 1 - run A", "1", [[1.0, 2.0]]) != key("Iteration 1 - run A", "1", [[1.0, 2.5]])
+    # So are the WEAP inputs for the scenario
+    before = key("Iteration 1 - run A", "1", None)
+    (model_dir / "inputs" / "S1_max_util.csv").write_text("1", encoding = 'utf-8')
+    assert key("Iteration 1 - run A", "1", None) != before
@@ -0,0 +1,123 @@
+import time
+import threading
+from collections import defaultdict
+from utils.ames_jobs import AmesJob, AmesJobPool
+
+class GatedRunner:
+    """Runner whose runs wait until the gate of the job's script is opened or the run is cancelled
+
+    Input arguments:
+        gates: dictionary of threading.Event keyed by script
+        statuses: exit status by script (default 0)
+        started: list to which the script of each run is appended when it starts
+    """
+    def __init__(self, gates, statuses, started):
+        self.gates = gates
+        self.statuses = statuses
+        self.started = started
+        self.script = None
+        self.cancelled = False
+
+    def run(self, script, args, log_fname):
+        self.script = script
+        self.started.append(script)
+        self.gates[script].wait(timeout = 10)
+        if self.cancelled:
+            return [1, "cancelled"]
+        return [self.statuses.get(script, 0), script]
+
+    def cancel(self):
+        self.cancelled = True
+        self.gates[self.script].set()
+
+    def close(self):
+        pass
+
+    def log_stats(self):
+        pass
+
+def make_pool(max_workers, statuses = None):
+    """Return [pool, gates, started scripts, runners made]"""
+    gates = defaultdict(threading.Event)
+    started = []
+    runners = []
+    def make_runner():
+        runners.append(GatedRunner(gates, statuses or {}, started))
+        return runners[-1]
+    return [AmesJobPool(make_runner, max_workers), gates, started, runners]
+
+def job(name, *resources):
+    return AmesJob(name, resources, name, [], name + ".log")
+
+def wait_until(condition, timeout = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+def test_all_jobs_complete():
+    pool, gates, started, runners = make_pool(2)
+    for name in ["a1", "b1", "a2"]:
+        gates[name].set()
+    for name, region in [("a1", "A"), ("b1", "B"), ("a2", "A")]:
+        pool.submit(job(name, region))
+    assert pool.wait() is None
+    assert sorted(started) == ["a1", "a2", "b1"]
+    assert pool.jobs == 3
+
+def test_jobs_sharing_a_resource_run_one_at_a_time():
+    pool, gates, started, runners = make_pool(3)
+    pool.submit(job("a1", "A"))
+    pool.submit(job("a2", "A"))
+    pool.submit(job("b1", "B"))
+    wait_until(lambda: len(started) == 2)
+    # a2 waits for a1, although a worker is free
+    assert sorted(started) == ["a1", "b1"]
+    gates["a1"].set()
+    wait_until(lambda: len(started) == 3)
+    assert started[2] == "a2"
+    gates["a2"].set()
+    gates["b1"].set()
+    assert pool.wait() is None
+    # The runner released by a1 is reused for a2
+    assert len(runners) == 2
+
+def test_jobs_using_leap_never_overlap():
+    pool, gates, started, runners = make_pool(3)
+    # Different regions, but all runs use LEAP
+    for name, region in [("a1", "A"), ("b1", "B"), ("c1", "C")]:
+        pool.submit(job(name, region, "LEAP"))
+    for name in ["a1", "b1", "c1"]:
+        wait_until(lambda: name in started)
+        assert len(pool.running) == 1
+        gates[name].set()
+    assert pool.wait() is None
+    assert started == ["a1", "b1", "c1"]
+    assert len(runners) == 1
+
+def test_failure_stops_pending_and_cancels_running_jobs():
+    pool, gates, started, runners = make_pool(2, {"bad": 1})
+    pool.submit(job("bad", "A"))
+    pool.submit(job("slow", "B"))
+    pool.submit(job("pending", "C"))
+    wait_until(lambda: len(started) == 2)
+    # Let the failing job return; the job still running is cancelled and the pending one is never started
+    gates["bad"].set()
+    failed = pool.wait()
+    assert failed is not None and failed.name == "bad"
+    assert next(r for r in runners if r.script == "slow").cancelled
+    assert "pending" not in started
+    # Jobs submitted after a failure are ignored
+    pool.submit(job("late", "D"))
+    assert pool.wait() is failed
+    assert "late" not in started
+
+def test_runner_exception_counts_as_failure():
+    class FailingRunner(GatedRunner):
+        def run(self, script, args, log_fname):
+            raise OSError("julia not found")
+    pool = AmesJobPool(lambda: FailingRunner(None, {}, []), 1)
+    pool.submit(job("a1", "A"))
+    failed = pool.wait()
+    assert failed.status == 1
+    assert "julia not found" in failed.output
@@ -0,0 +1,32 @@
+from utils.ames_worker import StubAmesWorker, AmesWorker, AmesProcess, ames_runner
+
+def test_stub_records_runs_and_writes_log(tmp_path):
+    stub = StubAmesWorker()
+    log_fname = tmp_path / "run.log"
+    status, output = stub.run("runames.jl", ["S1", "-y", 2050], str(log_fname))
+    assert status == 0
+    assert stub.calls == [["runames.jl", ["S1", "-y", "2050"], str(log_fname)]]
+    assert log_fname.read_text(encoding = 'utf-8') == output
+    assert '"S1" "-y" "2050"' in output
+
+def test_stub_returns_configured_status(tmp_path):
+    stub = StubAmesWorker(status = 3)
+    status, _output = stub.run("runames.jl", [], str(tmp_path / "run.log"))
+    assert status == 3
+
+def test_stub_has_runner_interface(tmp_path):
+    stub = StubAmesWorker()
+    stub.run("runames.jl", ["S1"], str(tmp_path / "run.log"))
+    stub.cancel()
+    stub.close()
+    stub.log_stats()
+    assert len(stub.calls) == 1
+
+def test_ames_runner_selection():
+    assert isinstance(ames_runner("Stub", "julia"), StubAmesWorker)
+    assert isinstance(ames_runner("stub", "julia"), StubAmesWorker)
+    assert isinstance(ames_runner(False, "julia"), AmesProcess)
+    worker = ames_runner(True, "julia")
+    assert isinstance(worker, AmesWorker)
+    # The worker is only started by its first run
+    assert worker.process is None
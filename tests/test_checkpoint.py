@@ -0,0 +1,53 @@
+import pytest
+from utils.checkpoint import Checkpoint, PHASES
+
+KEY = {'LEAP area': 'WAVE', 'WEAP area': 'WAVE'}
+
+def test_positions_follow_iterations_then_phases(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.pkl.gz"), KEY)
+    assert checkpoint.position(0, "Prepare") < checkpoint.position(0, "Calculate WEAP")
+    assert checkpoint.position(0, PHASES[-1]) < checkpoint.position(1, "Prepare")
+
+def test_nothing_completed_without_checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.pkl.gz"), KEY)
+    assert checkpoint.load() is None
+    assert not checkpoint.completed(0, "Prepare")
+
+def test_resumed_run_skips_completed_phases(tmp_path):
+    fname = str(tmp_path / "checkpoint.pkl.gz")
+    Checkpoint(fname, KEY).save(2, "Calculate LEAP", {'scenarios_map': {'S1': 'S1'}})
+    checkpoint = Checkpoint(fname, KEY)
+    assert checkpoint.load() == {'scenarios_map': {'S1': 'S1'}}
+    assert checkpoint.resume_position == (2, PHASES.index("Calculate LEAP"))
+    # Phases up to and including the last one saved were completed
+    assert checkpoint.completed(2, "Calculate LEAP")
+    assert checkpoint.completed(2, "WEAP to LEAP pumping")
+    assert checkpoint.completed(1, "WEAP to AMES")
+    assert not checkpoint.completed(2, "Record results")
+    assert not checkpoint.completed(3, "Prepare")
+    assert checkpoint.describe() == 'iteration 3, after "Calculate LEAP"'
+
+def test_checkpoint_for_other_models_is_ignored(tmp_path):
+    fname = str(tmp_path / "checkpoint.pkl.gz")
+    Checkpoint(fname, KEY).save(0, "Prepare", {})
+    checkpoint = Checkpoint(fname, dict(KEY, **{'LEAP area': 'Other'}))
+    assert checkpoint.load() is None
+    assert not checkpoint.completed(0, "Prepare")
+
+def test_disabled_checkpoint_is_not_written(tmp_path):
+    fname = tmp_path / "checkpoint.pkl.gz"
+    checkpoint = Checkpoint(str(fname), KEY, enabled = False)
+    checkpoint.save(0, "Prepare", {})
+    assert not fname.exists()
+
+def test_remove(tmp_path):
+    fname = tmp_path / "checkpoint.pkl.gz"
+    checkpoint = Checkpoint(str(fname), KEY)
+    checkpoint.save(0, "Prepare", {})
+    checkpoint.remove()
+    assert not fname.exists()
+    checkpoint.remove()
+
+def test_unknown_phase(tmp_path):
+    with pytest.raises(ValueError):
+        Checkpoint(str(tmp_path / "checkpoint.pkl.gz"), KEY).position(0, "Calculate NEMO")
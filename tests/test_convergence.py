@@ -0,0 +1,178 @@
+import numpy as np
+import pytest
+from utils.convergence import ConvergenceEngine, DamConvergence, relative_differences
+
+PLANTS = ['TOKTOGUL', 'KAIRAKKUM']
+YEARS = [2030, 2031, 2032]
+
+def make_engine(top_n = 5, tolerance = 0.1):
+    return ConvergenceEngine([PLANTS, YEARS], tolerance, top_n, names = ['Plant', 'Year'])
+
+def test_check_reports_rms_relative_difference():
+    engine = make_engine()
+    previous = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]])
+    current = np.array([[1.0, 2.5, 3.0], [4.0, 5.0, 3.0]])
+    engine.record('S1', previous)
+    engine.advance()
+    engine.record('S1', current)
+    result = engine.check()['S1']
+    expected = np.sqrt(np.mean(relative_differences(current, previous)**2))
+    assert result.test_value == pytest.approx(expected)
+    assert result.converged == (expected <= 0.1)
+    assert not result.converged
+
+def test_check_orders_offenders_largest_first():
+    engine = make_engine(top_n = 2)
+    engine.record('S1', np.ones(6))
+    engine.advance()
+    engine.record('S1', [1.0, 1.2, 1.0, 2.0, 1.0, 1.5])
+    result = engine.check()['S1']
+    assert [o[0] for o in result.offenders] == [['KAIRAKKUM', 2030], ['KAIRAKKUM', 2032]]
+    assert result.offenders[0][1] > result.offenders[1][1]
+    assert result.offenders[0][2:] == [1.0, 2.0]
+    assert result.largest == result.offenders[0]
+    assert result.describe_offenders() == 'KAIRAKKUM 2030 (66.67%); KAIRAKKUM 2032 (40.00%)'
+
+def test_check_with_top_n_zero_still_finds_largest():
+    engine = make_engine(top_n = 0)
+    engine.record('S1', np.ones(6))
+    engine.advance()
+    engine.record('S1', [1.0, 1.2, 1.0, 2.0, 1.0, 1.5])
+    result = engine.check()['S1']
+    assert result.offenders == []
+    assert result.largest[0] == ['KAIRAKKUM', 2030]
+
+def test_identical_iterations_converge():
+    engine = make_engine()
+    engine.record('S1', np.arange(6.0))
+    engine.advance()
+    engine.record('S1', np.arange(6.0))
+    result = engine.check()['S1']
+    assert result.test_value == 0.0
+    assert result.converged
+
+@pytest.mark.parametrize('top_n', [-1, 2.5, '5', True])
+def test_invalid_top_n_is_rejected(top_n):
+    with pytest.raises(ValueError):
+        make_engine(top_n = top_n)
+
+def test_record_rejects_wrong_size():
+    with pytest.raises(ValueError):
+        make_engine().record('S1', np.ones(5))
+
+def test_frozen_scenario_keeps_results_and_iteration():
+    engine = make_engine()
+    engine.record('S1', np.ones(6))
+    engine.record('S2', np.ones(6))
+    engine.advance()
+    engine.record('S1', np.full(6, 2.0))
+    engine.record('S2', np.full(6, 3.0))
+    engine.freeze('S1', 2)
+    assert 'S1' not in engine.check()
+    final = engine.final_results()
+    assert final['S1'][1] == 2
+    assert np.array_equal(final['S1'][0], np.full(6, 2.0))
+    # Scenarios still iterating report their latest results, without an iteration
+    assert final['S2'][1] is None
+    assert np.array_equal(final['S2'][0], np.full(6, 3.0))
+
+def test_csv_round_trip(tmp_path):
+    fname = str(tmp_path / "final_results.csv")
+    engine = make_engine()
+    engine.record('S1', np.arange(6.0))
+    engine.freeze('S1', 3)
+    engine.record('S2', np.arange(6.0) + 10)
+    engine.write_csv(fname)
+    later = make_engine()
+    assert sorted(later.read_csv(fname, ['S1', 'S2'])) == ['S1', 'S2']
+    assert np.array_equal(later.previous['S1'], np.arange(6.0))
+    assert np.array_equal(later.previous['S2'], np.arange(6.0) + 10)
+    # Only the scenarios asked for are read
+    assert make_engine().read_csv(fname, ['S2']) == ['S2']
+
+def test_read_csv_rejects_scenario_with_missing_rows(tmp_path):
+    fname = str(tmp_path / "final_results.csv")
+    engine = make_engine()
+    engine.record('S1', np.arange(6.0))
+    engine.record('S2', np.arange(6.0))
+    engine.write_csv(fname)
+    with open(fname) as f:
+        lines = f.readlines()
+    with open(fname, 'w') as f:
+        f.writelines(l for l in lines if not l.startswith('S2,,KAIRAKKUM'))
+    later = make_engine()
+    assert later.read_csv(fname, ['S1', 'S2']) == ['S1']
+    assert 'S2' not in later.previous
+
+def test_read_csv_rejects_file_without_all_years(tmp_path):
+    fname = str(tmp_path / "final_results.csv")
+    engine = ConvergenceEngine([PLANTS, YEARS[:2]], 0.1, names = ['Plant', 'Year'])
+    engine.record('S1', np.arange(4.0))
+    engine.write_csv(fname)
+    assert make_engine().read_csv(fname, ['S1']) == []
+
+def observe_both(dams, scenario, dam, values):
+    """Observe the same values in both directions; returns whether the dam was frozen by the second"""
+    dams.observe(DamConvergence.DIRECTIONS[0], scenario, dam, values)
+    return dams.observe(DamConvergence.DIRECTIONS[1], scenario, dam, values)
+
+def test_dam_freezes_only_when_both_directions_converge():
+    dams = DamConvergence(0.01)
+    weap_to_leap, leap_to_weap = DamConvergence.DIRECTIONS
+    dams.start_iteration(0)
+    assert not observe_both(dams, 'S1', 'TOKTOGUL', [1.0, 2.0])
+    dams.start_iteration(1)
+    # Only one direction is within tolerance
+    assert not dams.observe(weap_to_leap, 'S1', 'TOKTOGUL', [1.0, 2.0])
+    assert not dams.observe(leap_to_weap, 'S1', 'TOKTOGUL', [1.5, 2.0])
+    assert not dams.is_frozen('S1', 'TOKTOGUL')
+    dams.start_iteration(2)
+    assert not dams.observe(weap_to_leap, 'S1', 'TOKTOGUL', [1.0, 2.0])
+    assert dams.observe(leap_to_weap, 'S1', 'TOKTOGUL', [1.5, 2.0])
+    assert dams.frozen == {('S1', 'TOKTOGUL'): 2}
+    assert dams.frozen_count == 1
+    # The dam is only frozen in that scenario
+    assert not dams.is_frozen('S2', 'TOKTOGUL')
+
+def test_is_frozen_counts_skipped_exchanges():
+    dams = DamConvergence(0.01)
+    observe_both(dams, 'S1', 'TOKTOGUL', [1.0])
+    observe_both(dams, 'S1', 'TOKTOGUL', [1.0])
+    assert dams.skipped == 0
+    assert dams.is_frozen('S1', 'TOKTOGUL')
+    assert dams.is_frozen('S1', 'TOKTOGUL')
+    assert not dams.is_frozen('S1', 'KAIRAKKUM')
+    assert dams.skipped == 2
+
+def test_disabled_dams_never_freeze():
+    dams = DamConvergence(0.01, enabled = False)
+    observe_both(dams, 'S1', 'TOKTOGUL', [1.0])
+    assert not observe_both(dams, 'S1', 'TOKTOGUL', [1.0])
+    assert not dams.is_frozen('S1', 'TOKTOGUL')
+
+def test_forget_drops_only_that_scenario():
+    dams = DamConvergence(0.01)
+    for scenario in ['S1', 'S2']:
+        observe_both(dams, scenario, 'TOKTOGUL', [1.0])
+        observe_both(dams, scenario, 'TOKTOGUL', [1.0])
+    dams.forget('S1')
+    assert not dams.is_frozen('S1', 'TOKTOGUL')
+    assert dams.is_frozen('S2', 'TOKTOGUL')
+    assert all(k[1] == 'S2' for k in list(dams.last) + list(dams.within))
+    # Without earlier values, S1 starts over
+    assert not observe_both(dams, 'S1', 'TOKTOGUL', [1.0])
+
+def test_dam_state_restore():
+    dams = DamConvergence(0.01)
+    observe_both(dams, 'S1', 'TOKTOGUL', [1.0])
+    observe_both(dams, 'S1', 'TOKTOGUL', [1.0])
+    observe_both(dams, 'S1', 'KAIRAKKUM', [1.0])
+    dams.is_frozen('S1', 'TOKTOGUL')
+    restored = DamConvergence(0.01)
+    restored.restore(dams.state())
+    assert restored.frozen == dams.frozen
+    assert restored.frozen_count == 1
+    assert restored.skipped == 1
+    assert restored.is_frozen('S1', 'TOKTOGUL')
+    # The values observed before the checkpoint are compared with the next ones
+    assert observe_both(restored, 'S1', 'KAIRAKKUM', [1.0])
@@ -0,0 +1,97 @@
+import numpy as np
+from utils.leap_weap import index_leap_columns, proc_leap_hpp, leapfloat, read_leap_export_header, read_leap_export_chunks, LEAP_EXPORT_FIELD_BYTES
+
+MONTHS = ['January', 'February', 'March']
+
+PROCESSES = 'Transformation\\Electricity Production\\Processes\\'
+
+def plants(*names):
+    """Return plants in the form of config.yml, each with the LEAP branch given after '=' (or its own name)"""
+    entries = {}
+    for name in names:
+        plant, _sep, branch = name.partition('=')
+        entries[plant] = {'leap_path': PROCESSES + (branch or plant)}
+    return entries
+
+def test_plant_name_is_not_matched_inside_longer_name():
+    labels = ['2020 CHIRCHIK_1', '2020 CHIRCHIK_1X', '2021 CHIRCHIK_1X', '2021 CHIRCHIK_1']
+    index = index_leap_columns(labels, plants('CHIRCHIK_1', 'CHIRCHIK_1X'))
+    assert index['CHIRCHIK_1'] == {'cols': [0, 3], 'years': [2020, 2021]}
+    assert index['CHIRCHIK_1X'] == {'cols': [1, 2], 'years': [2020, 2021]}
+
+def test_longer_name_wins_when_label_is_not_a_plant_or_branch():
+    labels = ['2020 CHIRCHIK_1X (Uzbekistan)', '2020 CHIRCHIK_1 (Uzbekistan)']
+    index = index_leap_columns(labels, plants('CHIRCHIK_1', 'CHIRCHIK_1X'))
+    assert index['CHIRCHIK_1']['cols'] == [1]
+    assert index['CHIRCHIK_1X']['cols'] == [0]
+
+def test_shared_cascade_branch_goes_to_every_plant_with_that_branch():
+    labels = ['Time slice', '2020 SUUSAMYR_KOKOMEREN CASCADE', '2020 TOKTOGUL', '2021 SUUSAMYR_KOKOMEREN CASCADE']
+    index = index_leap_columns(labels, plants('KOKOMEREN=SUUSAMYR_KOKOMEREN CASCADE', 'SUUSAMYR_KOKOMEREN CASCADE', 'TOKTOGUL'))
+    assert index['KOKOMEREN'] == {'cols': [1, 3], 'years': [2020, 2021]}
+    assert index['SUUSAMYR_KOKOMEREN CASCADE'] == index['KOKOMEREN']
+    assert index['TOKTOGUL'] == {'cols': [2], 'years': [2020]}
+
+def test_unmatched_labels_are_skipped():
+    index = index_leap_columns(['Time slice', '2020 KAMBARATA_2', 'Total'], plants('TOKTOGUL'))
+    assert index['TOKTOGUL'] == {'cols': [], 'years': []}
+
+def write_leap_export(fname, labels, rows):
+    """Write a LEAP export with a title and a "Time slice" header row, followed by [time slice, values] rows"""
+    with open(fname, 'w') as f:
+        f.write('Area: WAVE\nScenario: Baseline\n\n')
+        f.write(','.join(['Time slice'] + labels) + '\n')
+        for ts, vals in rows:
+            f.write(','.join([ts] + vals) + '\n')
+
+def make_export(tmp_path, slices = 4):
+    """Write an export for two plants and two years, with "-" values and a total row; returns [file name, labels, rows]"""
+    labels = ['2020 TOKTOGUL', '2020 KAMBARATA_2', '2020 CHIRCHIK_1', '2021 TOKTOGUL', '2021 CHIRCHIK_1']
+    rng = np.random.default_rng(1)
+    rows = []
+    for m in MONTHS:
+        for hour in range(1, slices + 1):
+            vals = ['{v:.3f}'.format(v = v) for v in rng.random(len(labels)) * 100]
+            vals[hour % len(labels)] = '-'
+            rows.append(['{m}: Hour {h}'.format(m = m, h = hour), vals])
+    rows.append(['Total', ['999'] * len(labels)])
+    fname = str(tmp_path / "Baseline_HPP.csv")
+    write_leap_export(fname, labels, rows)
+    return [fname, labels, rows]
+
+def monthly_sums(labels, rows, label):
+    """Sum the values in the column with label by month, directly from the rows of an export"""
+    col = labels.index(label)
+    return {m: sum(leapfloat(vals[col]) for ts, vals in rows if ts.startswith(m + ':')) for m in MONTHS}
+
+def config(memory_mb = None):
+    return {'LEAP': {'Months': MONTHS, 'Hydropower_plants': {'plants': plants('TOKTOGUL', 'CHIRCHIK_1')}},
+            'Integrated model': {'LEAP export memory (MB)': memory_mb}}
+
+def check_against_direct_sums(hpp, labels, rows):
+    assert hpp['TOKTOGUL']['years'] == [2020, 2021]
+    for h in ['TOKTOGUL', 'CHIRCHIK_1']:
+        for y, year in enumerate([2020, 2021]):
+            expected = monthly_sums(labels, rows, '{y} {h}'.format(y = year, h = h))
+            for m in MONTHS:
+                assert np.isclose(hpp[h]['vals'][m][y], expected[m])
+
+def test_time_slices_are_summed_by_month(tmp_path):
+    fname, labels, rows = make_export(tmp_path)
+    check_against_direct_sums(proc_leap_hpp(fname, config()), labels, rows)
+
+def test_time_slices_are_summed_by_month_with_time_slice_info(tmp_path):
+    fname, labels, rows = make_export(tmp_path)
+    leap_ts_info = {ts: MONTHS.index(ts.split(':')[0]) + 1 for ts, _vals in rows if ':' in ts}
+    check_against_direct_sums(proc_leap_hpp(fname, config(), leap_ts_info), labels, rows)
+
+def test_chunks_that_split_months_give_the_same_sums(tmp_path):
+    fname, labels, rows = make_export(tmp_path, slices = 5)
+    # Memory for 3 rows of the 4 columns used: 16 rows (with the total row) are read in chunks of 3, which split
+    # the 5 time slices of each month
+    used_cols = [0, 2, 3, 4]
+    hdr_row, hdr = read_leap_export_header(fname, "Time slice")
+    memory_mb = 3 * (LEAP_EXPORT_FIELD_BYTES * len(hdr) + 8 * len(used_cols)) / 2**20
+    chunks = [len(chunk_labels) for chunk_labels, _data in read_leap_export_chunks(fname, hdr_row, hdr, used_cols, memory_mb)]
+    assert chunks == [3, 3, 3, 3, 3, 1]
+    check_against_direct_sums(proc_leap_hpp(fname, config(memory_mb)), labels, rows)
@@ -0,0 +1,162 @@
+import sys
+import logging
+import math
+import numpy as np
+
+#==================================================================================================#
+# Acceleration of the fixed-point iteration between LEAP and WEAP
+#
+# Each iteration of main_integration() computes the values passed from one model to the other (e.g., the
+# monthly maximum availabilities MaxAvail_* written to LEAP, or the hydropower energy demand written to WEAP)
+# from the results of the previous iteration. With plain substitution, those values are written as they
+# are. FixedPointAccelerator instead combines them with the values written in earlier iterations:
+#   - "Aitken": Aitken's delta-squared method with dynamic relaxation (Irons-Tuck), which rescales each
+#     step by a relaxation factor estimated from the last two residuals. The factor is kept within
+#     AITKEN_RELAXATION_BOUNDS, and reset to 1 (plain substitution) whenever the residual grows, because with
+#     noisy or stalled residuals it can otherwise grow without limit
+#   - "Anderson": Anderson mixing, which extrapolates from the residuals of the last few iterations
+# where the residual is the difference between the newly computed values and the values last written.
+#
+# Each series of values is accelerated separately, keyed by, e.g., (quantity, scenario, plant). The
+# accelerator also estimates how many iterations it saved. The rate at which plain substitution would
+# shrink residuals is estimated from how much the computed values changed in response to changes in the
+# written values, and the iterations that plain substitution would have needed to reduce the residual as
+# much as it was reduced are compared with the iterations made.
+#==================================================================================================#
+
+ACCELERATION_METHODS = ['aitken', 'anderson']
+# Bounds on the Aitken (Irons-Tuck) relaxation factor
+AITKEN_RELAXATION_BOUNDS = (0.1, 30.0)
+
+class FixedPointAccelerator:
+    """Accelerate the values passed between LEAP and WEAP in successive iterations
+
+    Input arguments:
+        method: "Aitken" or "Anderson" (case insensitive), or None for plain substitution
+        memory: number of previous iterations used for Anderson mixing
+    """
+    def __init__(self, method = None, memory = 2):
+        self.method = method.lower() if method else None
+        if self.method is not None and self.method not in ACCELERATION_METHODS:
+            msg = _('Unknown acceleration method "{m}"; use one of {l}. Exiting...').format(m = method, l = ", ".join(ACCELERATION_METHODS))
+            logging.error(msg)
+            sys.exit(msg)
+        self.memory = max(1, int(memory))
+        self.history = {} # By key: dictionary with last written values, residuals, and Anderson/Aitken state
+        self.iteration = 0
+        self.residuals = {} # Sums of squares of [residuals, computed values] by iteration
+        self.responses = {} # Sums of squares of [changes in computed values, changes in written values] by iteration
+
+    @property
+    def enabled(self):
+        return self.method is not None
+
+    def start_iteration(self, iteration):
+        """Set the number of the current iteration (e.g., completed_iterations in main_integration())"""
+        self.iteration = iteration
+
+    def accelerate(self, key, values, lower = None, upper = None):
+        """Return the values to write for key, given the values computed by plain substitution
+
+        Input arguments:
+            key: identifies a series of values (e.g., ("MaxAvail", scenario, plant, month))
+            values: values computed from the latest results (a list or array of any shape)
+            lower, upper: optional bounds on the values to write
+        Returns: values unchanged if acceleration is disabled or there is not enough history; otherwise a NumPy
+            array of accelerated values with the same shape
+        """
+        if not self.enabled:
+            return values
+        shape = np.shape(values)
+        g = np.asarray(values, dtype = np.float64).ravel()
+        h = self.history.get(key)
+        if h is None or h['x'].size != g.size:
+            self.history[key] = {'x': g, 'x_prev': None, 'f': None, 'g': None, 'dF': [], 'dG': [], 'omega': 1.0}
+            return values
+        # Residual of the last written values
+        f = g - h['x']
+        sums = self.residuals.setdefault(self.iteration, [0.0, 0.0])
+        sums[0] += float(np.dot(f, f))
+        sums[1] += float(np.dot(g, g))
+        if h['g'] is not None and h['x_prev'] is not None:
+            dg = g - h['g']
+            dx = h['x'] - h['x_prev']
+            sums = self.responses.setdefault(self.iteration, [0.0, 0.0])
+            sums[0] += float(np.dot(dg, dg))
+            sums[1] += float(np.dot(dx, dx))
+        x_new = None
+        if h['f'] is not None:
+            df = f - h['f']
+            if self.method == 'aitken':
+                # Irons-Tuck update of the relaxation factor, within bounds; restart from plain substitution if the residual grew
+                denom = float(np.dot(df, df))
+                if float(np.dot(f, f)) > float(np.dot(h['f'], h['f'])):
+                    h['omega'] = 1.0
+                elif denom > 0:
+                    h['omega'] = float(np.clip(-h['omega'] * float(np.dot(h['f'], df)) / denom, *AITKEN_RELAXATION_BOUNDS))
+                x_new = h['x'] + h['omega'] * f
+            else:
+                h['dF'] = (h['dF'] + [df])[-self.memory:]
+                h['dG'] = (h['dG'] + [g - h['g']])[-self.memory:]
+                dF = np.column_stack(h['dF'])
+                gamma = np.linalg.lstsq(dF, f, rcond = None)[0]
+                x_new = g - np.column_stack(h['dG']) @ gamma
+            if not np.all(np.isfinite(x_new)):
+                x_new = None
+        h['f'] = f
+        h['g'] = g
+        h['x_prev'] = h['x']
+        if x_new is None:
+            h['x'] = g
+            return values
+        if lower is not None or upper is not None:
+            x_new = np.clip(x_new, lower, upper)
+        h['x'] = x_new
+        return x_new.reshape(shape)
+
+    def seed(self, key, values):
+        """Use values as the values last written for key (e.g., from a warm start), so that acceleration can start an iteration earlier"""
+        if self.enabled and key not in self.history:
+            self.history[key] = {'x': np.asarray(values, dtype = np.float64).ravel(), 'x_prev': None, 'f': None, 'g': None, 'dF': [], 'dG': [], 'omega': 1.0}
+
+    def written(self, key, values):
+        """Record the values actually written for key, if they differ from those returned (e.g., after rounding)"""
+        if self.enabled and key in self.history:
+            self.history[key]['x'] = np.asarray(values, dtype = np.float64).ravel()
+
+    def forget(self, key_prefix):
+        """Drop the history of keys starting with key_prefix (e.g., (quantity, scenario) once a scenario converged)"""
+        n = len(key_prefix)
+        for key in [k for k in self.history if k[:n] == key_prefix]:
+            del self.history[key]
+
+    def state(self):
+        """Return the history of written values and residuals (e.g., to write a checkpoint)"""
+        return {'history': self.history, 'residuals': self.residuals, 'responses': self.responses}
+
+    def restore(self, state):
+        """Restore information returned by state()"""
+        self.history = dict(state['history'])
+        self.residuals = dict(state['residuals'])
+        self.responses = dict(state['responses'])
+
+    def log_stats(self):
+        """Log the relative residual by iteration and an estimate of the number of iterations saved"""
+        if not self.enabled or not self.residuals:
+            return
+        iterations = sorted(self.residuals)
+        rel = {i: math.sqrt(r / v) if v > 0 else 0.0 for i, (r, v) in self.residuals.items()}
+        logging.info(_('Acceleration ({m}): relative residual by iteration: {r}').format(m = self.method, r = ", ".join("{i}: {v:.3g}".format(i = i + 1, v = rel[i]) for i in iterations)))
+        # Rate of convergence of plain substitution: the ratio of changes in computed values to changes in written values, over all iterations
+        dg = sum(r[0] for r in self.responses.values())
+        dx = sum(r[1] for r in self.responses.values())
+        if len(iterations) < 2 or dx <= 0 or rel[iterations[0]] <= 0 or rel[iterations[-1]] <= 0:
+            logging.info(_('Acceleration ({m}): too few iterations to estimate the number of iterations saved').format(m = self.method))
+            return
+        rate = math.sqrt(dg / dx)
+        if rate >= 1:
+            logging.info(_('Acceleration ({m}): plain substitution would not converge (estimated rate {q:.3g} per iteration); cannot estimate the number of iterations saved').format(m = self.method, q = rate))
+            return
+        made = iterations[-1] - iterations[0]
+        needed = math.log(rel[iterations[-1]] / rel[iterations[0]]) / math.log(rate)
+        logging.info(_('Acceleration ({m}): residual reduced by a factor of {f:.3g} in {n} iteration(s); plain substitution at its estimated rate of {q:.3g} per iteration would need {p:.1f}, so about {s:.1f} iteration(s) saved').format(m = self.method, f = rel[iterations[0]] / rel[iterations[-1]], n = made, q = rate, p = needed, s = needed - made))
@@ -0,0 +1,203 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import yaml
+
+#==================================================================================================#
+# Cache of AMES results
+#
+# An AMES run is determined by the scenario, the region, the arguments passed to the region's script
+# (runames.jl), the files in the region's AMES folder, the input files written for the scenario by
+# weap_to_ames_processing() (_max_util.csv, _realoutputindex.csv, _priceindex.csv), and, for runs with
+# --load-leap-first, the LEAP results that AMES loads. AmesCache hashes all of these into a key, and keeps
+# what a run leaves behind under that key:
+#   - the output folder of the scenario in the region's AMES folder (AMES writes to a folder named after the
+#     scenario)
+#   - the log of the run
+#   - the expressions AMES wrote to LEAP for the region, read back by main_integration() after the run
+# When a run with the same key is requested again, main_integration() restores these instead of running AMES.
+#
+# Hashed folder contents exclude what runames.jl and AMES change during a run: the output folders of all
+# scenarios, and the entries of the AMES configuration file that runames.jl sets from its arguments. Input
+# files generated from WEAP for other scenarios are also excluded. The LEAP version (-u) and the initial run
+# number (-r) are not hashed: they differ in every iteration and every integration run, while the LEAP
+# results that AMES loads from that version are hashed instead, as read by the caller. The AMES package
+# itself is not hashed, so the cache should be cleared (by deleting its folder) after updating AMES.
+#
+# Entries are evicted, least recently used first, when the cache grows beyond its size limit. The index of
+# entries is a JSON file in the cache folder, replaced atomically.
+#==================================================================================================#
+
+# Input files written by weap_to_ames_processing(), named {LEAP scenario}{suffix}
+WEAP_INPUT_SUFFIXES = ["_max_util.csv", "_realoutputindex.csv", "_priceindex.csv"]
+# Entries of the AMES configuration file set by runames.jl from its command-line arguments
+RUNAMES_CONFIG_ENTRIES = [["output_folder"], ["LEAP-info", "scenario"], ["model", "hide_leap"], ["model", "run_leap"], ["model", "max_runs"],
+                          ["years", "end"], ["report-diagnostics"], ["exog-files"], ["clear-folders"]]
+# Options of runames.jl whose values are not hashed
+UNHASHED_OPTIONS = ["-u", "--use-leap-version", "-r", "--init-run-number"]
+INDEX_FILE = "index.json"
+
+def _folder_size(directory):
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _dirs, files in os.walk(directory) for f in files)
+
+class AmesCache:
+    """Keep the results of AMES runs, keyed by a hash of everything a run depends on
+
+    Input arguments:
+        directory: cache folder; created if it does not exist
+        max_mb: maximum size of the cache in MB; if zero, nothing is cached
+    """
+    def __init__(self, directory, max_mb):
+        self.directory = directory
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.enabled = self.max_bytes > 0
+        self.file_hashes = {} # Hashes of files keyed by (path, size, modification time)
+        self.folder_hashes = {} # Hashes of AMES folders, kept until forget_folders() is called
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.index = {}
+        if self.enabled:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            fname = os.path.join(directory, INDEX_FILE)
+            if os.path.isfile(fname):
+                try:
+                    with open(fname, encoding = 'utf-8') as f:
+                        self.index = json.load(f)
+                except (OSError, ValueError) as e:
+                    logging.warning(_('Could not read the index of the AMES cache in {d} ({e}); starting an empty cache').format(d = directory, e = e))
+            # Drop entries whose folders were deleted
+            self.index = {k: v for k, v in self.index.items() if os.path.isdir(os.path.join(directory, k))}
+
+    def _file_hash(self, path):
+        st = os.stat(path)
+        memo_key = (path, st.st_size, st.st_mtime_ns)
+        if memo_key not in self.file_hashes:
+            h = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    h.update(block)
+            self.file_hashes[memo_key] = h.hexdigest()
+        return self.file_hashes[memo_key]
+
+    def _config_hash(self, path):
+        """Hash the AMES configuration file, leaving out the entries set by runames.jl"""
+        with open(path, encoding = 'utf-8') as f:
+            config = yaml.safe_load(f) or {}
+        for entry in RUNAMES_CONFIG_ENTRIES:
+            d = config
+            for k in entry[:-1]:
+                d = d.get(k) if isinstance(d, dict) else None
+            if isinstance(d, dict):
+                d.pop(entry[-1], None)
+        return hashlib.sha256(json.dumps(config, sort_keys = True, default = str).encode('utf-8')).hexdigest()
+
+    def _folder_hash(self, directory, skip_top = (), skip_file = None):
+        """Hash names and contents of the files in directory, except top-level entries in skip_top and files for which skip_file(name) is True"""
+        h = hashlib.sha256()
+        for d, dirs, files in os.walk(directory):
+            rel = os.path.relpath(d, directory)
+            if rel == os.curdir:
+                dirs[:] = [x for x in dirs if x not in skip_top]
+                files = [x for x in files if x not in skip_top]
+            dirs.sort()
+            for f in sorted(files):
+                if skip_file is not None and skip_file(f):
+                    continue
+                h.update(os.path.normcase(os.path.join(rel, f)).encode('utf-8') + b'\0' + self._file_hash(os.path.join(d, f)).encode('ascii'))
+        return h.hexdigest()
+
+    def run_key(self, scenario, region, script, args, scenarios, leap_results = None, config_file = "config.yml"):
+        """Return the key of an AMES run
+
+        Input arguments:
+            scenario, region: scenario and region of the run
+            script: script run for the region, in the region's AMES folder
+            args: command-line arguments of the script; the values of UNHASHED_OPTIONS are left out
+            scenarios: all scenarios that AMES may be run for (their output folders are not hashed)
+            leap_results: LEAP results loaded by AMES during the run (e.g., lists of values by year), or None
+            config_file: AMES configuration file in the region's AMES folder
+        """
+        model_dir = os.path.dirname(os.path.abspath(script))
+        if model_dir not in self.folder_hashes:
+            config_fname = os.path.join(model_dir, config_file)
+            self.folder_hashes[model_dir] = [self._folder_hash(model_dir, skip_top = set(scenarios) | {"inputs", config_file}),
+                                             self._config_hash(config_fname) if os.path.isfile(config_fname) else ""]
+        # Input files generated from WEAP are only read with the -w argument, and only for the scenario being run
+        use_weap_inputs = "-w" in args or "--use-weap-results" in args
+        def skip_input(f):
+            return any(f.endswith(x) for x in WEAP_INPUT_SUFFIXES) and not (use_weap_inputs and any(f == scenario + x for x in WEAP_INPUT_SUFFIXES))
+        inputs_dir = os.path.join(model_dir, "inputs")
+        inputs_hash = self._folder_hash(inputs_dir, skip_file = skip_input) if os.path.isdir(inputs_dir) else ""
+        hashed_args = [str(a) for i, a in enumerate(args) if a not in UNHASHED_OPTIONS and (i == 0 or args[i - 1] not in UNHASHED_OPTIONS)]
+        parts = [scenario, region, os.path.basename(script), hashed_args] + self.folder_hashes[model_dir] + [inputs_hash, leap_results]
+        return hashlib.sha256(json.dumps(parts, default = str).encode('utf-8')).hexdigest()
+
+    def forget_folders(self):
+        """Hash AMES folders again for later runs (e.g., once a set of runs has completed)"""
+        self.folder_hashes = {}
+
+    def lookup(self, key):
+        """Return True if results are cached for key, counting a hit or a miss"""
+        if key in self.index:
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def restore(self, key, output_dir, log_fname):
+        """Restore the output folder and log saved for key to output_dir and log_fname
+
+        Returns: list of [LEAP branch, variable, expression] written by AMES
+        """
+        entry_dir = os.path.join(self.directory, key)
+        if os.path.isdir(output_dir):
+            shutil.rmtree(output_dir)
+        if os.path.isdir(os.path.join(entry_dir, "output")):
+            shutil.copytree(os.path.join(entry_dir, "output"), output_dir)
+        shutil.copyfile(os.path.join(entry_dir, "run.log"), log_fname)
+        with open(os.path.join(entry_dir, "leap.json"), encoding = 'utf-8') as f:
+            leap_expressions = json.load(f)
+        self.index[key]['last_used'] = time.time()
+        self._write_index()
+        return leap_expressions
+
+    def store(self, key, output_dir, log_fname, leap_expressions):
+        """Save the output folder, log, and LEAP expressions ([branch, variable, expression]) of a completed run under key"""
+        entry_dir = os.path.join(self.directory, key)
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.makedirs(entry_dir)
+        if os.path.isdir(output_dir):
+            shutil.copytree(output_dir, os.path.join(entry_dir, "output"))
+        shutil.copyfile(log_fname, os.path.join(entry_dir, "run.log"))
+        with open(os.path.join(entry_dir, "leap.json"), 'w', encoding = 'utf-8') as f:
+            json.dump(leap_expressions, f)
+        self.index[key] = {'size': _folder_size(entry_dir), 'last_used': time.time()}
+        self._evict()
+        self._write_index()
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache is within its size limit"""
+        total = sum(v['size'] for v in self.index.values())
+        for key in sorted(self.index, key = lambda k: self.index[k]['last_used']):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors = True)
+            total -= self.index.pop(key)['size']
+            self.evicted += 1
+
+    def _write_index(self):
+        fname = os.path.join(self.directory, INDEX_FILE)
+        with open(fname + ".tmp", 'w', encoding = 'utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(fname + ".tmp", fname)
+
+    def log_stats(self):
+        if self.enabled:
+            logging.info(_('AMES cache: {h} hit(s), {m} miss(es), {e} entries evicted; {n} entries, {s:.1f} MB').format(
+                h = self.hits, m = self.misses, e = self.evicted, n = len(self.index), s = sum(v['size'] for v in self.index.values()) / (1024 * 1024)))
@@ -0,0 +1,131 @@
+import time
+import logging
+import threading
+from collections import deque
+
+#==================================================================================================#
+# Concurrent AMES runs
+#
+# AmesJobPool runs AMES jobs (one scenario in one region) on up to max_workers threads, each with its own
+# runner from utils/ames_worker.py (a Julia worker, a Julia process per run, or a stub), so that runs are
+# started as soon as their inputs are ready and the integration program can go on (e.g., exporting WEAP
+# results for the next scenario) while they run. Each job writes its output to its own log file.
+#
+# Each job holds a set of resources while it runs, and jobs that share a resource are never run at the same
+# time. runames.jl rewrites the configuration file in the region's AMES folder, so runs in the same region
+# must follow one another (the folder is a resource). AMES also drives the running LEAP instance over COM
+# when it loads LEAP results or pushes its own (it sets the active scenario and region, writes expressions,
+# and reads results), so runs that use LEAP must not overlap either ("LEAP" is a resource). Jobs start in
+# the order in which they were submitted, skipping jobs with a resource in use.
+#
+# The pool fails fast: once a job returns a nonzero exit status, no other job is started, the runners of
+# jobs that are still running are cancelled, and wait() returns the failed job.
+#==================================================================================================#
+
+class AmesJob:
+    """A run of an AMES script
+
+    Attributes:
+        name: description of the job for log messages (e.g., scenario and region)
+        resources: names of resources the job uses exclusively (e.g., the region's AMES folder, and "LEAP"); jobs
+            sharing a resource are run one after the other
+        script, args, log_fname: arguments for the run() method of the runner
+        status, output: exit status and output of the run, once it has completed
+    """
+    def __init__(self, name, resources, script, args, log_fname):
+        self.name = name
+        self.resources = set(resources)
+        self.script = script
+        self.args = args
+        self.log_fname = log_fname
+        self.status = None
+        self.output = None
+        self.elapsed = 0.0
+
+class AmesJobPool:
+    """Run AMES jobs concurrently, with at most max_workers at a time
+
+    Input arguments:
+        make_runner: function returning a new runner (e.g., AmesWorker); one runner is made for each thread, as needed
+        max_workers: maximum number of jobs run at the same time
+    Notes:
+        The pool has the close() and log_stats() methods of the runners, so it can be used in their place.
+    """
+    def __init__(self, make_runner, max_workers = 1):
+        self.make_runner = make_runner
+        self.max_workers = max(1, int(max_workers))
+        self.runners = []
+        self.idle = [] # Runners not running a job
+        self.pending = deque()
+        self.running = {} # Runner running each job
+        self.busy_resources = set()
+        self.failure = None # First job that failed
+        self.jobs = 0
+        self.busy_time = 0.0
+        self.lock = threading.Condition()
+
+    def submit(self, job):
+        """Queue job, starting it at once if a worker is free; jobs submitted after a failure are ignored"""
+        with self.lock:
+            if self.failure is not None:
+                return
+            self.pending.append(job)
+            self._dispatch()
+
+    def _dispatch(self):
+        """Start pending jobs while workers are free (called with the lock held)"""
+        while self.failure is None and len(self.running) < self.max_workers:
+            job = next((j for j in self.pending if not (j.resources & self.busy_resources)), None)
+            if job is None:
+                return
+            self.pending.remove(job)
+            if self.idle:
+                runner = self.idle.pop()
+            else:
+                runner = self.make_runner()
+                self.runners.append(runner)
+            self.running[job] = runner
+            self.busy_resources |= job.resources
+            threading.Thread(target = self._run, args = (job, runner), daemon = True).start()
+
+    def _run(self, job, runner):
+        start = time.perf_counter()
+        try:
+            job.status, job.output = runner.run(job.script, job.args, job.log_fname)
+        except Exception as e:
+            job.status, job.output = 1, _('Could not run AMES: {e}').format(e = e)
+        job.elapsed = time.perf_counter() - start
+        with self.lock:
+            del self.running[job]
+            self.busy_resources -= job.resources
+            self.idle.append(runner)
+            self.jobs += 1
+            self.busy_time += job.elapsed
+            if job.status == 0:
+                logging.info('\t' + _('AMES completed for {j} in {t:.1f} s').format(j = job.name, t = job.elapsed))
+            elif self.failure is None:
+                self.failure = job
+                self.pending.clear()
+                for other in self.running.values():
+                    other.cancel()
+            self._dispatch()
+            self.lock.notify_all()
+
+    def wait(self):
+        """Wait until all jobs submitted have completed, or until a job fails and the jobs still running have stopped
+
+        Returns: the first job that failed, or None if all jobs completed
+        """
+        with self.lock:
+            while self.running or (self.pending and self.failure is None):
+                self.lock.wait()
+            return self.failure
+
+    def close(self):
+        for runner in self.runners:
+            runner.close()
+
+    def log_stats(self):
+        logging.info(_('AMES jobs: {n} completed, up to {w} at a time; {t:.1f} s of AMES runs').format(n = self.jobs, w = self.max_workers, t = self.busy_time))
+        for runner in self.runners:
+            runner.log_stats()
@@ -0,0 +1,175 @@
+import os
+import atexit
+import logging
+import subprocess
+
+#==================================================================================================#
+# Running AMES
+#
+# AMES is run through a Julia script in each region's AMES folder (scripts/runames.jl in this repository),
+# with the scenario and options as command-line arguments. Launching julia.exe for every run pays for
+# starting Julia and for loading and compiling AMES and its dependencies every time. AmesWorker instead
+# starts scripts/ames_worker.jl once and sends it one request per run over a pipe: the worker runs the
+# region's script in the same Julia session, with the requested arguments, and answers with the exit
+# status. AmesProcess launches julia.exe for each run, as before, and StubAmesWorker stands in for either
+# without running AMES (e.g., for tests). All three take the same requests and return the exit status and
+# the output of the run, which is also written to a log file.
+#
+# Protocol of ames_worker.jl (one line per message, fields separated by tabs):
+#   worker -> integration: "READY" once AMES is loaded
+#   integration -> worker: "RUN", log file, script, argument 1, argument 2, ... or "QUIT"
+#   worker -> integration: "DONE", exit status
+#==================================================================================================#
+
+AMES_WORKER_SCRIPT = os.path.join("scripts", "ames_worker.jl")
+
+def _read_log(log_fname):
+    if not os.path.isfile(log_fname):
+        return ""
+    with open(log_fname, encoding = 'utf-8', errors = 'replace') as f:
+        return f.read()
+
+class AmesWorker:
+    """Run AMES scripts in a long-lived Julia process
+
+    Input arguments:
+        juliapath: Julia executable
+        worker_script: the worker script (scripts/ames_worker.jl)
+    Notes:
+        The worker is started by the first run, and restarted if it stops (e.g., if a script calls exit()).
+    """
+    def __init__(self, juliapath, worker_script = AMES_WORKER_SCRIPT):
+        self.command = [juliapath, "--startup-file=no", os.path.abspath(worker_script)]
+        self.process = None
+        self.starts = 0
+        self.runs = 0
+        atexit.register(self.close)
+
+    def _start(self):
+        """Start the worker; returns an error message, or None if the worker is ready"""
+        logging.info('\t' + _('Starting AMES worker: {c}').format(c = " ".join('"' + c + '"' for c in self.command)))
+        try:
+            self.process = subprocess.Popen(self.command, stdin = subprocess.PIPE, stdout = subprocess.PIPE, text = True, encoding = 'utf-8', bufsize = 1)
+        except OSError as e:
+            self.process = None
+            return _('Could not start the AMES worker: {e}').format(e = e)
+        self.starts += 1
+        # Julia may print messages (e.g., warnings) while loading AMES
+        output = []
+        for line in self.process.stdout:
+            if line.rstrip('\n') == "READY":
+                if output:
+                    logging.info('\t' + _('Output of the AMES worker while loading AMES:') + '\n' + "".join(output))
+                return None
+            output.append(line)
+        self.process.wait()
+        self.process = None
+        return _('The AMES worker stopped before it was ready:') + '\n' + "".join(output)
+
+    def run(self, script, args, log_fname):
+        """Run AMES script with command-line arguments args, sending its output to log_fname
+
+        Returns: [exit status, output of the run]
+        """
+        fields = ["RUN", os.path.abspath(log_fname), os.path.abspath(script)] + [str(a) for a in args]
+        if any('\t' in f or '\n' in f for f in fields):
+            raise ValueError('Arguments for AMES cannot contain tabs or line breaks: {a}'.format(a = fields[2:]))
+        if self.process is None or self.process.poll() is not None:
+            msg = self._start()
+            if msg is not None:
+                return [1, msg]
+        self.runs += 1
+        self.process.stdin.write("\t".join(fields) + "\n")
+        self.process.stdin.flush()
+        reply = self.process.stdout.readline().rstrip('\n').split('\t')
+        if reply[0] == "DONE" and len(reply) == 2:
+            return [int(reply[1]), _read_log(log_fname)]
+        # The worker stopped during the run
+        status = self.process.wait() or 1
+        self.process = None
+        return [status, _read_log(log_fname) + '\n' + _('The AMES worker stopped with exit status {s}').format(s = status)]
+
+    def cancel(self):
+        """Stop a run in progress (e.g., from another thread, after another AMES run failed)"""
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def close(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.process.stdin.write("QUIT\n")
+                self.process.stdin.flush()
+                self.process.wait(timeout = 60)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+        self.process = None
+
+    def log_stats(self):
+        logging.info(_('AMES worker: {n} run(s), {k} start(s) of Julia').format(n = self.runs, k = self.starts))
+
+class AmesProcess:
+    """Run AMES scripts by launching the Julia executable juliapath for each run"""
+    def __init__(self, juliapath):
+        self.juliapath = juliapath
+        self.runs = 0
+        self.process = None
+
+    def run(self, script, args, log_fname):
+        """Run AMES script with command-line arguments args, sending its output to log_fname
+
+        Returns: [exit status, output of the run]
+        """
+        self.runs += 1
+        with open(log_fname, 'w', encoding = 'utf-8') as log:
+            self.process = subprocess.Popen([self.juliapath, script] + [str(a) for a in args], stdout = log, stderr = subprocess.STDOUT)
+            status = self.process.wait()
+        self.process = None
+        return [status, _read_log(log_fname)]
+
+    def cancel(self):
+        """Stop a run in progress (e.g., from another thread, after another AMES run failed)"""
+        process = self.process
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def close(self):
+        pass
+
+    def log_stats(self):
+        logging.info(_('AMES: {n} run(s), each in a new Julia process').format(n = self.runs))
+
+class StubAmesWorker:
+    """Stand-in for AmesWorker that records runs instead of running AMES
+
+    Input arguments:
+        status: exit status returned for every run
+    """
+    def __init__(self, status = 0):
+        self.status = status
+        self.calls = [] # [script, args, log file] for each run
+
+    def run(self, script, args, log_fname):
+        self.calls.append([script, [str(a) for a in args], log_fname])
+        output = 'Stub AMES worker: {s} {a}\n'.format(s = script, a = " ".join('"' + str(a) + '"' for a in args))
+        with open(log_fname, 'w', encoding = 'utf-8') as log:
+            log.write(output)
+        return [self.status, output]
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+    def log_stats(self):
+        logging.info(_('Stub AMES worker: {n} run(s) recorded; AMES was not run').format(n = len(self.calls)))
+
+def ames_runner(setting, juliapath):
+    """Return the object used to run AMES for the "Worker" setting in the AMES section of config.yml: True (or
+    missing) for AmesWorker, False for AmesProcess, or "Stub" for StubAmesWorker"""
+    if isinstance(setting, str) and setting.lower() == "stub":
+        return StubAmesWorker()
+    if setting == False:
+        return AmesProcess(juliapath)
+    return AmesWorker(juliapath)
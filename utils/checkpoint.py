@@ -0,0 +1,86 @@
+import os
+import gzip
+import pickle
+import logging
+
+#==================================================================================================#
+# Checkpoints of the iterations between LEAP, WEAP, and AMES
+#
+# After each phase of each iteration, main_integration() saves the LEAP and WEAP areas and writes a
+# checkpoint with the state it keeps between phases: the scenarios still being calculated, the results
+# kept for the convergence checks, the generation potentials of hydropower dams, and the state of the
+# accelerator, the dam convergence tracker, and the record of expressions written. The checkpoint is a
+# gzip-compressed pickle, replaced atomically so that a crash while writing it leaves the previous one.
+#
+# When the integration procedure starts and finds a checkpoint written for the same LEAP and WEAP areas,
+# hydropower plants, and years, it restores that state and skips every phase up to and including the last
+# one completed, so that no calculation is repeated. The checkpoint is deleted when the run completes.
+#
+# The position of a phase is (iteration, phase number), where iteration is the number of completed
+# iterations when the pass through the iteration loop started and phase numbers follow PHASES.
+#==================================================================================================#
+
+CHECKPOINT_VERSION = 3
+CHECKPOINT_FILE = "integration_checkpoint.pkl.gz"
+# Phases of main_integration(), in the order in which they are completed. "Prepare" covers the steps before
+# the first iteration (e.g., the initial AMES run)
+PHASES = ["Prepare", "Push LEAP drivers to WEAP", "Calculate WEAP", "WEAP to LEAP availability", "WEAP to LEAP pumping",
+          "Calculate LEAP", "Record results", "Check convergence", "LEAP to WEAP hydropower", "WEAP to AMES"]
+
+class Checkpoint:
+    """Write checkpoints of the integration procedure to fname, and find out which phases a resumed run can skip
+
+    Input arguments:
+        fname: checkpoint file
+        key: dictionary identifying the models and settings the checkpoint applies to; a checkpoint written with another key is ignored
+        enabled: if False, no checkpoint is read or written
+    """
+    def __init__(self, fname, key, enabled = True):
+        self.fname = fname
+        self.key = key
+        self.enabled = enabled
+        self.resume_position = None # Position of the last phase completed before the run was interrupted
+
+    def load(self):
+        """Return the state saved in the checkpoint, or None if there is no usable checkpoint"""
+        if not self.enabled or not os.path.isfile(self.fname):
+            return None
+        try:
+            with gzip.open(self.fname, 'rb') as f:
+                saved = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+            logging.warning(_('Could not read checkpoint {f} ({e}); starting a new run').format(f = self.fname, e = e))
+            return None
+        if saved.get('version') != CHECKPOINT_VERSION or saved.get('key') != self.key:
+            logging.warning(_('Checkpoint {f} was written for other models or settings; starting a new run').format(f = self.fname))
+            return None
+        self.resume_position = tuple(saved['position'])
+        return saved['state']
+
+    def position(self, iteration, phase):
+        return (iteration, PHASES.index(phase))
+
+    def describe(self):
+        """Describe the position of the resumed run, e.g., 'iteration 3, after "Calculate WEAP"'"""
+        if self.resume_position is None:
+            return ""
+        return _('iteration {i}, after "{p}"').format(i = self.resume_position[0] + 1, p = PHASES[self.resume_position[1]])
+
+    def completed(self, iteration, phase):
+        """Return True if phase of the pass through the iteration loop starting after iteration was completed before the run was interrupted"""
+        return self.resume_position is not None and self.position(iteration, phase) <= self.resume_position
+
+    def save(self, iteration, phase, state):
+        """Write the state after completing phase, replacing the last checkpoint"""
+        if not self.enabled:
+            return
+        saved = {'version': CHECKPOINT_VERSION, 'key': self.key, 'position': self.position(iteration, phase), 'state': state}
+        temp_fname = self.fname + ".tmp"
+        with gzip.open(temp_fname, 'wb', compresslevel = 1) as f:
+            pickle.dump(saved, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_fname, self.fname)
+
+    def remove(self):
+        """Delete the checkpoint (e.g., once the run has completed)"""
+        if os.path.isfile(self.fname):
+            os.remove(self.fname)
@@ -0,0 +1,132 @@
+import logging
+
+#==================================================================================================#
+# Cache of LEAP and WEAP COM handles
+#
+# Every call through a win32com dispatch object is a cross-process round trip. The integration
+# procedure resolves the same branches and variables many times per iteration, so the application
+# objects are wrapped and the Branch and Variable handles are kept, keyed on path and name.
+#
+# Whether a branch or variable exists can depend on the active scenario (e.g., "Minimum Capacity" is
+# only available in optimized LEAP scenarios, and a WEAP reservoir may not be active in a scenario),
+# so handles are stored separately for each active scenario. The active scenario is tracked from
+# assignments made through the wrapper, which avoids a COM call to read it back.
+#
+# The cache is cleared when the active area changes (including in reopen_weap_area()) and should be
+# cleared at the start of each iteration by calling invalidate(). Other structures that depend on the
+# open area can register a callback with on_area_change().
+#
+# Wrappers of the application objects, here and in other modules (e.g., com_profiler.py, com_recorder.py),
+# return the repr of the object they wrap, because check_branch_var() in leap_weap_integration.py
+# identifies the application ("LEAP" or "WEAP") from characters 11-14 of the repr of the COM object.
+#==================================================================================================#
+
+class CachedBranch:
+    """Wrap a LEAP or WEAP Branch object, keeping handles returned by Variable() and Variables()"""
+    def __init__(self, branch, owner):
+        object.__setattr__(self, '_branch', branch)
+        object.__setattr__(self, '_owner', owner)
+        object.__setattr__(self, '_variables', {})
+
+    def _get_variable(self, method, name):
+        key = (method, name)
+        if key in self._variables:
+            self._owner.hits += 1
+        else:
+            self._owner.misses += 1
+            self._variables[key] = getattr(self._branch, method)(name)
+        return self._variables[key]
+
+    def Variable(self, name):
+        return self._get_variable('Variable', name)
+
+    def Variables(self, name):
+        return self._get_variable('Variables', name)
+
+    def __getattr__(self, name):
+        return getattr(self._branch, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._branch, name, value)
+
+class CachedBranches:
+    """Wrap the Branches collection so that app.Branches(path) is memoized and other members pass through"""
+    def __init__(self, owner):
+        object.__setattr__(self, '_owner', owner)
+
+    def __call__(self, path):
+        return self._owner._get_branch('Branches', path)
+
+    def __getattr__(self, name):
+        return getattr(self._owner._app.Branches, name)
+
+class CachedApp:
+    """Wrap a LEAP or WEAP application object, memoizing Branch and Variable handles
+
+    Input arguments:
+        app: LEAP or WEAP application object (or a stand-in with the same interface)
+        name: label used in log messages (e.g., "LEAP")
+    Attribute reads, attribute assignments, and method calls that are not cached are passed through to app.
+    """
+    def __init__(self, app, name):
+        object.__setattr__(self, '_app', app)
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_branches', {})
+        object.__setattr__(self, '_scenario', None)
+        object.__setattr__(self, '_area_callbacks', [])
+        object.__setattr__(self, 'hits', 0)
+        object.__setattr__(self, 'misses', 0)
+
+    def _get_branch(self, method, path):
+        key = (self._scenario, method, path)
+        if key in self._branches:
+            self.hits += 1
+            return self._branches[key]
+        self.misses += 1
+        branch = getattr(self._app, method)(path)
+        # Don't store missing branches: WEAP can return None when its branch list needs to be refreshed (see reopen_weap_area())
+        if branch is None:
+            return None
+        self._branches[key] = CachedBranch(branch, self)
+        return self._branches[key]
+
+    @property
+    def Branches(self):
+        return CachedBranches(self)
+
+    # WEAP also exposes branches through Branch(path)
+    def Branch(self, path):
+        return self._get_branch('Branch', path)
+
+    def invalidate(self):
+        """Drop all cached handles (call after an area switch and at the start of each iteration)"""
+        self._branches.clear()
+
+    def on_area_change(self, callback):
+        """Register a function (taking no arguments) to call whenever ActiveArea is set"""
+        self._area_callbacks.append(callback)
+
+    def log_stats(self):
+        logging.info(_('{a} handle cache: {h} hits, {m} misses').format(a = self._name, h = self.hits, m = self.misses))
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        return getattr(self._app, name)
+
+    def __setattr__(self, name, value):
+        if name in ('hits', 'misses'):
+            object.__setattr__(self, name, value)
+            return
+        setattr(self._app, name, value)
+        if name == 'ActiveArea':
+            self.invalidate()
+            object.__setattr__(self, '_scenario', None)
+            for callback in self._area_callbacks:
+                callback()
+        elif name == 'ActiveScenario':
+            object.__setattr__(self, '_scenario', value)
+
+    def __repr__(self):
+        # See the notes on repr() at the top of this module
+        return repr(self._app)
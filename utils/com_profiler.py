@@ -0,0 +1,157 @@
+import time
+import types
+import bisect
+import logging
+
+#==================================================================================================#
+# Optional timing of calls to the LEAP and WEAP application objects
+#
+# The application objects (and every COM object obtained from them) are wrapped in proxies that record
+# the count, total time, and latency distribution of each attribute read, attribute assignment, and
+# method call, tagged with the current phase of the integration procedure. Latencies are stored in
+# fixed, logarithmically spaced histogram bins, so memory use does not grow with the number of calls.
+#
+# The proxies only rely on ordinary Python attribute access, so they work with plain Python stand-ins
+# for LEAP and WEAP as well as with win32com dispatch objects.
+#==================================================================================================#
+
+# Types returned as-is rather than wrapped in a proxy
+PLAIN_TYPES = (type(None), bool, int, float, complex, str, bytes, tuple, list, dict)
+# Method types, whose attribute reads are not recorded separately from the call
+METHOD_TYPES = (types.MethodType, types.FunctionType, types.BuiltinFunctionType, types.BuiltinMethodType)
+
+class LatencyHistogram:
+    """Count, total, maximum, and binned distribution of latencies [s] from 1 microsecond to ~3 hours"""
+    EDGES = [10**(-6 + i/20) for i in range(0, 20*10 + 1)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.EDGES) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, dt):
+        self.counts[bisect.bisect_left(self.EDGES, dt)] += 1
+        self.count += 1
+        self.total += dt
+        self.max = max(self.max, dt)
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """Return the upper edge of the bin containing the p-th percentile (0 < p <= 100), capped at the maximum"""
+        target = p / 100 * self.count
+        cum = 0
+        for i, c in enumerate(self.counts):
+            cum += c
+            if cum >= target and c > 0:
+                return min(self.EDGES[i] if i < len(self.EDGES) else self.max, self.max)
+        return self.max
+
+class ComProfiler:
+    """Record timings of calls made through objects returned by wrap()
+
+    Input arguments:
+        enabled: if False, wrap() returns objects unchanged and nothing is recorded or reported
+    Set the phase attribute to tag subsequent calls with the current phase of the integration procedure.
+    """
+    def __init__(self, enabled = True):
+        self.enabled = enabled
+        self.phase = ""
+        self.iteration_stats = {} # Histograms since the last report(), keyed by (phase, app, member)
+        self.total_stats = {} # Histograms for the full run
+
+    def wrap(self, obj, app_name):
+        if not self.enabled:
+            return obj
+        return ProfiledObject(obj, self, app_name)
+
+    def record(self, app_name, member, dt):
+        key = (self.phase, app_name, member)
+        if key not in self.iteration_stats:
+            self.iteration_stats[key] = LatencyHistogram()
+        self.iteration_stats[key].add(dt)
+
+    def _log_table(self, title, stats):
+        logging.info(_('COM call timings: {t}').format(t = title))
+        logging.info('\t' + '{:<30} {:<5} {:<30} {:>9} {:>10} {:>9} {:>9} {:>9}'.format('Phase', 'App', 'Member', 'Count', 'Total [s]', 'p50 [ms]', 'p95 [ms]', 'Max [ms]'))
+        for key in sorted(stats, key = lambda k: -stats[k].total):
+            h = stats[key]
+            logging.info('\t' + '{:<30} {:<5} {:<30} {:>9} {:>10.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(key[0][:30], key[1], key[2][:30], h.count, h.total, 1000 * h.percentile(50), 1000 * h.percentile(95), 1000 * h.max))
+
+    def report(self, title):
+        """Log a table of timings recorded since the last report, then add them to the totals for the run"""
+        if not self.enabled:
+            return
+        self._log_table(title, self.iteration_stats)
+        for key, h in self.iteration_stats.items():
+            if key not in self.total_stats:
+                self.total_stats[key] = LatencyHistogram()
+            self.total_stats[key].merge(h)
+        self.iteration_stats = {}
+
+    def report_total(self):
+        """Log a table of timings for the full run (including any not yet reported)"""
+        if not self.enabled:
+            return
+        self.report(_('since last report'))
+        self._log_table(_('full run'), self.total_stats)
+
+class ProfiledObject:
+    """Proxy for a LEAP or WEAP object (or any object obtained from it) that records timings in a ComProfiler"""
+    def __init__(self, obj, profiler, app_name, member = None):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_profiler', profiler)
+        object.__setattr__(self, '_app_name', app_name)
+        object.__setattr__(self, '_member', member)
+
+    def _wrap_result(self, result, member):
+        if isinstance(result, PLAIN_TYPES):
+            return result
+        return ProfiledObject(result, self._profiler, self._app_name, member)
+
+    def __getattr__(self, name):
+        t0 = time.perf_counter()
+        result = getattr(self._obj, name)
+        dt = time.perf_counter() - t0
+        if isinstance(result, METHOD_TYPES):
+            return ProfiledMethod(result, self, name)
+        self._profiler.record(self._app_name, name, dt)
+        return self._wrap_result(result, name)
+
+    def __setattr__(self, name, value):
+        t0 = time.perf_counter()
+        setattr(self._obj, name, value)
+        self._profiler.record(self._app_name, name + " set", time.perf_counter() - t0)
+
+    def __call__(self, *args):
+        # Collections such as Branches are called with a key
+        t0 = time.perf_counter()
+        result = self._obj(*args)
+        self._profiler.record(self._app_name, str(self._member) + "()", time.perf_counter() - t0)
+        return self._wrap_result(result, self._member)
+
+    def __iter__(self):
+        for item in self._obj:
+            yield self._wrap_result(item, self._member)
+
+    def __repr__(self):
+        # Return the repr of the wrapped object (see the notes on repr() in com_cache.py)
+        return repr(self._obj)
+
+class ProfiledMethod:
+    """Bound method of a ProfiledObject that records the time taken by each call"""
+    def __init__(self, method, owner, name):
+        self.method = method
+        self.owner = owner
+        self.name = name
+
+    def __call__(self, *args, **kwargs):
+        t0 = time.perf_counter()
+        result = self.method(*args, **kwargs)
+        self.owner._profiler.record(self.owner._app_name, self.name + "()", time.perf_counter() - t0)
+        return self.owner._wrap_result(result, self.name)
@@ -0,0 +1,287 @@
+import gzip
+import json
+import time
+import atexit
+import logging
+from utils.com_profiler import METHOD_TYPES
+
+#==================================================================================================#
+# Recording and replay of calls to LEAP and WEAP
+#
+# ComRecorder wraps the LEAP and WEAP application objects (and every object obtained from them) in
+# proxies that write each attribute read, attribute assignment, method call, and iteration, with its
+# arguments, result, and duration, to a gzip-compressed trace file with one JSON record per line. When a
+# call exports results to a file (e.g., ExportResultsCSV), the contents of the file are recorded too.
+#
+# ComReplayer reads a trace and serves the recorded results to the integration procedure in place of
+# LEAP and WEAP, optionally waiting for the recorded duration of each call, and recreates exported
+# files. Objects are identified by how they were obtained (e.g., Branches(path) on the application), and
+# results are looked up by object, member, arguments, and the state of the application: the values
+# assigned to its own attributes (e.g., ActiveScenario, ActiveRegion) and the number of calculations
+# made. Repeated identical calls return the recorded results in order. If the integration procedure
+# makes a call in a state in which it was not recorded, the result recorded for the same call in
+# another state is used, and the number of such approximate matches is reported.
+#
+# Trace records:
+#   ["v", version]: trace format version (first record)
+#   ["a", app_name, object_id, repr]: application object
+#   ["x", context_id, context]: application state
+#   ["c", object_id, kind, member, args, context_id, result, duration, (file contents)]: call, where kind is
+#       "g" (read), "s" (assignment), "c" (method call, or call of the object itself if member is ""), or
+#       "i" (iteration); results that are objects are recorded as {"o": object_id}
+#==================================================================================================#
+
+TRACE_VERSION = 1
+# Methods that export results to the file named by their first argument
+FILE_METHODS = ['exportresultscsv', 'exportresults']
+# Types recorded as values (other results are recorded as objects)
+VALUE_TYPES = (type(None), bool, int, float, str)
+
+def _plain(value):
+    # NumPy scalars and other values that JSON cannot encode
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+def _dumps(value):
+    return json.dumps(value, default = _plain, separators = (',', ':'))
+
+def _context(state):
+    return _dumps([sorted(state['sets'].items()), state['calculations']])
+
+def _new_state():
+    return {'sets': {}, 'calculations': 0}
+
+class ComRecorder:
+    """Record calls made through objects returned by wrap() to the gzip-compressed trace file fname"""
+    def __init__(self, fname):
+        self.fname = fname
+        self.file = gzip.open(fname, 'wt', encoding = 'utf-8')
+        self.ids = {} # Object IDs keyed by (parent object ID, kind, member, args)
+        self.contexts = {} # Context IDs keyed by context
+        self.states = {} # Application state keyed by application object ID
+        self.calls = 0
+        self._write(["v", TRACE_VERSION])
+        atexit.register(self.close)
+
+    def _write(self, record):
+        self.file.write(_dumps(record) + "\n")
+
+    def _object_id(self, derivation):
+        if derivation not in self.ids:
+            self.ids[derivation] = len(self.ids)
+        return self.ids[derivation]
+
+    def _context_id(self, root_id):
+        context = _context(self.states[root_id])
+        if context not in self.contexts:
+            self.contexts[context] = len(self.contexts)
+            self._write(["x", self.contexts[context], context])
+        return self.contexts[context]
+
+    def wrap(self, obj, app_name):
+        root_id = self._object_id((None, "a", app_name, ""))
+        self.states[root_id] = _new_state()
+        self._write(["a", app_name, root_id, repr(obj)])
+        return RecordedObject(obj, self, root_id, root_id)
+
+    def _encode(self, result, parent_id, kind, member, args_json, root_id):
+        """Return [encoded result, result to pass to the caller]"""
+        if isinstance(result, VALUE_TYPES):
+            return [result, result]
+        if isinstance(result, (tuple, list)) and all(isinstance(r, VALUE_TYPES) for r in result):
+            return [list(result), result]
+        obj_id = self._object_id((parent_id, kind, member, args_json))
+        return [{"o": obj_id}, RecordedObject(result, self, obj_id, root_id)]
+
+    def record(self, obj_id, root_id, kind, member, args, call):
+        """Make call() and record it; returns the result to pass to the caller"""
+        t0 = time.perf_counter()
+        result = call()
+        return self.record_result(obj_id, root_id, kind, member, args, result, time.perf_counter() - t0)
+
+    def record_result(self, obj_id, root_id, kind, member, args, result, dt):
+        """Record a call that returned result after dt seconds; returns the result to pass to the caller"""
+        member = member.lower()
+        context_id = self._context_id(root_id)
+        args_json = _dumps(args)
+        if kind == "i":
+            items = [self._encode(r, obj_id, kind, member, _dumps(i), root_id) for i, r in enumerate(result)]
+            encoded = [e[0] for e in items]
+            result = [e[1] for e in items]
+        elif kind == "s":
+            encoded = None
+        else:
+            encoded, result = self._encode(result, obj_id, kind, member, args_json, root_id)
+        record = ["c", obj_id, kind, member, args, context_id, encoded, round(dt, 6)]
+        if member in FILE_METHODS and args:
+            try:
+                with open(args[0], encoding = 'utf-8') as f:
+                    record.append(f.read())
+            except OSError:
+                pass
+        self._write(record)
+        self.calls += 1
+        # Update the application state after the call
+        if obj_id == root_id:
+            if kind == "s":
+                self.states[root_id]['sets'][member] = args[0]
+            elif kind == "c" and member == "calculate":
+                self.states[root_id]['calculations'] += 1
+        return result
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+            logging.info(_('Recorded {n} call(s) to LEAP and WEAP in {f}').format(n = self.calls, f = self.fname))
+
+class RecordedObject:
+    """Proxy for a LEAP or WEAP object (or any object obtained from it) that records calls in a ComRecorder"""
+    def __init__(self, obj, recorder, obj_id, root_id):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_recorder', recorder)
+        object.__setattr__(self, '_id', obj_id)
+        object.__setattr__(self, '_root_id', root_id)
+
+    def __getattr__(self, name):
+        t0 = time.perf_counter()
+        result = getattr(self._obj, name)
+        dt = time.perf_counter() - t0
+        if isinstance(result, METHOD_TYPES):
+            return lambda *args: self._recorder.record(self._id, self._root_id, "c", name, list(args), lambda: result(*args))
+        return self._recorder.record_result(self._id, self._root_id, "g", name, [], result, dt)
+
+    def __setattr__(self, name, value):
+        self._recorder.record(self._id, self._root_id, "s", name, [value], lambda: setattr(self._obj, name, value))
+
+    def __call__(self, *args):
+        return self._recorder.record(self._id, self._root_id, "c", "", list(args), lambda: self._obj(*args))
+
+    def __iter__(self):
+        return iter(self._recorder.record(self._id, self._root_id, "i", "", [], lambda: list(self._obj)))
+
+    def __repr__(self):
+        # Return the repr of the wrapped object (see the notes on repr() in com_cache.py)
+        return repr(self._obj)
+
+class ComReplayer:
+    """Serve the calls recorded in trace file fname
+
+    Input arguments:
+        fname: trace file written by ComRecorder
+        time_scale: each call waits for time_scale times its recorded duration (0 to not wait)
+    """
+    def __init__(self, fname, time_scale = 1.0):
+        self.fname = fname
+        self.time_scale = time_scale
+        self.apps = {} # (object ID, repr) keyed by application name
+        self.contexts = {} # Context IDs keyed by context
+        self.exact = {} # Recorded calls keyed by (object ID, kind, member, args, context ID)
+        self.loose = {} # Recorded calls keyed by (object ID, kind, member, args)
+        self.kinds = {} # Kinds of call recorded, keyed by (object ID, member)
+        self.cursors = {} # Number of times each key has been served
+        self.states = {}
+        self.exact_matches = 0
+        self.approximate_matches = 0
+        self.misses = 0
+        with gzip.open(fname, 'rt', encoding = 'utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record[0] == "v":
+                    if record[1] != TRACE_VERSION:
+                        raise ValueError('Unsupported version {v} of trace file {f}'.format(v = record[1], f = fname))
+                elif record[0] == "a":
+                    self.apps[record[1]] = (record[2], record[3])
+                    self.states[record[2]] = _new_state()
+                elif record[0] == "x":
+                    self.contexts[record[2]] = record[1]
+                elif record[0] == "c":
+                    obj_id, kind, member, args, context_id = record[1:6]
+                    entry = record[6:]
+                    key = (obj_id, kind, member, _dumps(args))
+                    self.exact.setdefault(key + (context_id,), []).append(entry)
+                    self.loose.setdefault(key, []).append(entry)
+                    self.kinds.setdefault((obj_id, member), set()).add(kind)
+        logging.info(_('Replaying {n} recorded call(s) to LEAP and WEAP from {f}').format(n = sum(len(v) for v in self.loose.values()), f = fname))
+
+    def app(self, app_name):
+        if app_name not in self.apps:
+            raise ValueError('No calls to {a} recorded in {f}'.format(a = app_name, f = self.fname))
+        root_id, repr_text = self.apps[app_name]
+        return ReplayObject(self, root_id, root_id, repr_text)
+
+    def _decode(self, value, root_id):
+        if isinstance(value, dict):
+            return ReplayObject(self, value["o"], root_id)
+        if isinstance(value, list):
+            return [self._decode(v, root_id) for v in value]
+        return value
+
+    def serve(self, obj_id, root_id, kind, member, args):
+        """Return the recorded result of a call, or raise LookupError if the call was not recorded"""
+        member = member.lower()
+        key = (obj_id, kind, member, _dumps(args))
+        context_id = self.contexts.get(_context(self.states[root_id]))
+        if key + (context_id,) in self.exact:
+            key = key + (context_id,)
+            entries = self.exact[key]
+            self.exact_matches += 1
+        elif key in self.loose:
+            entries = self.loose[key]
+            self.approximate_matches += 1
+        else:
+            entries = None
+            if kind != "s":
+                self.misses += 1
+        if entries is not None:
+            n = self.cursors.get(key, 0)
+            self.cursors[key] = n + 1
+            entry = entries[min(n, len(entries) - 1)]
+            if self.time_scale > 0:
+                time.sleep(self.time_scale * entry[1])
+            if len(entry) > 2:
+                with open(args[0], 'w', encoding = 'utf-8') as f:
+                    f.write(entry[2])
+        # Update the application state after the call
+        if obj_id == root_id:
+            if kind == "s":
+                self.states[root_id]['sets'][member] = args[0]
+            elif kind == "c" and member == "calculate":
+                self.states[root_id]['calculations'] += 1
+        if entries is None:
+            if kind == "s":
+                return None
+            raise LookupError('Call to "{m}" with arguments {a} was not recorded in {f}'.format(m = member, a = args, f = self.fname))
+        return self._decode(entry[0], root_id)
+
+    def log_stats(self):
+        logging.info(_('Replayed calls: {e} exact match(es), {a} approximate match(es) from another application state, {m} not recorded').format(e = self.exact_matches, a = self.approximate_matches, m = self.misses))
+
+class ReplayObject:
+    """Stand-in for a recorded LEAP or WEAP object (or any object obtained from it) that serves calls from a ComReplayer"""
+    def __init__(self, replayer, obj_id, root_id, repr_text = None):
+        object.__setattr__(self, '_replayer', replayer)
+        object.__setattr__(self, '_id', obj_id)
+        object.__setattr__(self, '_root_id', root_id)
+        object.__setattr__(self, '_repr', repr_text)
+
+    def __getattr__(self, name):
+        kinds = self._replayer.kinds.get((self._id, name.lower()), set())
+        if "c" in kinds:
+            return lambda *args: self._replayer.serve(self._id, self._root_id, "c", name, list(args))
+        if "g" in kinds:
+            return self._replayer.serve(self._id, self._root_id, "g", name, [])
+        raise AttributeError('No calls to "{n}" recorded'.format(n = name))
+
+    def __setattr__(self, name, value):
+        self._replayer.serve(self._id, self._root_id, "s", name, [value])
+
+    def __call__(self, *args):
+        return self._replayer.serve(self._id, self._root_id, "c", "", list(args))
+
+    def __iter__(self):
+        return iter(self._replayer.serve(self._id, self._root_id, "i", "", []))
+
+    def __repr__(self):
+        # Return the repr of the wrapped object (see the notes on repr() in com_cache.py)
+        return self._repr if self._repr is not None else '<ReplayObject {i}>'.format(i = self._id)
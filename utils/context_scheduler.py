@@ -0,0 +1,99 @@
+import logging
+
+#==================================================================================================#
+# Scheduler for expression writes that depend on the active scenario and region
+#
+# Setting ActiveScenario or ActiveRegion in LEAP or WEAP is slow, and the integration procedure used to
+# set both before every expression it wrote. The scheduler collects pending writes, sorts them by
+# (scenario, region), and applies each group after a single context switch.
+#
+# Use the scheduler as a context manager around a block of code. Within the block, all changes to the
+# active scenario and region must be made through activate(), so that the scheduler knows the current
+# context; pending writes are applied when the block exits. Outside a block the context is unknown, so
+# the first switch in each block is always made.
+#
+# If an ExpressionSink is supplied, writes that would not change the expression are skipped before any
+# context switch is made for them.
+#==================================================================================================#
+
+class ContextScheduler:
+    """Group LEAP or WEAP expression writes by scenario and region
+
+    Input arguments:
+        app: LEAP or WEAP application object
+        name: label used in log messages (e.g., "LEAP")
+        has_regions: True if app has regions (LEAP), False otherwise (WEAP)
+        sink: optional ExpressionSink, shared between schedulers, used to skip unchanged expressions
+    """
+    def __init__(self, app, name, has_regions, sink = None):
+        self.app = app
+        self.name = name
+        self.has_regions = has_regions
+        self.sink = sink
+        self.pending = []
+        self.scenario = None
+        self.region = None
+        self.switches = 0 # Context switches made
+        self.switches_avoided = 0 # Context switches that were skipped because the context was already active
+
+    def __enter__(self):
+        self.scenario = None
+        self.region = None
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't apply writes if the block failed
+        if exc_type is None:
+            self.flush()
+        else:
+            self.pending = []
+        self.scenario = None
+        self.region = None
+
+    def activate(self, scenario = None, region = None):
+        """Make scenario and region active, setting them in app only if they are not already active (None means no change)"""
+        if scenario is not None:
+            if scenario == self.scenario:
+                self.switches_avoided += 1
+            else:
+                self.app.ActiveScenario = scenario
+                self.scenario = scenario
+                self.switches += 1
+        if region is not None and self.has_regions:
+            if region == self.region:
+                self.switches_avoided += 1
+            else:
+                self.app.ActiveRegion = region
+                self.region = region
+                self.switches += 1
+
+    def set_expression(self, branch_path, variable, expression, scenario = None, region = None):
+        """Queue a write of expression to branch_path:variable in the given scenario and region (None means any)"""
+        self.pending.append((scenario, region, branch_path, variable, expression))
+
+    def flush(self):
+        """Apply all pending writes, grouped by (scenario, region), starting with the active context"""
+        def sort_key(w):
+            in_context = (w[0] is None or w[0] == self.scenario) and (w[1] is None or w[1] == self.region)
+            return (not in_context, "" if w[0] is None else str(w[0]), "" if w[1] is None else str(w[1]))
+
+        pending = self.pending
+        self.pending = []
+        if self.sink is not None:
+            pending = [w for w in pending if self.sink.needs_write(self.name, w[2], w[3], w[0], w[1], w[4])]
+        pending.sort(key = sort_key)
+        for scenario, region, branch_path, variable, expression in pending:
+            self.activate(scenario, region)
+            branch = self.app.Branches(branch_path)
+            # A particular branch may not be active in a scenario
+            if branch is None or branch.Variables(variable) is None:
+                logging.warning(_('Could not write expression for {a} branch "{b}", variable "{v}" in scenario {s}').format(a = self.name, b = branch_path, v = variable, s = scenario))
+                continue
+            branch.Variables(variable).Expression = expression
+            if self.sink is not None:
+                self.sink.record(self.name, branch_path, variable, scenario, region, expression)
+
+    def log_stats(self):
+        logging.info(_('{a} scenario/region switches: {n} made, {m} avoided').format(a = self.name, n = self.switches, m = self.switches_avoided))
+        self.switches = 0
+        self.switches_avoided = 0
@@ -0,0 +1,264 @@
+import csv
+import logging
+import numpy as np
+from sys import float_info
+
+#==================================================================================================#
+# Convergence checks between successive iterations
+#
+# ConvergenceEngine keeps the target results of the previous and the current iteration for each scenario
+# as contiguous float64 arrays. The elements of an array are indexed by the product of a set of lists
+# (e.g., hydropower plants x years), in the order used by index_to_elements() in main_integration().
+# check() computes the root-mean-square relative difference between iterations for all scenarios at once,
+# and reports the elements with the largest relative differences. Once a scenario converges, freeze() keeps
+# its latest results apart from the scenarios still iterating, and write_csv() saves the final results for
+# all scenarios, which read_csv() can load as the previous iteration of a later run (a warm start). The
+# engine does not call LEAP, WEAP, or AMES, so it can be used with arrays of results from any source.
+#
+# DamConvergence applies the same test to the series exchanged for each hydropower dam within a scenario, so
+# that dams whose exchanges have converged can be left untouched while other dams keep iterating.
+#==================================================================================================#
+
+def relative_differences(current, previous):
+    """Return |current - previous| / (0.5 * |current + previous|), with the denominator bounded below by machine epsilon"""
+    # This formulation avoids divide by zero
+    return np.abs(current - previous) / (0.5 * np.maximum(np.abs(current + previous), float_info.epsilon))
+
+class ConvergenceResult:
+    """Result of a convergence check for one scenario
+
+    Attributes:
+        test_value: root-mean-square relative difference between the previous and current iterations
+        converged: True if test_value is within the tolerance
+        largest: [elements, relative difference, previous value, current value] for the element with the largest
+            relative difference, where elements is a list with one entry from each of the engine's lists (e.g.,
+            [plant, year]); None if there are no results
+        offenders: list in the same form as largest for the top_n elements with the largest relative differences,
+            largest first (empty if top_n is 0)
+    """
+    def __init__(self, test_value, converged, largest, offenders):
+        self.test_value = test_value
+        self.converged = converged
+        self.largest = largest
+        self.offenders = offenders
+
+    def describe_offenders(self):
+        """Return the offenders as text, e.g., TOKTOGUL 2030 (35.20%); KAIRAKKUM 2031 (12.05%)"""
+        return "; ".join("{e} ({d:.2%})".format(e = " ".join(str(x) for x in o[0]), d = o[1]) for o in self.offenders)
+
+class ConvergenceEngine:
+    """Check convergence of target results between successive iterations
+
+    Input arguments:
+        lists: lists whose product indexes the results (e.g., [plants, years])
+        tolerance: maximum root-mean-square relative difference for results to have converged
+        top_n: number of elements with the largest relative differences to report (an integer, at least 0); the
+            element with the largest relative difference is always available as ConvergenceResult.largest
+        names: names of the lists, used as column headers by write_csv()
+    Notes:
+        The relative difference of an element is |current - previous| / (0.5 * |current + previous|), with the
+        denominator bounded below by machine epsilon. Missing values (NaN) are counted as zero.
+    """
+    def __init__(self, lists, tolerance, top_n = 5, names = None):
+        self.lists = [list(l) for l in lists]
+        self.names = list(names) if names is not None else ['List {i}'.format(i = i + 1) for i in range(len(self.lists))]
+        self.shape = tuple(len(l) for l in self.lists)
+        self.size = int(np.prod(self.shape))
+        self.tolerance = tolerance
+        if isinstance(top_n, bool) or not isinstance(top_n, (int, np.integer)) or top_n < 0:
+            raise ValueError('The number of largest differences to report must be an integer, at least 0: {n}'.format(n = top_n))
+        self.top_n = int(top_n)
+        self.previous = {}
+        self.current = {}
+        self.frozen = {} # Results of converged scenarios, with the iteration in which they converged
+
+    def record(self, scenario, values):
+        """Store the results for scenario in the current iteration"""
+        values = np.nan_to_num(np.ascontiguousarray(values, dtype = np.float64).ravel())
+        if values.size != self.size:
+            raise ValueError('Expected {n} results for scenario {s}, received {m}'.format(n = self.size, s = scenario, m = values.size))
+        self.current[scenario] = values
+
+    def advance(self):
+        """Make the current iteration the previous one, for scenarios recorded in the current iteration"""
+        self.previous.update(self.current)
+        self.current = {}
+
+    def drop(self, scenario):
+        """Stop tracking scenario (e.g., once it has converged)"""
+        self.previous.pop(scenario, None)
+        self.current.pop(scenario, None)
+
+    def freeze(self, scenario, iteration):
+        """Stop tracking scenario once it has converged, keeping its latest results as its final results"""
+        if scenario in self.current:
+            self.frozen[scenario] = [self.current[scenario], iteration]
+        self.drop(scenario)
+
+    def final_results(self):
+        """Return a dictionary of [latest results, iteration in which it converged or None] keyed by scenario"""
+        final = {s: [v, None] for s, v in self.previous.items()}
+        final.update({s: [v, None] for s, v in self.current.items()})
+        final.update(self.frozen)
+        return final
+
+    def write_csv(self, fname):
+        """Write the final results for all scenarios to fname, with one column per entry in the last list (e.g., year)"""
+        rows_shape = self.shape[:-1]
+        with open(fname, 'w', newline = '') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Scenario', 'Converged in iteration'] + self.names[:-1] + self.lists[-1])
+            for s, (values, iteration) in self.final_results().items():
+                values = values.reshape(-1, self.shape[-1])
+                for i, row in enumerate(values):
+                    elements = [l[j] for l, j in zip(self.lists[:-1], np.unravel_index(i, rows_shape))] if rows_shape else []
+                    writer.writerow([s, '' if iteration is None else iteration] + elements + row.tolist())
+
+    def read_csv(self, fname, scenarios):
+        """Use the final results saved by write_csv() in fname (e.g., by an earlier run) as the previous iteration
+
+        Input arguments:
+            fname: file written by write_csv()
+            scenarios: scenarios to read; a scenario is only read if fname has a value for each of its elements
+        Returns: list of the scenarios read
+        """
+        rows_shape = self.shape[:-1]
+        # Position of each row of results, keyed by its elements as text
+        row_pos = {}
+        for i in range(int(np.prod(rows_shape))):
+            elements = [l[j] for l, j in zip(self.lists[:-1], np.unravel_index(i, rows_shape))] if rows_shape else []
+            row_pos[tuple(str(e) for e in elements)] = i
+        values = {}
+        with open(fname, newline = '') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader)
+            n = 2 + len(rows_shape)
+            col_pos = {c: k for k, c in enumerate(header[n:])}
+            cols = [col_pos.get(str(y)) for y in self.lists[-1]]
+            if any(c is None for c in cols):
+                return []
+            for row in reader:
+                if not row or row[0] not in scenarios or tuple(row[2:n]) not in row_pos:
+                    continue
+                if row[0] not in values:
+                    values[row[0]] = np.full(self.size, np.nan)
+                i = row_pos[tuple(row[2:n])]
+                values[row[0]][i * self.shape[-1]:(i + 1) * self.shape[-1]] = [float(row[n + c]) for c in cols]
+        read = [s for s, v in values.items() if not np.any(np.isnan(v))]
+        for s in read:
+            self.previous[s] = values[s]
+        return read
+
+    def state(self):
+        """Return the results kept by the engine (e.g., to write a checkpoint)"""
+        return {'previous': self.previous, 'current': self.current, 'frozen': self.frozen}
+
+    def restore(self, state):
+        """Restore results returned by state()"""
+        self.previous = dict(state['previous'])
+        self.current = dict(state['current'])
+        self.frozen = dict(state['frozen'])
+
+    def check(self, scenarios = None):
+        """Compare the current and previous iterations
+
+        Input arguments:
+            scenarios: scenarios to check; by default, all scenarios recorded in both iterations
+        Returns: dictionary of ConvergenceResult keyed by scenario
+        """
+        if scenarios is None:
+            scenarios = [s for s in self.current if s in self.previous]
+        if not scenarios or self.size == 0:
+            return {s: ConvergenceResult(0.0, True, None, []) for s in scenarios}
+        current = np.vstack([self.current[s] for s in scenarios])
+        previous = np.vstack([self.previous[s] for s in scenarios])
+        reldiff = relative_differences(current, previous)
+        test_values = np.sqrt(np.mean(reldiff**2, axis = 1))
+        # Largest relative differences in each scenario, largest first; the largest one is always found
+        n = min(max(self.top_n, 1), self.size)
+        top = np.argpartition(-reldiff, n - 1, axis = 1)[:, :n]
+        order = np.argsort(-np.take_along_axis(reldiff, top, axis = 1), axis = 1, kind = 'stable')
+        top = np.take_along_axis(top, order, axis = 1)
+        results = {}
+        for k, s in enumerate(scenarios):
+            offenders = []
+            for i in top[k]:
+                elements = [l[j] for l, j in zip(self.lists, np.unravel_index(i, self.shape))]
+                offenders.append([elements, reldiff[k, i], previous[k, i], current[k, i]])
+            results[s] = ConvergenceResult(test_values[k], bool(test_values[k] <= self.tolerance), offenders[0], offenders[:self.top_n])
+        return results
+
+class DamConvergence:
+    """Track convergence of the series exchanged for each hydropower dam, by scenario
+
+    Input arguments:
+        tolerance: maximum root-mean-square relative difference between iterations for a series to have converged
+        enabled: if False, no dam is ever frozen
+    Notes:
+        Two series are exchanged for each dam: WEAP hydropower generation, from which LEAP maximum availabilities
+        are calculated ("WEAP to LEAP"), and LEAP hydropower generation, which is written to WEAP as energy
+        demand ("LEAP to WEAP"). Once both have converged, the dam is frozen for the scenario: the values last
+        written for it are kept, and it is skipped in later iterations.
+    """
+    DIRECTIONS = ['WEAP to LEAP', 'LEAP to WEAP']
+
+    def __init__(self, tolerance, enabled = True):
+        self.tolerance = tolerance
+        self.enabled = enabled
+        self.last = {} # Last values keyed by (direction, scenario, dam)
+        self.within = {} # Whether the last values were within tolerance, keyed by (direction, scenario, dam)
+        self.frozen = {} # Iteration in which the dam was frozen, keyed by (scenario, dam)
+        self.iteration = 0
+        self.frozen_count = 0
+        self.skipped = 0
+
+    def start_iteration(self, iteration):
+        self.iteration = iteration
+
+    def is_frozen(self, scenario, dam):
+        """Return True if the dam is frozen for scenario; counts a skipped exchange"""
+        if (scenario, dam) in self.frozen:
+            self.skipped += 1
+            return True
+        return False
+
+    def observe(self, direction, scenario, dam, values):
+        """Compare the values of a series with those observed in the previous iteration; returns True if the dam is now frozen"""
+        if not self.enabled:
+            return False
+        key = (direction, scenario, dam)
+        values = np.nan_to_num(np.asarray(values, dtype = np.float64).ravel())
+        previous = self.last.get(key)
+        self.last[key] = values
+        if previous is not None and previous.size == values.size and values.size > 0:
+            self.within[key] = bool(np.sqrt(np.mean(relative_differences(values, previous)**2)) <= self.tolerance)
+        if all(self.within.get((d, scenario, dam), False) for d in self.DIRECTIONS):
+            self.frozen[(scenario, dam)] = self.iteration
+            self.frozen_count += 1
+            logging.info('\t' + _('Exchanges for hydropower dam {d} converged in scenario {s}; it will not be updated in later iterations').format(d = dam, s = scenario))
+            return True
+        return False
+
+    def forget(self, scenario):
+        """Drop all information for scenario (e.g., once it has converged)"""
+        for d in [self.last, self.within]:
+            for key in [k for k in d if k[1] == scenario]:
+                del d[key]
+        for key in [k for k in self.frozen if k[0] == scenario]:
+            del self.frozen[key]
+
+    def state(self):
+        """Return the series and frozen dams tracked (e.g., to write a checkpoint)"""
+        return {'last': self.last, 'within': self.within, 'frozen': self.frozen, 'frozen_count': self.frozen_count, 'skipped': self.skipped}
+
+    def restore(self, state):
+        """Restore information returned by state()"""
+        self.last = dict(state['last'])
+        self.within = dict(state['within'])
+        self.frozen = dict(state['frozen'])
+        self.frozen_count = state['frozen_count']
+        self.skipped = state['skipped']
+
+    def log_stats(self):
+        if self.enabled:
+            logging.info(_('Hydropower dams frozen after converging: {n}; exchanges skipped: {k}').format(n = self.frozen_count, k = self.skipped))
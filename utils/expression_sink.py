@@ -0,0 +1,50 @@
+import hashlib
+import logging
+
+#==================================================================================================#
+# Record of expressions written to LEAP and WEAP, used to skip writes that would change nothing
+#
+# Each iteration rewrites the same expressions, often with the same values. Every write is a COM call
+# and marks the scenario as needing calculation, so a hash of the last expression written to each
+# (app, branch, variable, scenario, region) is kept and identical writes are skipped. The number of
+# expressions that actually changed in an iteration is a cheap early signal of convergence.
+#==================================================================================================#
+
+class ExpressionSink:
+    """Decide whether an expression write is needed, and count changes per iteration"""
+    def __init__(self):
+        self.hashes = {}
+        self.changes = 0 # Expressions changed in the current iteration
+        self.skipped = 0 # Writes skipped in the current iteration
+
+    @staticmethod
+    def _hash(expression):
+        return hashlib.sha1(expression.encode('utf-8')).hexdigest()
+
+    def needs_write(self, app_name, branch_path, variable, scenario, region, expression):
+        """Return True if expression differs from the last one recorded for the target; False (and count a skipped write) otherwise"""
+        if self.hashes.get((app_name, branch_path, variable, scenario, region)) == self._hash(expression):
+            self.skipped += 1
+            return False
+        return True
+
+    def record(self, app_name, branch_path, variable, scenario, region, expression):
+        """Record that expression was written to the target"""
+        self.hashes[(app_name, branch_path, variable, scenario, region)] = self._hash(expression)
+        self.changes += 1
+
+    def state(self):
+        """Return the hashes of the expressions recorded (e.g., to write a checkpoint)"""
+        return self.hashes
+
+    def restore(self, hashes):
+        """Restore hashes returned by state(); only valid if the LEAP and WEAP areas were saved when state() was called"""
+        self.hashes = dict(hashes)
+
+    def end_iteration(self, iteration):
+        """Log and reset the counts for this iteration; returns the number of expressions changed"""
+        changes = self.changes
+        logging.info(_('Iteration {i}: {n} expression(s) changed, {m} unchanged write(s) skipped').format(i = iteration, n = changes, m = self.skipped))
+        self.changes = 0
+        self.skipped = 0
+        return changes
@@ -1,6 +1,9 @@
 import re
 import os #os.path, os.system
-from winreg import *
+try:
+    from winreg import *
+except ImportError:
+    ConnectRegistry = None # Not on Windows, so the registry is not searched
 
 # function that retrieve path where julia is installed
 def get_julia_path(shell):
@@ -15,13 +18,15 @@ def get_julia_path(shell):
             break
     
 	# Then check in C:\USER\AppData\Local\Programs
-    if juliapath is None:
+    if juliapath is None and 'localappdata' in os.environ:
         for p in os.scandir(os.path.join(os.environ['localappdata'],'Programs')):
             if p.is_dir() and r.search(p.name) is not None:
                 juliapath = os.path.join(p.path, 'bin', 'julia.exe')
                 break
 
     # Then check registry
+    if ConnectRegistry is None:
+        return juliapath
     hklm = ConnectRegistry(None, HKEY_LOCAL_MACHINE)
     hkcu = ConnectRegistry(None, HKEY_CURRENT_USER)
     common_prefix = r"SOFTWARE"
@@ -0,0 +1,74 @@
+import logging
+import numpy as np
+
+#==================================================================================================#
+# Hydropower capacities from LEAP, fetched once per plant and scenario for the whole integration run
+#
+# Converting WEAP generation into LEAP maximum availabilities needs the capacity of each LEAP plant in
+# every WEAP year. Querying LEAP for each plant and year issues one or two ValueR() calls per plant per
+# year per scenario, in every iteration. Capacities are LEAP inputs, which the integration procedure does
+# not change, so each value is fetched once per run: WEAP years outside the LEAP base year to end year are
+# clamped to the nearest LEAP year, and only the distinct clamped years that have not been fetched yet are
+# requested from LEAP.
+#==================================================================================================#
+
+class LeapCapacityProvider:
+    """Serve LEAP hydropower plant capacities [MW] by scenario from memory
+
+    Input arguments:
+        leap: LEAP application object
+        config_params: the configuration data structure for the integration program
+        leap_region_ids: dictionary of LEAP region IDs keyed by region name
+        base_year, end_year: LEAP base year and end year
+    Notes:
+        Create one provider for the integration run. Values, and whether "Minimum Capacity" exists, depend on the scenario,
+        so they are kept by scenario; capacities() must be called with the scenario active in LEAP.
+    """
+    def __init__(self, leap, config_params, leap_region_ids, base_year, end_year):
+        self.leap = leap
+        self.plants = config_params['LEAP']['Hydropower_plants']['plants']
+        self.leap_region_ids = leap_region_ids
+        self.base_year = base_year
+        self.end_year = end_year
+        self.series = {} # Capacities by year from the LEAP base year to end year (NaN if not fetched yet), keyed by (scenario, plant)
+        self.calls_per_year = {} # ValueR() calls per year (2 if "Minimum Capacity" exists, otherwise 1), keyed by (scenario, plant)
+        self.com_calls = 0 # ValueR() calls made since the last call to log_stats()
+        self.com_calls_unbatched = 0 # ValueR() calls that year-by-year lookups would have made since the last call to log_stats()
+
+    def _fetch(self, key, years):
+        """Fetch capacities for the (scenario, plant) key in years (distinct LEAP years) into self.series"""
+        plant = key[1]
+        leap_region_id = self.leap_region_ids[self.plants[plant]['leap_region']]
+        branch = self.leap.Branches(self.plants[plant]['leap_path'])
+        # TODO: Find the unit using Variable.DataUnitID, convert using Unit.ConversionFactor; set a target unit and store its conversion factor
+        # Can't specify unit when querying data variables, but unit for Exogenous Capacity is MW
+        exog_var = branch.Variable("Exogenous Capacity")
+        # Check whether branch "Minimum Capacity" exists (only available in optimized scenarios). Use exogenous capacity when not available
+        min_var = branch.Variable("Minimum Capacity")
+        capacity = np.array([exog_var.ValueR(leap_region_id, int(y), "", "") for y in years], dtype=np.float64)
+        self.com_calls += len(years)
+        if min_var is not None:
+            min_capacity = np.array([min_var.ValueR(leap_region_id, int(y), "", "") for y in years], dtype=np.float64)
+            self.com_calls += len(years)
+            capacity = np.maximum(capacity, min_capacity)
+        self.series[key][years - self.base_year] = capacity
+        self.calls_per_year[key] = 2 if min_var is not None else 1
+
+    def capacities(self, scenario, plant, years):
+        """Return a NumPy array of capacities [MW] for LEAP plant in scenario in each of years, clamped to the LEAP base and end years"""
+        key = (scenario, plant)
+        if key not in self.series:
+            self.series[key] = np.full(self.end_year - self.base_year + 1, np.nan)
+        ndx = np.clip(np.asarray(years), self.base_year, self.end_year) - self.base_year
+        needed = np.unique(ndx)
+        needed = needed[np.isnan(self.series[key][needed])]
+        if len(needed) > 0:
+            self._fetch(key, needed + self.base_year)
+        self.com_calls_unbatched += self.calls_per_year[key] * len(ndx)
+        return self.series[key][ndx]
+
+    def log_stats(self):
+        """Log the ValueR() calls made and saved since the last call"""
+        logging.info('\t' + _('LEAP capacity lookups: {n} ValueR calls made, {s} saved').format(n = self.com_calls, s = max(self.com_calls_unbatched - self.com_calls, 0)))
+        self.com_calls = 0
+        self.com_calls_unbatched = 0
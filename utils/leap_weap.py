@@ -4,8 +4,9 @@ import yaml
 import re
 import time
 import sys
-import win32com.client as win32
 import logging
+import numpy as np
+import pandas as pd
 from collections import OrderedDict # Not necessary with Python 3.7+
 import ctypes, threading # needed for checking cursor
 #import win32gui, win32con # needed for checking cursor
@@ -19,7 +20,8 @@ def leapfloat(x):
     else:
         return float(x)
 
-user32 = ctypes.WinDLL("user32", use_last_error=True)
+# user32 is only available on Windows; elsewhere (e.g., with simulated LEAP and WEAP) the cursor is not checked
+user32 = ctypes.WinDLL("user32", use_last_error=True) if hasattr(ctypes, 'WinDLL') else None
 
 class POINT(ctypes.Structure):
     _fields_ = [("x", wintypes.LONG), ("y", wintypes.LONG)]
@@ -38,9 +40,10 @@ class CURSORINFO(ctypes.Structure):
         ("ptScreenPos", POINT),
     ]
 
-GetCursorInfo = user32.GetCursorInfo
-GetCursorInfo.argtypes = [ctypes.POINTER(CURSORINFO)]
-GetCursorInfo.restype  = wintypes.BOOL
+if user32 is not None:
+    GetCursorInfo = user32.GetCursorInfo
+    GetCursorInfo.argtypes = [ctypes.POINTER(CURSORINFO)]
+    GetCursorInfo.restype  = wintypes.BOOL
 
 def _safe_get_cursor_handle():
     """Return HCURSOR (int-like) or None if unreadable this tick."""
@@ -60,6 +63,9 @@ def print_while_busy_ctypes(poll=1.0, warmup_idle_secs=0.2,
     - Treats any handle seen during the warmup period as 'idle' baseline(s).
     - Stops after seeing an idle handle idle_if_seen_n times in a row.
     """
+    if user32 is None:
+        yield
+        return
     stop = threading.Event()
     idle_handles = set()   # learned during warmup only
     busy_handles = set()   # learned during run
@@ -187,7 +193,7 @@ def split_interp_ex(exp, startyear, endyear, listseparator):
         return_val[1] = "".join([return_val[1], interp_termination])
     return return_val
 
-def add_leap_data_to_weap_interp(weap, leap, weap_scenarios, leap_scenarios, weap_branch, weap_variable, leap_branch, leap_variable, leap_region, data_multiplier, listseparator):
+def add_leap_data_to_weap_interp(weap, leap, weap_scenarios, leap_scenarios, weap_branch, weap_variable, leap_branch, leap_variable, leap_region, data_multiplier, listseparator, weap_writes, leap_writes):
     """Insert LEAP data from specified branch, variable, and region into a WEAP Interp expression for a specified branch and variable
     
     Input arguments:
@@ -197,21 +203,22 @@ def add_leap_data_to_weap_interp(weap, leap, weap_scenarios, leap_scenarios, wea
         leap_branch, leap_variable, and leap_region are strings specifying LEAP branch, variable, and region
         data_multiplier corrects for different units: Set the value so that LEAP and WEAP units are compatible when LEAP values are multiplied by data_multiplier
         listseparator is the currently active Windows list separator character (e.g., "," or ";")
+        weap_writes and leap_writes are ContextScheduler objects for WEAP and LEAP, used to switch scenarios and regions and to queue the WEAP writes
     Returns: Nothing
     
     Notes:
         This procedure doesn't validate branches, variables, and regions: use check_branch_var() and check_region() before the procedure is called.
         The variables weap_scenarios and leap_scenarios should exclude Current Accounts: The procedure adds Current Accounts to local copies of weap_scenarios and leap_scenarios.
+        The new WEAP expressions are written when the weap_writes block exits.
     """
     leap_scenarios_local = leap_scenarios.copy()
     weap_scenarios_local = weap_scenarios.copy()
     leap_scenarios_local.append('Current Accounts')
     weap_scenarios_local.append('Current Accounts')
-    leap.ActiveRegion = leap_region
     # Loop over scenarios and add LEAP data to WEAP expressions.
     for i in range(0, len(leap_scenarios_local)):
-        weap.ActiveScenario = weap_scenarios_local[i]
-        leap.ActiveScenario = leap_scenarios_local[i]
+        weap_writes.activate(scenario = weap_scenarios_local[i])
+        leap_writes.activate(scenario = leap_scenarios_local[i], region = leap_region)
         # logging.info('LEAP Scenario: ' + leap_scenarios_local[i] + '; LEAP Variable: ' + weap.Branches(weap_branch).Variables(weap_variable).Name)
         weap_expression = weap.Branches(weap_branch).Variables(weap_variable).Expression # ' Target expression in WEAP; must be an Interp expression
         if not weap_expression[0:6] == 'Interp':
@@ -232,53 +239,139 @@ def add_leap_data_to_weap_interp(weap, leap, weap_scenarios, leap_scenarios, wea
             new_weap_expression = "".join([new_weap_expression[0:-1], split_weap_expression[1]])
         else:
             new_weap_expression = "".join([new_weap_expression, split_weap_expression[1]])
-        weap.Branches(weap_branch).Variables(weap_variable).Expression = new_weap_expression
+        weap_writes.set_expression(weap_branch, weap_variable, new_weap_expression, scenario = weap_scenarios_local[i])
 
 #--------------------------------------------------------------------------------
 # Process LEAP HPPs
 #--------------------------------------------------------------------------------
-def proc_leap_hpp(leap_export_fname, config_params):
-    hpp = {} # This is the return variable
-    for h in list(config_params['LEAP']['Hydropower_plants']['plants'].keys()):
-        hpp[h] = {}
+# Column headers in LEAP exports have the form "2020 TOKTOGUL" (year, then branch name)
+leap_column_re = re.compile(r'^([1-9][0-9]{3})\s+(.*?)\s*$')
 
-    # Extracts, e.g., "January" from "January: Hour 1" in first match
-    month_re = re.compile(r'^([A-Za-z]+):')
-    year_re = re.compile(r'[1-9][0-9]{3}')
+def index_leap_columns(labels, plants):
+    """Parse LEAP export column labels once into a (plant, year) index
+
+    Input arguments:
+        labels: column labels, e.g., "2020 TOKTOGUL"
+        plants: dictionary of LEAP hydropower plants from config.yml, with 'leap_path' entries
+    Returns: dictionary of {'cols': column indices, 'years': years} keyed by plant, in column order
+
+    A label is assigned to every plant with that LEAP branch (the last part of 'leap_path'), or else to the
+    plant with that name. Otherwise, it is assigned to the longest plant or branch name found in the label as a
+    whole word, so that, e.g., "CHIRCHIK_1X" is never assigned to CHIRCHIK_1.
+    """
+    index = {h: {'cols': [], 'years': []} for h in plants}
+    names = {}
+    for h, entry in plants.items():
+        names.setdefault(entry['leap_path'].split('\\')[-1].strip().upper(), []).append(h)
+    for h in plants:
+        names.setdefault(h.upper(), [h])
+    # Plant and branch names as whole words (not adjacent to letters, digits, or underscores), longest first
+    names_re = re.compile(r'(?<![0-9A-Za-z_])(' + '|'.join(re.escape(n) for n in sorted(names, key = len, reverse = True)) + r')(?![0-9A-Za-z_])')
+    for i, label in enumerate(labels):
+        label_match = leap_column_re.match(label)
+        if label_match is None:
+            continue
+        name = label_match.group(2).upper()
+        if name not in names:
+            found = [m.group(1) for m in names_re.finditer(name)]
+            if not found:
+                continue
+            name = max(found, key = len)
+        for h in names[name]:
+            index[h]['cols'].append(i)
+            index[h]['years'].append(int(label_match.group(1)))
+    return index
+
+# Default memory ceiling for reading a LEAP export, in MB; set with "LEAP export memory (MB)" in config.yml
+LEAP_EXPORT_MEMORY_MB = 256
+# Allowance per field of a row of a LEAP export while it is parsed, in bytes (text of the value, plus separator)
+LEAP_EXPORT_FIELD_BYTES = 32
 
+def read_leap_export_header(leap_export_fname, header_label):
+    """Return [row number, header row] of the first row of a LEAP export starting with header_label"""
     with open(leap_export_fname) as csv_file:
         csv_reader = csv.reader(csv_file, delimiter=',')
-        # Search for header row
-        for hdr in csv_reader:
-            if hdr[0] == "Time slice":
-                break
-        # Extract columns for each hydropower plant
-        for h in hpp:
-            # Will execute regex multiple times per HPP plant, so compile; get indices and years for each HPP
-            hpp_re = re.compile(h)
-            hpp[h]['cols'] = [i for i, item in enumerate(hdr[1:]) if re.search(hpp_re, item)]
-            hpp[h]['years'] = [int(re.match(year_re, hdr[i + 1]).group()) for i in hpp[h]['cols']]
-            hpp[h]['vals'] = {}
-        
-        # Loop over rows of values, summing up months
-        curr_month = ""
-        for val in csv_reader:
-            # If there is a total row it will give "None"
-            month_match = month_re.match(val[0])
-            if month_match is not None:
-                m = month_match.group(1)
-                if m != curr_month:
-                    new = True
-                    curr_month = m
-                else:
-                    new = False
-                for h in hpp:
-                    if hpp[h]['cols']:
-                        curr_vals = [leapfloat(x) for x in [val[i + 1] for i in hpp[h]['cols']]]
-                        if new:
-                            hpp[h]['vals'][m] = curr_vals
-                        else:
-                            hpp[h]['vals'][m] = [hpp[h]['vals'][m][i] + curr_vals[i] for i in range(len(curr_vals))]
+        for hdr_row, hdr in enumerate(csv_reader):
+            if hdr and hdr[0] == header_label:
+                return [hdr_row, hdr]
+    msg = _('Could not find a "{h}" header row in LEAP export {f}. Exiting...').format(h = header_label, f = leap_export_fname)
+    logging.error(msg)
+    sys.exit(msg)
+
+def read_leap_export_chunks(leap_export_fname, hdr_row, hdr, cols, memory_mb = LEAP_EXPORT_MEMORY_MB):
+    """Read the rows below the header of a LEAP export in chunks that fit within a memory ceiling
+
+    Input arguments:
+        leap_export_fname: CSV file exported from LEAP
+        hdr_row, hdr: row number and contents of the header row, from read_leap_export_header()
+        cols: indices of the columns to read, counting from the column after the row labels
+        memory_mb: approximate ceiling on the memory used to parse each chunk, in MB
+    Yields: [row labels, float64 array of values in cols], with LEAP's missing value "-" set to zero
+    """
+    row_bytes = LEAP_EXPORT_FIELD_BYTES * len(hdr) + 8 * len(cols)
+    chunk_rows = max(1, int(memory_mb * 2**20) // row_bytes)
+    reader = pd.read_csv(leap_export_fname, skiprows = hdr_row + 1, header = None, usecols = [0] + [c + 1 for c in cols],
+                         na_values = ['-'], keep_default_na = False, dtype = {0: str}, chunksize = chunk_rows)
+    for chunk in reader:
+        yield [chunk[0].tolist(), np.nan_to_num(chunk.iloc[:, 1:].to_numpy(dtype = np.float64))]
+
+def proc_leap_hpp(leap_export_fname, config_params, leap_ts_info = None):
+    """Read hydropower generation by time slice from a LEAP export and sum it by month
+
+    The export is read in chunks of rows, keeping only monthly running sums, so that memory use stays within
+    "LEAP export memory (MB)" in config.yml even for exports with hourly time slices.
+
+    Input arguments:
+        leap_export_fname: CSV file exported from the LEAP favorite, with a "Time slice" header row
+        config_params: configuration parameters from config.yml
+        leap_ts_info: month numbers keyed by time slice name, from get_leap_timeslice_info(); if not given, the
+            month is taken from the time slice name (e.g., "January" from "January: Hour 1")
+    Returns: dictionary keyed by LEAP plant of {'cols', 'years', 'vals'}, where 'vals' holds a list of values by
+        year, keyed by month name
+    """
+    months = config_params['LEAP']['Months']
+    month_nums = dict(zip(months, range(1, len(months) + 1)))
+    # Extracts, e.g., "January" from "January: Hour 1"
+    month_re = re.compile(r'^([A-Za-z]+):')
+    memory_mb = config_params['Integrated model'].get('LEAP export memory (MB)') or LEAP_EXPORT_MEMORY_MB
+
+    # Extract columns and years for each hydropower plant
+    hdr_row, hdr = read_leap_export_header(leap_export_fname, "Time slice")
+    hpp = index_leap_columns(hdr[1:], config_params['LEAP']['Hydropower_plants']['plants'])
+
+    # Read the columns used by some plant, adding up time slices by month
+    used_cols = sorted(set(i for h in hpp for i in hpp[h]['cols']))
+    used_ndx = {c: i for i, c in enumerate(used_cols)}
+    monthly = np.zeros((len(months), len(used_cols)))
+    present = set()
+    for labels, data in read_leap_export_chunks(leap_export_fname, hdr_row, hdr, used_cols, memory_mb):
+        # Keep time slice rows (a total row has no month)
+        row_months = []
+        keep = []
+        for ts in labels:
+            if leap_ts_info is not None and ts in leap_ts_info:
+                m = leap_ts_info[ts]
+            else:
+                month_match = month_re.match(ts)
+                m = month_nums.get(month_match.group(1)) if month_match is not None else None
+            keep.append(m is not None)
+            if m is not None:
+                row_months.append(m - 1)
+        if not row_months:
+            continue
+        # Sum runs of time slices in the same month, then add the runs to their months
+        row_months = np.array(row_months)
+        starts = np.flatnonzero(np.r_[True, row_months[1:] != row_months[:-1]])
+        np.add.at(monthly, row_months[starts], np.add.reduceat(data[keep], starts, axis = 0))
+        present.update(row_months[starts].tolist())
+
+    for h in hpp:
+        hpp[h]['vals'] = {}
+        if hpp[h]['cols']:
+            ndx = [used_ndx[c] for c in hpp[h]['cols']]
+            for mi, m in enumerate(months):
+                if mi in present:
+                    hpp[h]['vals'][m] = monthly[mi, ndx].tolist()
                         
     return hpp
                 
@@ -326,20 +419,38 @@ def proc_weap_hpp(weap, hpp, config_params):
 
     return hpp_weap
             
-def export_leap_hpp_to_weap(leap, weap, iteration, leap_scenario, weap_scenario, config_params):
+# Move hydropower generation for leap_scenario from LEAP to hydropower energy demand for weap_scenario in WEAP. Returns the name of the energy demand file read by WEAP
+def export_leap_hpp_to_weap(leap, weap, iteration, leap_scenario, weap_scenario, config_params, leap_ts_info = None, accelerator = None, dam_convergence = None):
     energy_unit = config_params['LEAP']['Hydropower_plants']['convergence_check']['leap_unit']
     # 1. Get values from LEAP
     # Get path for storing files and create it if it doesn't exist
-    leap_export_path = os.path.normpath(os.path.join(leap.ActiveArea.Directory, "..\\..", config_params['LEAP']['Folder']))
+    leap_export_path = os.path.normpath(os.path.join(leap.ActiveArea.Directory, "..", "..", config_params['LEAP']['Folder']))
     if not os.path.exists(leap_export_path):
         os.makedirs(leap_export_path)
     leap_export_fname = os.path.join(leap_export_path, leap_scenario + "_iteration_" + str(iteration) + "_HPP.csv")
     favname = "WEAP#hydropower"
     export_leap_favorite_to_csv(leap, favname, leap_scenario, leap_export_fname, energy_unit)
-    hpp = proc_leap_hpp(leap_export_fname, config_params)
+    hpp = proc_leap_hpp(leap_export_fname, config_params, leap_ts_info)
 
     # 2. Load values into WEAP 
     hpp_weap = proc_weap_hpp(weap, hpp, config_params)
+    # Energy demand expressions are left as they are for dams that have converged
+    frozen = set()
+    if dam_convergence is not None:
+        months = config_params['LEAP']['Months']
+        for hw, dam in hpp_weap['dams'].items():
+            if dam_convergence.is_frozen(leap_scenario, hw) or dam_convergence.observe("LEAP to WEAP", leap_scenario, hw, [dam['vals'].get(m, []) for m in months]):
+                frozen.add(hw)
+    # Optionally accelerate convergence, combining with values written in earlier iterations
+    if accelerator is not None:
+        months = config_params['LEAP']['Months']
+        for hw, dam in hpp_weap['dams'].items():
+            if len(dam['vals']) == len(months) and hw not in frozen:
+                vals = [dam['vals'][m] for m in months]
+                accelerated = accelerator.accelerate(("HPP demand", weap_scenario, hw), vals, lower = 0)
+                if accelerated is not vals:
+                    for mi, m in enumerate(months):
+                        dam['vals'][m] = accelerated[mi].tolist()
     energy_unit_string = "[" + energy_unit + "]"
     hpp_hdr = "\"" + (energy_unit_string + "\",\"").join(list(hpp_weap['dams'].keys())) + energy_unit_string + "\""
     hdr = ",".join(["$Columns = Year","Month",hpp_hdr]) + "\n"
@@ -361,8 +472,11 @@ def export_leap_hpp_to_weap(leap, weap, iteration, leap_scenario, weap_scenario,
     weap.ActiveScenario = weap_scenario
     weap_fname_full = os.path.join(config_params['WEAP']['Folder'], weap_fname)
     for hppname, hppitem in hpp_weap['dams'].items():
+        if hppname in frozen: continue
         expression = "ReadFromFile(\"" + weap_fname_full + "\", \"" + hppname + "\")"
         hppobj = weap.Branches(hppitem['path'])
         # A particular plant may not be active in a scenario -- check
         if hppobj is not None:
             hppobj.Variables('Energy Demand').Expression = expression
+
+    return os.path.join(weap_export_path, weap_fname)
@@ -0,0 +1,676 @@
+import os
+import re
+import csv
+import time
+import types
+import logging
+import numpy as np
+from calendar import monthrange
+from utils.weap_results import unit_conversion_factor
+
+#==================================================================================================#
+# Simulated LEAP and WEAP applications
+#
+# LEAP and WEAP only run on Windows, so without them the integration procedure can be neither run nor
+# timed. The classes in this file implement the part of the LEAP and WEAP automation interfaces used by
+# the integration procedure, for synthetic areas generated from config.yml and scenarios.yml by
+# synthetic_area_definitions(). Every call to an application, or to an object obtained from it, waits
+# for a configurable latency, and every scenario calculation waits for a configurable solve time.
+#
+# Results do not depend on the expressions written by the integration procedure. Instead, each time a
+# scenario is calculated its results approach fixed values through a damped oscillation, so the
+# procedure converges after a number of iterations that is set by the damping factor. As in LEAP and
+# WEAP, a scenario is only calculated if an expression has changed since its last calculation (or if
+# a calculation is forced).
+#
+# As with win32com dispatch objects, member names are not case-sensitive.
+#==================================================================================================#
+
+# Amplitude of the relative deviation of results from their final values before the first calculation
+AMPLITUDE = 0.2
+# Favorites used by the integration procedure, with the layout of their CSV exports
+LEAP_FAVORITES = {"9 HPP Energy Generation": "scenarios", "WEAP#hydropower": "time slices"}
+# Conversion factors from GWh to LEAP energy units used for exports
+LEAP_ENERGY_UNITS = {'Gigawatt-Hour': 1.0, 'Megawatt-Hour': 1e3, 'Gigajoule': 3600.0}
+
+class SimulatedObject:
+    """Base class for simulated objects: member names are case-insensitive, and each call waits for the application's latency"""
+    def __init__(self, app):
+        object.__setattr__(self, '_app', app)
+
+    @classmethod
+    def _member(cls, name):
+        members = cls.__dict__.get('_members')
+        if members is None:
+            members = {n.lower(): n for n in dir(cls) if not n.startswith('_')}
+            cls._members = members
+        member = members.get(name.lower())
+        if member is None:
+            raise AttributeError('{c} has no member "{n}"'.format(c = cls.__name__, n = name))
+        return member
+
+    def __getattribute__(self, name):
+        if name.startswith('_'):
+            return object.__getattribute__(self, name)
+        app = object.__getattribute__(self, '_app')
+        value = object.__getattribute__(self, type(self)._member(name))
+        if isinstance(value, types.MethodType):
+            # The latency of a method is incurred when it is called
+            def method(*args):
+                app._wait()
+                return value(*args)
+            return method
+        app._wait()
+        return value
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+            return
+        self._app._wait()
+        object.__setattr__(self, type(self)._member(name), value)
+
+class SimulatedItem(SimulatedObject):
+    """Named item in a collection (e.g., an area, region, scenario, time slice, or favorite)"""
+    def __init__(self, app, name, id = None, tags = ()):
+        super().__init__(app)
+        self._name = name
+        self._id = id
+        self._tags = [t.lower() for t in tags]
+
+    def _matches(self, key):
+        if isinstance(key, str):
+            return self._name.lower() == key.lower()
+        return self._id == key
+
+    @property
+    def Name(self):
+        return self._name
+
+    @property
+    def ID(self):
+        return self._id
+
+class SimulatedArea(SimulatedItem):
+    def __init__(self, app, name, directory):
+        super().__init__(app, name)
+        self._directory = directory
+
+    @property
+    def Directory(self):
+        return self._directory
+
+class SimulatedScenario(SimulatedItem):
+    def __init__(self, app, name, id):
+        super().__init__(app, name, id)
+        self._results_shown = False
+        self._needs_calculation = True
+
+    @property
+    def ResultsShown(self):
+        return self._results_shown
+
+    @ResultsShown.setter
+    def ResultsShown(self, value):
+        self._results_shown = bool(value)
+
+    @property
+    def NeedsCalculation(self):
+        return self._needs_calculation
+
+class SimulatedRegion(SimulatedItem):
+    ResultsShown = True
+
+class SimulatedFavorite(SimulatedItem):
+    def Activate(self):
+        self._app._favorite = self._name
+
+class SimulatedCollection(SimulatedObject):
+    """Collection that can be called with a name (or ID), iterated over, and filtered by tag"""
+    def __init__(self, app, items):
+        super().__init__(app)
+        self._items = list(items)
+
+    def _find(self, key):
+        for item in self._items:
+            if item._matches(key):
+                return item
+        return None
+
+    def __call__(self, key):
+        self._app._wait()
+        return self._find(key)
+
+    def __iter__(self):
+        self._app._wait()
+        return iter(self._items)
+
+    def Exists(self, key):
+        return self._find(key) is not None
+
+    @property
+    def Count(self):
+        return len(self._items)
+
+    def FilterByTag(self, tag):
+        return SimulatedCollection(self._app, [i for i in self._items if tag.lower() in i._tags])
+
+class SimulatedBranches(SimulatedCollection):
+    """Collection of branches, looked up by full path"""
+    def __init__(self, app, branches):
+        super().__init__(app, branches)
+        self._by_path = {b._path.lower(): b for b in branches}
+
+    def _find(self, key):
+        return self._by_path.get(key.lower())
+
+class SimulatedBranch(SimulatedItem):
+    def __init__(self, app, path, tags = ()):
+        super().__init__(app, path.split('\\')[-1], tags = tags)
+        self._path = path
+        self._variables = {}
+
+    def _matches(self, key):
+        return self._path.lower() == key.lower()
+
+    @property
+    def FullName(self):
+        return self._path
+
+    def Variable(self, name):
+        return self._variables.get(name.lower())
+
+    def Variables(self, name):
+        return self._variables.get(name.lower())
+
+    def VariableExists(self, name):
+        return name.lower() in self._variables
+
+class SimulatedVariable(SimulatedObject):
+    """Variable with an expression for each scenario (and region, for LEAP), data values, and (for WEAP) monthly results
+
+    Input arguments:
+        app: the simulated application
+        name, unit: variable name and unit
+        expression: expression used in scenarios (and regions) for which none has been set
+        values: dictionary of NumPy arrays of values by year from the application's base year, keyed by region (None for WEAP)
+        results: NumPy array of monthly results from the application's base year, as they will be after convergence
+    """
+    def __init__(self, app, name, unit, expression = "", values = None, results = None):
+        super().__init__(app)
+        self._name = name
+        self._unit = unit
+        self._expressions = {None: expression}
+        self._values = {} if values is None else values
+        self._results = results
+
+    def _expression(self, scenario, region):
+        for key in [(scenario, region), (scenario, None)]:
+            if key in self._expressions:
+                return self._expressions[key]
+        return self._expressions[None]
+
+    def _value(self, region, year):
+        series = self._values.get(region)
+        if series is None:
+            try:
+                return float(self._expression(self._app._scenario, region))
+            except ValueError:
+                return 0.0
+        return float(series[min(max(year - self._app._base_year, 0), len(series) - 1)])
+
+    def _monthly(self, scenario):
+        if self._results is None:
+            raise ValueError('Variable "{v}" has no results'.format(v = self._name))
+        return self._results * self._app._factor(self._app._scenario_name(scenario))
+
+    @property
+    def Name(self):
+        return self._name
+
+    @property
+    def Unit(self):
+        return self._unit
+
+    @property
+    def ScaleUnit(self):
+        return self._unit
+
+    @property
+    def DataUnitText(self):
+        return self._unit
+
+    @property
+    def Expression(self):
+        return self._expression(self._app._scenario, self._app._region)
+
+    @Expression.setter
+    def Expression(self, value):
+        key = (self._app._scenario, self._app._region)
+        if self._expression(*key) != value:
+            self._expressions[key] = value
+            self._app._expression_changed(self._app._scenario)
+
+    def ExpressionRS(self, region, scenario):
+        return self._expression(self._app._scenario_name(scenario), self._app._region_name(region))
+
+    def Value(self, year):
+        return self._value(self._app._region, year)
+
+    def ValueR(self, region, year, unit = "", filter = ""):
+        return self._value(self._app._region_name(region), year)
+
+    def ResultValues(self, start_year, end_year, scenario):
+        monthly = self._monthly(scenario)[12 * (start_year - self._app._base_year):12 * (end_year - self._app._base_year + 1)]
+        # As in WEAP, the values are preceded by an extra item
+        return tuple([0.0] + monthly.tolist())
+
+class SimulatedApp(SimulatedObject):
+    """Members shared by the simulated LEAP and WEAP applications
+
+    Input arguments:
+        definition: area definition, as returned by synthetic_area_definitions()
+        latency: time [s] taken by each call
+        solve_time: time [s] taken to calculate each scenario
+    """
+    def __init__(self, definition, latency = 0.0, solve_time = 0.0):
+        super().__init__(self)
+        self._latency = latency
+        self._solve_time = solve_time
+        self._calls = 0 # Number of calls made to the application
+        self._base_year = definition['base_year']
+        self._end_year = definition['end_year']
+        self._damping = definition['damping']
+        self._areas = SimulatedCollection(self, [SimulatedArea(self, n, d) for n, d in definition['areas'].items()])
+        self._area = self._areas._find(definition['name'])
+        self._scenarios = SimulatedCollection(self, [SimulatedScenario(self, s, i + 1) for i, s in enumerate(definition['scenarios'])])
+        for s in definition['shown_scenarios']:
+            self._scenarios._find(s)._results_shown = True
+        self._scenario = definition['scenarios'][0]
+        self._region = None
+        self._calculations = {} # Number of times each scenario has been calculated
+        branches = []
+        for path, entry in definition['branches'].items():
+            branch = SimulatedBranch(self, path, entry.get('tags', ()))
+            for name, v in entry['variables'].items():
+                branch._variables[name.lower()] = SimulatedVariable(self, name, v['unit'], v.get('expression', ""), v.get('values'), v.get('results'))
+            branches.append(branch)
+        self._branches = SimulatedBranches(self, branches)
+
+    def __repr__(self):
+        # check_branch_var() identifies the application from characters 11-14 of the repr of the application object
+        return '<Simulated {a}>'.format(a = self._progid)
+
+    def _wait(self):
+        self._calls += 1
+        if self._latency > 0:
+            time.sleep(self._latency)
+
+    def _scenario_name(self, key):
+        scenario = self._scenarios._find(key)
+        if scenario is None:
+            raise ValueError('Unknown scenario "{s}"'.format(s = key))
+        return scenario._name
+
+    def _region_name(self, key):
+        return None
+
+    def _expression_changed(self, scenario):
+        for s in self._scenarios._items:
+            if scenario == self._scenarios._items[0]._name or s._name == scenario:
+                s._needs_calculation = True
+
+    def _calculate(self, force):
+        calculated = [s for s in self._scenarios._items[1:] if s._results_shown and (force or s._needs_calculation)]
+        if self._solve_time > 0:
+            time.sleep(self._solve_time * len(calculated))
+        for s in calculated:
+            s._needs_calculation = False
+            self._calculations[s._name] = self._calculations.get(s._name, 0) + 1
+
+    def _factor(self, scenario):
+        """Ratio of results for scenario to their values after convergence"""
+        return 1 + AMPLITUDE * (-self._damping) ** self._calculations.get(scenario, 0)
+
+    @property
+    def ProgramStarted(self):
+        return True
+
+    @property
+    def ActiveArea(self):
+        return self._area
+
+    @ActiveArea.setter
+    def ActiveArea(self, value):
+        area = self._areas._find(value)
+        if area is None:
+            raise ValueError('Unknown area "{a}"'.format(a = value))
+        self._area = area
+
+    @property
+    def Areas(self):
+        return self._areas
+
+    @property
+    def ActiveScenario(self):
+        return self._scenario
+
+    @ActiveScenario.setter
+    def ActiveScenario(self, value):
+        self._scenario = self._scenario_name(value)
+
+    @property
+    def Scenarios(self):
+        return self._scenarios
+
+    @property
+    def Branches(self):
+        return self._branches
+
+    @property
+    def BaseYear(self):
+        return self._base_year
+
+    @property
+    def IsCalculating(self):
+        return False
+
+    def Sleep(self, milliseconds):
+        time.sleep(milliseconds / 1000)
+
+    def SaveArea(self):
+        pass
+
+class SimulatedLEAP(SimulatedApp):
+    """Stand-in for the LEAP application object (LEAP.LEAPApplication)"""
+    _progid = 'LEAP.LEAPApplication'
+    Visible = False
+    ActiveUnit = ""
+    ActiveView = "Analysis"
+    BeforeScenarioCalc = ""
+
+    def __init__(self, definition, latency = 0.0, solve_time = 0.0):
+        super().__init__(definition, latency, solve_time)
+        self._first_scenario_year = definition['first_scenario_year']
+        self._results_every = definition['results_every']
+        self._regions = SimulatedCollection(self, [SimulatedRegion(self, r, i + 1) for i, r in enumerate(definition['regions'])])
+        self._region = definition['regions'][0]
+        self._timeslices = SimulatedCollection(self, [SimulatedItem(self, t, i + 1) for i, t in enumerate(definition['time_slices'])])
+        self._favorites = SimulatedCollection(self, [SimulatedFavorite(self, f) for f in definition['favorites']])
+        self._favorite_layouts = definition['favorites']
+        self._favorite = None
+        # Generation [GWh] after convergence by plant, year, and month
+        years = np.arange(self._base_year, self._end_year + 1)
+        hours = 24 * np.array([[monthrange(y, m)[1] for m in range(1, 13)] for y in years])
+        self._plants = list(definition['hydropower'].keys())
+        self._generation = np.array([
+            (self._branches._find(p)._variables['exogenous capacity']._values[entry['region']][:, np.newaxis] * hours * np.array(entry['availability'])) / 1000
+            for p, entry in definition['hydropower'].items()])
+
+    def _region_name(self, key):
+        region = self._regions._find(key)
+        if region is None:
+            raise ValueError('Unknown region "{r}"'.format(r = key))
+        return region._name
+
+    @property
+    def EndYear(self):
+        return self._end_year
+
+    @property
+    def FirstScenarioYear(self):
+        return self._first_scenario_year
+
+    @property
+    def ResultsEvery(self):
+        return self._results_every
+
+    @property
+    def Regions(self):
+        return self._regions
+
+    @property
+    def ActiveRegion(self):
+        return self._region
+
+    @ActiveRegion.setter
+    def ActiveRegion(self, value):
+        self._region = self._region_name(value)
+
+    @property
+    def TimeSlices(self):
+        return self._timeslices
+
+    @property
+    def Favorites(self):
+        return self._favorites
+
+    def ShowProgressBar(self, title, msg):
+        pass
+
+    def SetProgressBar(self, percent):
+        pass
+
+    def CloseProgressBar(self):
+        pass
+
+    def Calculate(self, *args):
+        self._calculate(False)
+
+    def ExportResultsCSV(self, fname):
+        """Write hydropower generation for the active favorite to fname, in the layout read by the integration procedure"""
+        if self._favorite not in self._favorite_layouts:
+            raise ValueError('No favorite with a known layout is active')
+        multiplier = LEAP_ENERGY_UNITS[self.ActiveUnit]
+        years = list(range(self._first_scenario_year, self._end_year + 1, self._results_every))
+        ndx = [y - self._base_year for y in years]
+        names = [self._branches._find(p)._name for p in self._plants]
+        cols = ['{y} {n}'.format(y = y, n = n) for n in names for y in years]
+        with open(fname, 'w', newline = '') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(['Area: ' + self._area._name])
+            writer.writerow(['Favorite: ' + self._favorite])
+            writer.writerow(['Units: ' + self.ActiveUnit])
+            if self._favorite_layouts[self._favorite] == "scenarios":
+                writer.writerow(['Scenario'] + cols)
+                for s in self._scenarios._items[1:]:
+                    if s._results_shown:
+                        annual = multiplier * self._factor(s._name) * self._generation[:, ndx, :].sum(axis = 2)
+                        writer.writerow([s._name] + annual.ravel().tolist())
+            else:
+                writer.writerow(['Time slice'] + cols)
+                monthly = multiplier * self._factor(self._scenario) * self._generation[:, ndx, :]
+                slices_per_month = len(self._timeslices._items) // 12
+                for i, t in enumerate(self._timeslices._items):
+                    writer.writerow([t._name] + (monthly[:, :, i // slices_per_month] / slices_per_month).ravel().tolist())
+                writer.writerow(['Total'] + monthly.sum(axis = 2).ravel().tolist())
+
+class SimulatedWEAP(SimulatedApp):
+    """Stand-in for the WEAP application object (WEAP.WEAPApplication)"""
+    _progid = 'WEAP.WEAPApplication'
+    Visible = False
+    Verbose = 1
+    Filter = ""
+    View = "Schematic"
+
+    def __init__(self, definition, latency = 0.0, solve_time = 0.0):
+        super().__init__(definition, latency, solve_time)
+        self._catchments = SimulatedCollection(self, [self._branches._find(p) for p in definition['catchments']])
+        self._demand_sites = SimulatedCollection(self, [self._branches._find(p) for p in definition['demand_sites']])
+
+    @property
+    def EndYear(self):
+        return self._end_year
+
+    @EndYear.setter
+    def EndYear(self, value):
+        self._end_year = value
+
+    @property
+    def Catchments(self):
+        return self._catchments
+
+    @property
+    def DemandSites(self):
+        return self._demand_sites
+
+    def Branch(self, path):
+        return self._branches._find(path)
+
+    def BranchExists(self, path):
+        return self._branches._find(path) is not None
+
+    def Calculate(self, last_year = 0, last_timestep = 0, always_calculate = False, *args):
+        self._calculate(always_calculate)
+
+    def ResultValue(self, pathvar, start_year, start_timestep, scenario, end_year, end_timestep, function = 'Total'):
+        m = re.match(r'^(.*):(.*)\[(.*)\]$', pathvar)
+        branch = self._branches._find(m.group(1))
+        variable = None if branch is None else branch._variables.get(m.group(2).lower())
+        if variable is None:
+            return None
+        factor = unit_conversion_factor(variable._unit, m.group(3))
+        if factor is None:
+            raise ValueError('Cannot convert "{f}" to "{t}"'.format(f = variable._unit, t = m.group(3)))
+        monthly = variable._monthly(scenario)
+        return factor * float(monthly[12 * (start_year - self._base_year) + start_timestep - 1:12 * (end_year - self._base_year) + end_timestep].sum())
+
+class SimulatedShell:
+    """Stand-in for the WScript.Shell object"""
+    def AppActivate(self, title):
+        return True
+
+def synthetic_area_definitions(config_params, scenarios, sim_params):
+    """Generate definitions of LEAP and WEAP areas with the branches, variables, regions, and scenarios named in the configuration
+
+    Input arguments:
+        config_params: the configuration data structure for the integration program
+        scenarios: the scenario mapping data structure (from scenarios.yml)
+        sim_params: the 'Simulation' entry in config_params
+    Returns: A list of the form [leap_definition, weap_definition]
+
+    Notes:
+        Values are random but reproducible for a given seed. LEAP scenarios are the keys of the predefined scenario mapping,
+        and the first 'Scenarios' of them are calculated. WEAP scenarios are the corresponding values in the mapping.
+    """
+    rng = np.random.default_rng(sim_params.get('Seed', 1))
+    base_year = sim_params.get('Base year', 2020)
+    end_year = sim_params.get('End year', 2050)
+    nyears = end_year - base_year + 1
+    folder = os.path.abspath(sim_params.get('Folder', 'Simulated areas'))
+    damping = sim_params.get('Damping', 0.3)
+    slices_per_month = sim_params.get('Time slices per month', 1)
+    growth = lambda: rng.uniform(1, 10) * (1 + rng.uniform(0.005, 0.04)) ** np.arange(nyears)
+
+    leap_scenarios = list(scenarios['predefined scenarios'].keys())
+    weap_scenarios = list(dict.fromkeys(scenarios['predefined scenarios'].values()))
+    shown = leap_scenarios[:sim_params.get('Scenarios', 2)]
+
+    plants = config_params['LEAP']['Hydropower_plants']['plants']
+    regions = list(config_params['LEAP']['Regions'])
+    regions += [p['leap_region'] for p in plants.values() if p['leap_region'] not in regions]
+
+    #------------------------------------
+    # LEAP
+    #------------------------------------
+    leap_branches = {}
+    for entry in config_params['LEAP']['Branches'].values():
+        leap_branches[entry['path']] = {'variables': {entry['variable']: {'unit': entry['unit'], 'expression': "Growth(3%)", 'values': {r: growth() for r in regions}}}}
+    for leap_basin in config_params['WEAP']['Water pumping']['basin_map'].values():
+        leap_branches.setdefault("Demand\\Agriculture\\" + leap_basin + "\\Water demand", {'variables': {"Activity Level": {'unit': "Cubic Meter/No Data"}}})
+
+    hydropower = {}
+    months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+    capacities = {} # Capacity [MW] by plant
+    for lb, entry in plants.items():
+        if entry['leap_path'] in hydropower:
+            capacities[lb] = leap_branches[entry['leap_path']]['variables']["Exogenous Capacity"]['values'][entry['leap_region']]
+            continue
+        capacity = np.full(nyears, round(rng.uniform(20, 2000)))
+        capacities[lb] = capacity
+        variables = {
+            "Exogenous Capacity": {'unit': "Megawatt", 'expression': "Interp({b}, {c}, {e}, {c})".format(b = base_year, e = end_year, c = capacity[0]), 'values': {entry['leap_region']: capacity}},
+            "Maximum Availability": {'unit': "Percent", 'expression': "100"},
+        }
+        for m in months:
+            variables["MaxAvail_" + m] = {'unit': "Percent", 'expression': "100"}
+        leap_branches[entry['leap_path']] = {'variables': variables}
+        # Seasonal availability, highest in early summer
+        hydropower[entry['leap_path']] = {'region': entry['leap_region'], 'availability': (0.5 + 0.3 * np.sin(np.pi * (np.arange(12) - 2) / 6) * rng.uniform(0.5, 1)).tolist()}
+
+    leap_definition = {
+        'name': config_params['LEAP']['Area'],
+        'areas': {config_params['LEAP']['Area']: os.path.join(folder, "LEAP Areas", config_params['LEAP']['Area'])},
+        'base_year': base_year,
+        'first_scenario_year': base_year + 1,
+        'end_year': end_year,
+        'results_every': 1,
+        'damping': damping,
+        'regions': regions,
+        'scenarios': ["Current Accounts"] + leap_scenarios,
+        'shown_scenarios': shown,
+        'time_slices': ['{m}: Hour {h}'.format(m = m, h = h + 1) for m in config_params['LEAP']['Months'] for h in range(slices_per_month)],
+        'favorites': LEAP_FAVORITES,
+        'branches': leap_branches,
+        'hydropower': hydropower,
+    }
+
+    #------------------------------------
+    # WEAP
+    #------------------------------------
+    hours = 24 * np.array([monthrange(y, m)[1] for y in range(base_year, end_year + 1) for m in range(1, 13)])
+    weap_branches = {}
+    for entry in config_params['WEAP']['Branches'].values():
+        weap_branches.setdefault(entry['path'], {'variables': {}})['variables'][entry['variable']] = {'unit': entry['unit'], 'expression': "Interp({y}, 1)".format(y = base_year - 5)}
+    for entry in config_params['WEAP']['Hydropower_plants']['dams'].values():
+        capacity = np.repeat(sum(capacities[lb] for lb in entry['leap_hpps']), 12)
+        availability = np.tile(0.5 + 0.3 * np.sin(np.pi * (np.arange(12) - 3) / 6) * rng.uniform(0.5, 1), nyears)
+        weap_branches[entry['weap_path']] = {'variables': {
+            "Hydropower Generation": {'unit': "GJ", 'results': 3.6 * capacity * hours * availability},
+            "Energy Demand": {'unit': "GJ", 'expression': ""},
+        }}
+    catchments = []
+    demand_sites = []
+    pump_variable = config_params['WEAP']['Water pumping']['variable']
+    pump_unit = config_params['WEAP']['Water pumping']['unit']
+    for weap_basin in config_params['WEAP']['Water pumping']['basin_map'].keys():
+        for wr in config_params['WEAP']['Water pumping']['region_map'].keys():
+            for tag, paths in [("Agriculture", catchments), ("Industrial", demand_sites), ("Domestic", demand_sites)]:
+                path = "Demand Sites and Catchments\\" + " ".join([weap_basin, wr, tag])
+                weap_branches[path] = {'tags': [tag, weap_basin], 'variables': {pump_variable: {'unit': pump_unit, 'results': rng.uniform(1e5, 1e7, 12 * nyears)}}}
+                paths.append(path)
+
+    weap_definition = {
+        'name': config_params['WEAP']['Area'],
+        'areas': {
+            config_params['WEAP']['Area']: os.path.join(folder, "WEAP Areas", config_params['WEAP']['Area']),
+            "Weaping River Basin": os.path.join(folder, "WEAP Areas", "Weaping River Basin"),
+        },
+        'base_year': base_year,
+        'end_year': end_year,
+        'damping': damping,
+        'scenarios': ["Current Accounts"] + weap_scenarios,
+        'shown_scenarios': [],
+        'branches': weap_branches,
+        'catchments': catchments,
+        'demand_sites': demand_sites,
+    }
+
+    return [leap_definition, weap_definition]
+
+def simulated_apps(config_params, scenarios):
+    """Create simulated LEAP and WEAP applications as configured in the 'Simulation' entry of config_params
+
+    Returns: A list of the form [leap, weap, shell]
+    """
+    sim_params = config_params['Simulation'] or {}
+    leap_definition, weap_definition = synthetic_area_definitions(config_params, scenarios, sim_params)
+    for definition in [leap_definition, weap_definition]:
+        for directory in definition['areas'].values():
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+    logging.info(_('Using simulated LEAP and WEAP: latency {l} s (LEAP), {w} s (WEAP) per call; solve time {sl} s (LEAP), {sw} s (WEAP) per scenario').format(
+        l = sim_params.get('LEAP latency', 0), w = sim_params.get('WEAP latency', 0), sl = sim_params.get('LEAP solve time', 0), sw = sim_params.get('WEAP solve time', 0)))
+    leap = SimulatedLEAP(leap_definition, sim_params.get('LEAP latency', 0), sim_params.get('LEAP solve time', 0))
+    weap = SimulatedWEAP(weap_definition, sim_params.get('WEAP latency', 0), sim_params.get('WEAP solve time', 0))
+    return [leap, weap, SimulatedShell()]
@@ -0,0 +1,86 @@
+import os
+import csv
+import re
+import shutil
+import logging
+
+#==================================================================================================#
+# Exchange data saved at the end of a run, for warm starts of later runs
+#
+# At the end of each run, main_integration() saves the last values it passed between LEAP and WEAP for
+# each scenario in the LEAP results folder:
+#   - {LEAP scenario}_MaxAvail.csv: maximum availabilities written to the MaxAvail_* user variables in
+#     LEAP, with one row per hydropower plant and month and one column per year
+#   - {WEAP scenario}_HPP_demand.csv: the last hydropower energy demand file read by WEAP (ReadFromFile)
+# together with the final results used in the convergence checks (LEAP_final_results.csv, etc.).
+#
+# A run with "Warm start from" set to a folder holding those files starts from the saved hydropower energy
+# demand instead of from cleared energy demand in WEAP: files are matched to the scenarios being calculated
+# by name, and the final results of the earlier run are used as the results of the "previous" iteration,
+# so that convergence can be checked after the first iteration. The saved maximum availabilities are not
+# written to LEAP, since the first iteration replaces them before LEAP is calculated; with acceleration,
+# they are used as the values last written, so that acceleration starts an iteration earlier. Scenarios
+# without files start as usual.
+#==================================================================================================#
+
+def max_availability_fname(directory, leap_scenario):
+    return os.path.join(directory, leap_scenario + "_MaxAvail.csv")
+
+def hpp_demand_fname(directory, weap_scenario):
+    return os.path.join(directory, weap_scenario + "_HPP_demand.csv")
+
+def write_max_availabilities(fname, years, series):
+    """Write maximum availabilities to fname
+
+    Input arguments:
+        years: years of the values
+        series: dictionary of lists of values, by year, keyed by (LEAP hydropower plant, month)
+    """
+    with open(fname, 'w', newline = '') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Plant', 'Month'] + list(years))
+        for (plant, month), values in series.items():
+            writer.writerow([plant, month] + list(values))
+
+def read_max_availabilities(fname):
+    """Read maximum availabilities written by write_max_availabilities()
+
+    Returns: [years, dictionary of lists of values keyed by (LEAP hydropower plant, month)], or None if fname does not exist
+    """
+    if not os.path.isfile(fname):
+        return None
+    with open(fname, newline = '') as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        years = [int(y) for y in header[2:]]
+        series = {(row[0], row[1]): [float(v) for v in row[2:]] for row in reader if row}
+    return [years, series]
+
+def hpp_demand_dams(fname):
+    """Return the WEAP hydropower dams in a hydropower energy demand file written by export_leap_hpp_to_weap()"""
+    with open(fname, newline = '') as csvfile:
+        reader = csv.reader(csvfile)
+        for row in reader:
+            # Column names follow the "$Columns" directive, with the unit in square brackets (e.g., TOKTOGUL[GJ])
+            if row and row[0].startswith('$Columns'):
+                return [re.sub(r'\[[^\]]*\]$', '', c) for c in row[2:]]
+    return []
+
+def save_hpp_demand(directory, weap_scenario, fname):
+    """Copy the hydropower energy demand file fname last read by WEAP for weap_scenario to directory"""
+    shutil.copyfile(fname, hpp_demand_fname(directory, weap_scenario))
+
+def load_hpp_demand(directory, weap_scenario, weap_folder_path):
+    """Copy the hydropower energy demand file saved for weap_scenario in directory to weap_folder_path
+
+    Returns: [name of the copy, relative to weap_folder_path, dams in the file], or None if no file was saved for weap_scenario
+    """
+    fname = hpp_demand_fname(directory, weap_scenario)
+    if not os.path.isfile(fname):
+        return None
+    if not os.path.exists(weap_folder_path):
+        os.makedirs(weap_folder_path)
+    copy_fname = weap_scenario + "_warm_start_HPP_demand.csv"
+    shutil.copyfile(fname, os.path.join(weap_folder_path, copy_fname))
+    logging.info('\t' + _('Warm start: hydropower energy demand for WEAP scenario {s} read from {f}').format(s = weap_scenario, f = fname))
+    return [copy_fname, hpp_demand_dams(fname)]
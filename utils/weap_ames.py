@@ -5,11 +5,19 @@ Created on Tue Sep 13 12:48:10 2022
 @author: emily
 """
 
+import sys
+import csv
+import hashlib
 import logging
 import numpy as np
 import pandas as pd
 import os
 
+# Version of the cache files written by read_weap_export()
+WEAP_EXPORT_CACHE_VERSION = 2
+# Static input tables (e.g., crop prices), keyed by file name; read once per process
+_static_tables = {}
+
 # Load and calculate correct scenario
 def load_weap_scen(WEAP, weap_scenario):
     WEAP.View = "Results"
@@ -20,6 +28,80 @@ def export_csv(WEAP, fname, favname):
     WEAP.LoadFavorite(favname)
     WEAP.ExportResults(fname)
 
+def _csv_header(fname, rowskip):
+    """Return the column labels of a CSV file, read from the line after the first rowskip lines"""
+    with open(fname, newline = '') as f:
+        for _line in range(rowskip):
+            next(f)
+        return next(csv.reader(f))
+
+def _csv_digest(fname):
+    """Return the SHA-256 hash of the contents of a file"""
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def read_weap_export(fname, index_col, rowskip, dtype = np.float64):
+    """Read a WEAP favorite exported to a CSV file, interpolating missing values along each row
+
+    Input arguments:
+        fname: the CSV file
+        index_col: the column labeling the rows (e.g., 'Branch')
+        rowskip: Number of rows to skip in WEAP favorites export files
+        dtype: NumPy type of the values
+    Returns: Pandas dataframe with index_col as its first column, followed by the values
+    Notes:
+        The result is kept in a cache file next to the CSV file (fname + ".npz"), which is used instead of parsing the
+        CSV file as long as the CSV file has the same contents. The cache is keyed on a hash of the contents rather than
+        the modification time, because WEAP rewrites the file each time the favorite is exported, even if the results
+        have not changed (e.g., for a scenario that is no longer calculated).
+    """
+    digest = _csv_digest(fname)
+    cache_fname = fname + ".npz"
+    if os.path.isfile(cache_fname):
+        try:
+            with np.load(cache_fname, allow_pickle = False) as cache:
+                if (int(cache['version']) == WEAP_EXPORT_CACHE_VERSION and str(cache['digest']) == digest
+                    and str(cache['index_col']) == index_col and cache['values'].dtype == np.dtype(dtype)):
+                    df = pd.DataFrame(cache['values'], columns = cache['columns'].tolist())
+                    df.insert(0, index_col, cache['index'].astype(object))
+                    return df
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(_('Could not read cached WEAP results {f} ({e}); reading {c}').format(f = cache_fname, e = e, c = fname))
+
+    # Parse with explicit types: text for the row labels, dtype for all other columns
+    dtypes = {c: dtype for c in _csv_header(fname, rowskip)}
+    dtypes[index_col] = str
+    df = pd.read_csv(fname, skiprows=rowskip, na_values = [" "], index_col=[index_col], dtype=dtypes)
+    # Interpolate only the rows with missing values
+    values = df.to_numpy(dtype = dtype)
+    missing = np.isnan(values).any(axis = 1)
+    if missing.any():
+        values[missing] = df.iloc[missing].interpolate(axis = 1).to_numpy(dtype = dtype)
+    df = pd.DataFrame(values, index = df.index, columns = df.columns)
+
+    temp_fname = cache_fname + ".tmp"
+    try:
+        with open(temp_fname, 'wb') as f:
+            np.savez(f, version = WEAP_EXPORT_CACHE_VERSION, digest = np.str_(digest), index_col = np.str_(index_col),
+                     index = np.array(df.index, dtype = str), columns = np.array(df.columns, dtype = str), values = values)
+        os.replace(temp_fname, cache_fname)
+    except OSError as e:
+        logging.warning(_('Could not cache WEAP results in {f} ({e})').format(f = cache_fname, e = e))
+    return df.reset_index()
+
+def read_static_table(fname, rowskip):
+    """Read a static input table (e.g., crop prices) once per process; columns labeled by years are read as float64
+
+    Returns: Pandas dataframe, shared between calls, which must not be modified
+    """
+    fname = os.path.abspath(fname)
+    if fname not in _static_tables:
+        _static_tables[fname] = pd.read_csv(fname, skiprows=rowskip, dtype={c: (np.float64 if c.isdigit() else str) for c in _csv_header(fname, rowskip)})
+    return _static_tables[fname]
+
 # WEAP favorites to export
 def get_weap_ag_results(fdirweapoutput, fdirmain, weap_scenario, WEAP, config_params, rowskip):
     """Export WEAP favorites so they can be converted to AMES inputs using weap_to_ames_processing()
@@ -35,7 +117,9 @@ def get_weap_ag_results(fdirweapoutput, fdirmain, weap_scenario, WEAP, config_pa
         dfcov: Demand site coverage at detailed level
         dfwatdmd: Water demand used as weights to calculate average coverage
         dfcrop: Potential crop production using MABIA potential yields and crop areas
-        dfcropprice: Crop prices
+        dfcropprice: Crop prices (read once per process and shared between calls)
+    Notes:
+        Exports are read with read_weap_export(), which skips parsing an export whose contents are the same as when it was last read
 
     TODO: Specify list_separator
     """
@@ -50,17 +134,13 @@ def get_weap_ag_results(fdirweapoutput, fdirmain, weap_scenario, WEAP, config_pa
     favname = "WEAP Macro\Demand Site Coverage"
     fname = os.path.join(fdirweapoutput, weap_scenario + "_Coverage_Percent.csv")
     export_csv(WEAP, fname, favname)
-    dfcov = pd.read_csv(fname, skiprows=rowskip, na_values = [" "], index_col=['Demand Site']).astype(float)
-    dfcov.interpolate(axis = 1, inplace = True)
-    dfcov.reset_index(inplace=True)
+    dfcov = read_weap_export(fname, 'Demand Site', rowskip)
 
     # Water demand in order to figure out coverage for each country
     favname = "WEAP Macro\Water Demand Annual Total - Level 1"
     fname = os.path.join(fdirweapoutput, weap_scenario + "_Water_Demand_Lvl1.csv")
     export_csv(WEAP, fname, favname)
-    dfwatdmd = pd.read_csv(fname, skiprows=rowskip, na_values = [" "], index_col=['Branch']).astype(float)
-    dfwatdmd.interpolate(axis = 1, inplace = True)
-    dfwatdmd.reset_index(inplace=True)
+    dfwatdmd = read_weap_export(fname, 'Branch', rowskip)
 
     #------------------------------------
     # Potential crop production (for realndx_incr and price series)
@@ -69,16 +149,12 @@ def get_weap_ag_results(fdirweapoutput, fdirmain, weap_scenario, WEAP, config_pa
     favname = "WEAP Macro\Area"
     fname = os.path.join(fdirweapoutput, weap_scenario + "_Area.csv")
     export_csv(WEAP, fname, favname)
-    dfcroparea = pd.read_csv(fname, skiprows=rowskip, na_values = [" "], index_col=['Branch']).astype(float)
-    dfcroparea.interpolate(axis = 1, inplace = True)
-    dfcroparea.reset_index(inplace=True)
+    dfcroparea = read_weap_export(fname, 'Branch', rowskip)
 
     favname = "WEAP Macro\Potential Yield"
     fname = os.path.join(fdirweapoutput, weap_scenario + "_Potential_Yield.csv")
     export_csv(WEAP, fname, favname)
-    dfcroppotyld = pd.read_csv(fname, skiprows=rowskip, na_values = [" "], index_col=['Branch']).astype(float)
-    dfcroppotyld.interpolate(axis = 1, inplace = True)
-    dfcroppotyld.reset_index(inplace=True)
+    dfcroppotyld = read_weap_export(fname, 'Branch', rowskip)
 
     # The tables pull a lot of irrelevant branches -- the intersection is what we want
     common_branches = set(dfcroparea['Branch']).intersection(set(dfcroppotyld['Branch']))
@@ -96,7 +172,7 @@ def get_weap_ag_results(fdirweapoutput, fdirmain, weap_scenario, WEAP, config_pa
     # Crop prices
     #------------------------------------
     fname = os.path.join(os.getcwd(), "data", config_params['AMES']['WEAP']['price_data'])
-    dfcropprice = pd.read_csv(fname, skiprows=rowskip)
+    dfcropprice = read_static_table(fname, rowskip)
 
     #------------------------------------
     # Investment
@@ -113,10 +189,205 @@ def get_weap_ag_results(fdirweapoutput, fdirmain, weap_scenario, WEAP, config_pa
 
     return dfcov, dfwatdmd, dfcrop, dfcropprice
 
+def _tag_countries(names, countries):
+    """Tag each name with the first of the WEAP countries it contains ('other' if none)
+
+    Returns: Pandas Categorical with the countries and 'other' as categories
+    """
+    conditions = [names.str.contains(c, na = False).to_numpy(dtype = bool) for c in countries]
+    if len(conditions) > 1 and (np.sum(conditions, axis = 0) > 1).any():
+        logging.warning(_('Some WEAP branches contain the names of more than one WEAP country; each is assigned to the first country listed for the AMES regions: {b}').format(
+            b = ", ".join(names[np.sum(conditions, axis = 0) > 1].astype(str).head(5))))
+    tags = np.select(conditions, countries, 'other') if conditions else np.full(len(names), 'other')
+    return pd.Categorical(tags, categories = countries + [c for c in ['other'] if c not in countries])
+
+def _plain_index(index):
+    """Convert the categorical levels of an index produced by a groupby to plain labels"""
+    if isinstance(index, pd.MultiIndex):
+        return pd.MultiIndex.from_arrays([index.get_level_values(i).astype(object) for i in range(index.nlevels)], names = index.names)
+    return index.astype(object)
+
+def aggregate_weap_results(config_params, dfcov, dfwatdmd, dfcrop, dfcropprice):
+    """Aggregate WEAP results for one scenario by WEAP country, for all AMES regions at once
+
+    Input arguments:
+        config_params: the configuration data structure for the integration program
+        dfcov, dfwatdmd, dfcrop, dfcropprice: the Pandas dataframes returned by get_weap_ag_results()
+    Returns: dictionary for weap_to_ames_processing() with
+        coverage: dictionary of water-demand-weighted average coverage (as a fraction) by country x year, keyed by WEAP sector name
+        crop_production: potential crop production by country x crop and year
+        crop_prices: crop prices for the same countries, crops, and years as crop_production (NaN if there is no price)
+    Notes:
+        Each row is tagged once with its country, and the coverage and crop production are summed by country in a
+        single groupby, so that each region only selects its countries. A row is tagged with the first country (in the
+        order the AMES regions and their WEAP countries are listed) that its name contains, or with 'other'.
+    """
+    regions = config_params['AMES']['Regions']
+    countries = list(dict.fromkeys(c for rinfo in regions.values() for c in rinfo['weap_region']))
+    sectors = list(dict.fromkeys(s for rinfo in regions.values() for s in rinfo['weap_coverage_mapping']))
+
+    #------------------------------------
+    # Coverage by sector and country
+    #------------------------------------
+    # Detailed WEAP coverage, indexed on Demand site x country, with the monthly average over the year, normalized
+    dfcovyr = dfcov.set_index('Demand Site')
+    dfcovyr.index = pd.MultiIndex.from_arrays([dfcovyr.index, _tag_countries(dfcov['Demand Site'], countries)], names = ['Demand Site', 'country'])
+    # Remove month name and get monthly average over the year
+    dfcovyr.columns = dfcovyr.columns.str[4:]
+    dfcovyr = (dfcovyr.T.groupby(level=0).mean()).T
+    dfcovyr = dfcovyr/100
+    # WEAP water demand (to calculate weights in weighted average), indexed on Branch x country
+    dfwatdmdyr = dfwatdmd.set_index('Branch')
+    dfwatdmdyr.index = pd.MultiIndex.from_arrays([dfwatdmdyr.index, _tag_countries(dfwatdmd['Branch'], countries)], names = ['Branch', 'country'])
+
+    coverage = {}
+    for weap_sectorname in sectors:
+        # Only include demand sites and branches related to this sector
+        dfcovsec = dfcovyr[dfcov['Demand Site'].str.contains(weap_sectorname).to_numpy(dtype = bool)]
+        dfwatdmdsec = dfwatdmdyr[dfwatdmd['Branch'].str.contains(weap_sectorname).to_numpy(dtype = bool)]
+        # Numerator, summed by country
+        wtcovtop = (dfcovsec * dfwatdmdsec).groupby(level = 'country', observed = True).sum()
+        # Denominator
+        wtcovbot = dfwatdmdsec.groupby(level = 'country', observed = True).sum()
+        # Calculate ratio (wtd average coverage)
+        wtcovtop.index = _plain_index(wtcovtop.index)
+        wtcovbot.index = _plain_index(wtcovbot.index)
+        coverage[weap_sectorname] = wtcovtop.div(wtcovbot)
+
+    #------------------------------------
+    # Crop production by country and crop
+    #------------------------------------
+    # Only include branches related to the agricultural sector
+    dfcropsec = dfcrop[dfcrop['Branch'].str.contains(config_params['AMES']['WEAP']['agsector']).to_numpy(dtype = bool)]
+    # Identify countries and crops from branch
+    crops = pd.Categorical(dfcropsec['Branch'].str.rsplit('\\', n=1).str.get(1))
+    dfcropsec = dfcropsec.set_index(pd.MultiIndex.from_arrays([_tag_countries(dfcropsec['Branch'], countries), crops], names = ['country', 'crop']))
+    # Convert columns to numeric and sum to country values
+    dfcropsec = dfcropsec.drop(columns = 'Branch').apply(pd.to_numeric)
+    crop_production = dfcropsec.groupby(level = ['country', 'crop'], observed = True).sum()
+    crop_production.index = _plain_index(crop_production.index)
+
+    #----------------------------------------------------------------------------------------
+    # Ensure that the columns in the prices and crop production matrices are the same
+    #----------------------------------------------------------------------------------------
+    dfcropprice_local = dfcropprice.set_index(['country', 'crop'])
+    # Find difference between the columns in dfcrop and dfcropprice_local
+    diff_cols = dfcropprice_local.columns.difference(dfcrop.columns)
+    # Limit to those containing years (giving True for isdigit) and drop from dfcropprice_local
+    diff_cols = [x for x in diff_cols if x.isdigit()]
+    dfcropprice_local = dfcropprice_local.drop(columns = diff_cols)
+    # Fill in any missing years from dfcrop, assuming constant below and above the min/max year
+    dfcropprice_cols = dfcropprice_local.columns
+    dfcropprice_cols = [x for x in dfcropprice_cols if x.isdigit()]
+    diff_cols = dfcrop.columns.difference(dfcropprice_cols)
+    diff_cols = [x for x in diff_cols if x.isdigit()]
+    # If there are years beyond the available time series, set equal to the value for the earliest/latest year
+    minyr = min(dfcropprice_cols)
+    maxyr = max(dfcropprice_cols)
+    for x in diff_cols:
+        if x < minyr:
+            dfcropprice_local[x] = dfcropprice_local[minyr]
+        elif x > maxyr:
+            dfcropprice_local[x] = dfcropprice_local[maxyr]
+        else:
+            # Must include all years between the min & max, so any interpolation must be done offline
+            msg = _('Must have a complete time series for crop prices: Missing value in year {a}, which is between the minimum and maximum years {b} and {c}').format(a = x, b = minyr, c = maxyr)
+            logging.error(msg)
+            sys.exit(msg)
+    # Resort columns labeling years to ensure they are in order
+    dfcropprice_cols = dfcropprice_local.columns
+    dfcropprice_cols = [x for x in dfcropprice_cols if x.isdigit()]
+    dfcropprice_cols.sort()
+    crop_prices = dfcropprice_local.loc[:,dfcropprice_cols]
+    # Align prices with crop production on a (country, crop) x year grid, with NaN for crops without prices
+    crop_production = crop_production.loc[:,dfcropprice_cols]
+    crop_prices = crop_prices[~crop_prices.index.duplicated()].reindex(crop_production.index)
+
+    return {'coverage': coverage,
+            'crop_production': crop_production,
+            'crop_prices': crop_prices}
+
+def _group_sum(values, groups, ngroups):
+    """Sum the rows of values by group (groups gives the group of each row), counting missing values (NaN) as zero"""
+    totals = np.zeros((ngroups, values.shape[1]))
+    np.add.at(totals, groups, np.where(np.isnan(values), 0.0, values))
+    return totals
+
+def _by_ames(table, labels, ames_map):
+    """Return the rows of table (one per label) for each entry of ames_map (AMES name: label), with NaN for labels not in table"""
+    pos = {c: i for i, c in enumerate(labels)}
+    result = np.full((len(ames_map), table.shape[1]), np.nan)
+    for k, c in enumerate(ames_map.values()):
+        if c in pos:
+            result[k] = table[pos[c]]
+    return result
+
+def _backcast(index_table, names, years, backcast_to = 2010):
+    """Return index_table (names x years) as a year x name dataframe, extended back to backcast_to
+
+    Notes:
+        The index is 1 in the first year, and in earlier years it is extrapolated using the ratio between the first two years
+    """
+    table = index_table.T
+    firstyear = years[0]
+    if firstyear >= backcast_to:
+        # Index is 1 in the first year, then is multiplied by the same factor in each earlier year
+        factor = 1/table[1]
+        backcast = np.cumprod(np.vstack([np.ones(len(names)), np.tile(factor, (firstyear - backcast_to, 1))]), axis = 0)
+        table = np.vstack([backcast[::-1], table[1:]])
+        years = list(range(backcast_to, firstyear)) + list(years)
+    return pd.DataFrame(table, index = pd.Index(years, dtype = 'int64'), columns = list(names))
+
+def crop_price_indices(production, prices, countries, categories, ames_agsec_map, ames_agprod_map, years):
+    """Calculate price and real output indices for AMES from potential crop production and crop prices
+
+    Input arguments:
+        production: potential crop production, as an array of (country, crop) x year
+        prices: crop prices, as an array aligned with production (NaN for crops without prices)
+        countries, categories: WEAP country and crop category of each row of production
+        ames_agsec_map, ames_agprod_map: dictionaries of crop categories keyed by AMES agricultural sector and product
+        years: years of the columns of production and prices, consecutive and in increasing order
+    Returns: [real output index by year x AMES agricultural sector, price index by year x AMES agricultural product], as
+        Pandas dataframes extended back to 2010
+    Notes:
+        The price growth rate of a crop category is the sum over its crops of the growth rate of the crop price,
+        weighted by the crop's share of the value of production of the category in its country. The real output index
+        is the value of production of the category, relative to the first year, divided by the price index.
+    """
+    country_category = pd.MultiIndex.from_arrays([np.asarray(countries), np.asarray(categories)])
+    pair_of_row, pairs = country_category.factorize()
+    cat_of_row, cat_labels = pd.factorize(np.asarray(categories))
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        #------------------------------------
+        # price inflation (growth rate of crop price)
+        #------------------------------------
+        inflation = prices[:, 1:]/prices[:, :-1] - 1.0
+        #------------------------------------
+        # share of production by joint crop category
+        #------------------------------------
+        value = production * prices
+        share = value/_group_sum(value, pair_of_row, len(pairs))[pair_of_row]
+        #------------------------------------
+        # price growth indices (by crop category), with index = 1 in the first year
+        #------------------------------------
+        pricegrowth_jointcrop = _group_sum(inflation * share[:, 1:], cat_of_row, len(cat_labels))
+        pricendx_jointcrop = np.hstack([np.ones((len(cat_labels), 1)), np.cumprod(1.0 + pricegrowth_jointcrop, axis = 1)])
+        #------------------------------------
+        # nominal output index
+        #------------------------------------
+        valndx_joint = _group_sum(production, cat_of_row, len(cat_labels))
+        valndx_joint = valndx_joint/valndx_joint[:, [0]]
+        # Calculate real index by dividing value index by price index
+        realndx_ames_agsec = _by_ames(valndx_joint, cat_labels, ames_agsec_map)/_by_ames(pricendx_jointcrop, cat_labels, ames_agsec_map)
+        pricendx_ames_agprod = _by_ames(pricendx_jointcrop, cat_labels, ames_agprod_map)
+        # Note: Must add some values to get to earlier years: go back to 2010 (only 2014 actually needed, for UZB)
+        return [_backcast(realndx_ames_agsec, ames_agsec_map.keys(), years),
+                _backcast(pricendx_ames_agprod, ames_agprod_map.keys(), years)]
+
 def weap_to_ames_processing(weap_scenario, leap_scenario,
                              config_params, region, countries,
                              fdiramesinput, fdirweapoutput,
-                             dfcov, dfwatdmd, dfcrop, dfcropprice):
+                             aggregates):
     """Process WEAP results and generate CSV files for AMES
 
     Input arguments:
@@ -126,78 +397,23 @@ def weap_to_ames_processing(weap_scenario, leap_scenario,
         countries: the WEAP countries that corresponds to the region
         fdiramesinput: the input folder for AMES (where the files are placed)
         fdirweapoutput: the folder for WEAP outputs as prepared by get_weap_ag_results()
-        dfcov, dfwatdmd, dfcrop, dfcropprice: the Pandas dataframes returned by get_weap_ag_results()
+        aggregates: the WEAP results for the scenario, as returned by aggregate_weap_results()
     Returns: Nothing
 
     TODO: Specify list_separator
     """
 
-    dfcov_local = dfcov.copy()
-    dfwatdmd_local = dfwatdmd.copy()
-    dfcrop_local = dfcrop.copy()
-    dfcropprice_local = dfcropprice.copy()
     #------------------------------------
     # Process coverage data
     #------------------------------------
     coverage = pd.DataFrame()
     for weap_sectorname, weap_sectorentry in config_params['AMES']['Regions'][region]['weap_coverage_mapping'].items():
+        # Weighted average coverage for the WEAP countries in this LEAP region
+        coveragesec = aggregates['coverage'][weap_sectorname]
+        coveragesec = coveragesec.loc[sorted(c for c in coveragesec.index if c in countries)]
         for ames_agsubsect in weap_sectorentry:
-            #----------------------------------------------------------------
-            # Get detailed WEAP coverage data
-            #----------------------------------------------------------------
-            # Remove any demand sites not related to this sector
-            dfcovsec = dfcov_local[dfcov_local['Demand Site'].str.contains(weap_sectorname)].copy()
-            # Extract every row for the WEAP countries in this LEAP region
-            conditions = list(map(dfcovsec.loc[:,'Demand Site'].str.contains, countries))
-            # Add a column to list the countries (default to 'other' if not in the list)
-            dfcovsec.loc[:,'country'] = np.select(conditions, countries, 'other')
-            
-            # Move country column to index 1 and reorder dataframe
-            cols = list(dfcovsec)
-            cols.insert(1, cols.pop(cols.index('country')))
-            dfcovsec = dfcovsec.loc[:,cols]
-            
-            # Index on Demand site x country
-            dfcovsec.set_index(['Demand Site', 'country'], inplace=True)
-            # Remove month name and get monthly average over the year
-            dfcovsec.columns = dfcovsec.columns.str[4:]
-            dfcovsec = (dfcovsec.T.groupby(level=0).mean()).T
-            # Normalize
-            dfcovsec = dfcovsec/100
-
-            #----------------------------------------------------------------
-            # Get WEAP water demand (to calculate weights in weighted average)
-            #----------------------------------------------------------------
-            # Remove any branches not related to this sector
-            dfwatdmdsec = dfwatdmd_local[dfwatdmd_local['Branch'].str.contains(weap_sectorname)].copy()
-            # Extract every row for the WEAP countries in this LEAP region
-            conditions = list(map(dfwatdmdsec.loc[:,'Branch'].str.contains, countries))
-            # Add a column to list the countries (default to 'other' if not in the list)
-            dfwatdmdsec.loc[:,'country'] = np.select(conditions, countries, 'other')
-            
-            # Move country column to index 1 and reorder dataframe
-            cols = list(dfwatdmdsec)
-            cols.insert(1, cols.pop(cols.index('country')))
-            dfwatdmdsec = dfwatdmdsec.loc[:,cols]
-            
-            # Index on Branch x country
-            dfwatdmdsec.set_index(['Branch', 'country'], inplace=True)
-
-            #----------------------------------------------------------------
-            # Calculate coverage as a weighted average
-            #----------------------------------------------------------------
-            # Numerator, summed by country
-            wtcovtop = dfcovsec * dfwatdmdsec
-            wtcovtop = wtcovtop.groupby('country').sum()
-            # Denominator
-            wtcovbot = dfwatdmdsec.groupby('country').sum()
-            # Calculate ratio (wtd average coverage)
-            coveragetemp = wtcovtop.div(wtcovbot)
-            # Drop 'other' region if present
-            coveragetemp = coveragetemp.drop('other', errors='ignore')
-            
             # Replace country label (no longer needed) with the current AMES sector within the current weap sector
-            coveragetemp = coveragetemp.rename(index={countries[0]: ames_agsubsect})
+            coveragetemp = coveragesec.rename(index={countries[0]: ames_agsubsect})
             # Add to the coverage dataframe
             coverage = pd.concat([coverage, coveragetemp])
     
@@ -228,210 +444,24 @@ def weap_to_ames_processing(weap_scenario, leap_scenario,
         for agprod in entry['ames']['product']:
             ames_joint_agprod_map[agprod] = category
 
-    # Add crop categories to dfcropprice_local
-    dfcropprice_local.loc[:,'crop category'] = dfcropprice_local.loc[:,'crop'].map(weap_joint_crop_map)
-    dfcropprice_local.set_index(['country', 'crop', 'crop category'], inplace=True)  # sets first three columns as index
-
-    # Only include branches related to this sector
-    dfcropsec = dfcrop_local[dfcrop_local['Branch'].str.contains(config_params['AMES']['WEAP']['agsector'])].copy()
-    # Extract every row for the WEAP countries in this LEAP region
-    conditions = list(map(dfcropsec.loc[:,'Branch'].str.contains, countries))
-    # Add a column to list the countries (default to 'other' if not in the list)
-    dfcropsec.loc[:,'country'] = np.select(conditions, countries, 'other')
-    
-    # Identify crops from branch
-    dfcropsec.loc[:,'crop']= dfcropsec.loc[:,'Branch'].str.rsplit('\\', n=1).str.get(1)
-    # Map WEAP crops to crop categories
-    dfcropsec.loc[:,'crop category'] = dfcropsec.loc[:,'crop'].map(weap_joint_crop_map)
-    
-    # Move country, crop, and crop category columns to indices 1, 2, and 3 and reorder dataframe
-    cols = list(dfcropsec) # list of columns
-    cols.insert(1, cols.pop(cols.index('country')))
-    cols.insert(2, cols.pop(cols.index('crop')))
-    cols.insert(3, cols.pop(cols.index('crop category')))
-    dfcropsec = dfcropsec.loc[:,cols]
-    
-    # Index on Branch x country x crop x crop category
-    dfcropsec.set_index(['Branch', 'country', 'crop', 'crop category'], inplace=True)
-    # Convert columns to numeric, sum to country values, and drop 'other' if present
-    dfcropsec = dfcropsec.apply(pd.to_numeric)
-    
-    #----------------------------------------------------------------------------------------
-    # Ensure number of columns & rows are the same in the prices and crop production matrices
-    #----------------------------------------------------------------------------------------
-    # ***** Columns
-    # Find difference between the columns in dfcrop_local and dfcropprice_local
-    diff_cols = dfcropprice_local.columns.difference(dfcrop_local.columns)
-    # Limit to those containing years (giving True for isdigit) and drop from dfcropprice_local
-    diff_cols = [x for x in diff_cols if x.isdigit()]
-    dfcropprice_local = dfcropprice_local.drop(columns = diff_cols)
-    # Fill in any missing years from dfcrop_local, assuming constant below and above the min/max year
-    dfcropprice_cols = dfcropprice_local.columns
-    dfcropprice_cols = [x for x in dfcropprice_cols if x.isdigit()]
-    diff_cols = dfcrop_local.columns.difference(dfcropprice_cols)
-    diff_cols = [x for x in diff_cols if x.isdigit()]
-    # If there are years beyond the available time series, set equal to the value for the earliest/latest year
-    minyr = min(dfcropprice_cols)
-    maxyr = max(dfcropprice_cols)
-    for x in diff_cols:
-        if x < minyr:
-            dfcropprice_local[x] = dfcropprice_local[minyr]
-        elif x > maxyr:
-            dfcropprice_local[x] = dfcropprice_local[maxyr]
-        else:
-            # Must include all years between the min & max, so any interpolation must be done offline
-            msg = _('Must have a complete time series for crop prices: Missing value in year {a}, which is between the minimum and maximum years {b} and {c}').format(a = x, b = minyr, c = maxyr)
-            logging.error(msg)
-            sys.exit(msg)
-    # Resort columns labeling years to ensure they are in order
-    dfcropprice_cols = dfcropprice_local.columns
-    dfcropprice_cols = [x for x in dfcropprice_cols if x.isdigit()]
-    dfcropprice_cols.sort()
-    dfcropprice_local = dfcropprice_local.loc[:,dfcropprice_cols]
-
-    # ***** Rows
-    # Sector crop production: Create a "helper column" called "key"
-    dfcropsecgrp = dfcropsec.groupby(['country','crop','crop category']).sum()
-    dfcropsecgrp = dfcropsecgrp.reset_index()
-    dfcropsecgrp['key'] = dfcropsecgrp['country']+dfcropsecgrp['crop'] # helper column
-    # Crop price: Create a "helper column" and called "key"
-    dfcropprice_local = dfcropprice_local.reset_index()
-    dfcropprice_local['key'] = dfcropprice_local['country']+dfcropprice_local['crop'] # helper column
-    # Delete any rows that don't match
-    dfcropprice_local = dfcropprice_local[dfcropprice_local['key'].isin(dfcropsecgrp['key'])]
-    # Sort on the (identical) helper columns & then drop, since no longer needed
-    dfcropsecgrp = dfcropsecgrp.sort_values('key')
-    dfcropprice_local = dfcropprice_local.sort_values('key')
-    dfcropsecgrp = dfcropsecgrp.drop(columns = 'key')
-    dfcropprice_local = dfcropprice_local.drop(columns = 'key')
-    # Reset index columns (country x crop x crop category)
-    dfcropsecgrp.set_index(['country', 'crop', 'crop category'], inplace=True)
-    dfcropprice_local.set_index(['country', 'crop', 'crop category'], inplace=True)
-    dfcropsecgrp.drop(index='other', level='country', errors='ignore', inplace=True) # Drop 'other' if it is present
-
-    #------------------------------------
-    # price inflation (growth rate of crop price)
-    #------------------------------------
-    dfinflation = dfcropprice_local.drop(columns = min(dfcropprice_local.columns))
-    dfinflation_lag = dfcropprice_local.drop(columns = max(dfcropprice_local.columns))
-    dfinflation = dfinflation/dfinflation_lag.values - 1.0
- 
-    #------------------------------------
-    # share of production by joint crop category
-    #------------------------------------
-    # Numerator
-    dfnum = dfcropsecgrp * dfcropprice_local
-    # Denominator
-    dfdom = dfnum.groupby(['country', 'crop category']).sum()
-    # Associate denominator with numerator by merging -- will assign "_x" and "_y" for the year columns in dfnum & dfdom
-    dfnum = dfnum.reset_index()
-    dfdom = dfnum.merge(dfdom, left_on=['country','crop category'], right_on=['country','crop category'], how='right')
-    # Get rid of dfnum columns & get rid of "_y" so same denom for all country/crop combinations
-    dfdom = dfdom[dfdom.columns.drop(list(dfdom.filter(regex='x')))]
-    dfdom.columns = dfdom.columns.str.replace('_y', '')
-    # Assign dfnum & dfdom identically structured indices
-    dfnum.set_index(['country', 'crop', 'crop category'], inplace=True)
-    dfdom.set_index(['country', 'crop', 'crop category'], inplace=True)
-    # Divide numerator by denominator
-    dfshare = dfnum.div(dfdom)
-    # Drop first year because it's not present in the growth rate data frames
-    dfcrop_cols = [x for x in dfcrop_local.columns if x.isdigit()] # keeps if column header has digits (years)
-    dfshare = dfshare.drop(columns = min(dfcrop_cols))
-
-    #------------------------------------
-    # price growth indices (by sector & by product)
-    #------------------------------------
-    pricegrowth_jointcrop = dfinflation * dfshare
-    pricegrowth_jointcrop = pricegrowth_jointcrop.droplevel('country')
-    pricegrowth_jointcrop = pricegrowth_jointcrop.groupby(['crop category']).sum()
-    
-    #--- By AMES ag sector
-    # Create dataframe with no entries
-    pricegrowth_ames_agsec = pd.DataFrame.from_dict(ames_joint_agsec_map, columns=['crop category'], orient='index')
-    pricegrowth_ames_agsec.reset_index(inplace = True)
-    pricegrowth_ames_agsec = pricegrowth_ames_agsec.rename(columns = {'index':'ames_agsec'})
-    
-    # Merge with pricegrowth_jointcrop to assign values, then drop crop categories column
-    pricegrowth_ames_agsec = pricegrowth_ames_agsec.merge(pricegrowth_jointcrop,
-                                                              left_on=['crop category'],
-                                                              right_on=['crop category'],
-                                                              how='left')
-    pricegrowth_ames_agsec.drop('crop category', axis=1, inplace=True)
-    pricegrowth_ames_agsec.set_index('ames_agsec', inplace=True)
-    
-    # Convert from growth rate to index
-    pricendx_ames_agsec = (1.0 + pricegrowth_ames_agsec).cumprod(axis = 1)
-    # Insert index = 1 in first year position
-    pricendx_ames_agsec.insert(0, int(min(pricendx_ames_agsec)) - 1, 1.0)
-    
-    #--- By AMES ag product
-    # Create dataframe with no entries
-    pricegrowth_ames_agprod = pd.DataFrame.from_dict(ames_joint_agprod_map, columns=['crop category'], orient='index')
-    pricegrowth_ames_agprod.reset_index(inplace = True)
-    pricegrowth_ames_agprod = pricegrowth_ames_agprod.rename(columns = {'index':'ames_agprod'})
-    
-    # Merge with pricegrowth_jointcrop to assign values, then drop crop categories column
-    pricegrowth_ames_agprod = pricegrowth_ames_agprod.merge(pricegrowth_jointcrop,
-                                                              left_on=['crop category'],
-                                                              right_on=['crop category'],
-                                                              how='left')
-    pricegrowth_ames_agprod.drop('crop category', axis=1, inplace=True)
-    pricegrowth_ames_agprod.set_index('ames_agprod', inplace=True)
-    
-    # Convert from growth rate to index
-    pricendx_ames_agprod = (1.0 + pricegrowth_ames_agprod).cumprod(axis = 1)
-    # Insert index = 1 in first year position
-    pricendx_ames_agprod.insert(0, int(min(pricendx_ames_agprod)) - 1, 1.0)
+    # Crop production and prices for the WEAP countries in this LEAP region, for crops in the crop categories
+    crop_production = aggregates['crop_production']
+    categories = crop_production.index.get_level_values('crop').map(weap_joint_crop_map)
+    rows = crop_production.index.get_level_values('country').isin(countries) & categories.notna()
+    realndx_ames_agsec, pricendx_ames_agprod = crop_price_indices(crop_production.to_numpy(dtype = np.float64)[rows],
+                                                                  aggregates['crop_prices'].to_numpy(dtype = np.float64)[rows],
+                                                                  crop_production.index.get_level_values('country')[rows],
+                                                                  categories[rows],
+                                                                  ames_joint_agsec_map, ames_joint_agprod_map,
+                                                                  [int(y) for y in crop_production.columns])
 
-    #------------------------------------
-    # nominal output index
-    #------------------------------------
-    # Create a value index by joint product
-    valndx_joint = dfcropsecgrp.groupby('crop category').sum()
-    valndx_joint = valndx_joint.div(valndx_joint[min(valndx_joint)], axis=0)
-    
-    # Assign to AMES ag products
-    # Create dataframe with no entries
-    valndx_ames_agsec = pd.DataFrame.from_dict(ames_joint_agsec_map, columns=['crop category'], orient='index')
-    valndx_ames_agsec.reset_index(inplace = True)
-    valndx_ames_agsec = valndx_ames_agsec.rename(columns = {'index':'ames_agsec'})
-    
-    # Merge with valndx_joint to assign values, then drop crop categories column
-    valndx_ames_agsec = valndx_ames_agsec.merge(valndx_joint,
-                                                    left_on=['crop category'],
-                                                    right_on=['crop category'],
-                                                    how='left')
-    valndx_ames_agsec.drop('crop category', axis=1, inplace=True)
-    valndx_ames_agsec.set_index('ames_agsec', inplace=True)
-    
-    # Calculate real index by dividing value index by price index
-    realndx_ames_agsec = valndx_ames_agsec/pricendx_ames_agsec.values
-    
     #------------------------------------
     # Write out AMES input files
     #------------------------------------
-    # Note: Must add some values to get to earlier years: go back to 2010 (only 2014 actually needed, for UZB)
-    firstyear = int(min(realndx_ames_agsec))
     fname = os.path.join(fdiramesinput, leap_scenario + "_realoutputindex.csv")
-    realndx_ames_agsec = realndx_ames_agsec.T
-    realndx_ames_agsec.index = realndx_ames_agsec.index.astype('int64') # After transpose, the index is years
-    val = 1
-    factor = 1/realndx_ames_agsec.loc[firstyear+1]
-    for y in range(firstyear,2009,-1):
-        realndx_ames_agsec.loc[y] = val
-        val *= factor
-    realndx_ames_agsec.sort_index(inplace=True)
     realndx_ames_agsec.to_csv(fname, index=True, index_label = "year") # final output to csv
 
     fname = os.path.join(fdiramesinput, leap_scenario + "_priceindex.csv")
-    pricendx_ames_agprod = pricendx_ames_agprod.T
-    pricendx_ames_agprod.index = pricendx_ames_agprod.index.astype('int64') # After transpose, the index is years
-    val = 1
-    factor = 1/pricendx_ames_agprod.loc[firstyear+1]
-    for y in range(firstyear,2009,-1):
-        pricendx_ames_agprod.loc[y] = val
-        val *= factor
-    pricendx_ames_agprod.sort_index(inplace=True)
     pricendx_ames_agprod.to_csv(fname, index=True, index_label = "year") # final output to csv
 
     # TODO: Investment parameters
@@ -0,0 +1,104 @@
+import logging
+import numpy as np
+
+#==================================================================================================#
+# Annual WEAP results fetched as full-horizon series
+#
+# weap.ResultValue() returns a single value, so pulling an annual series from WEAP one year at a time
+# costs one COM call per year. Variable.ResultValues() returns every monthly value from the start year
+# to the end year in one call; the months are summed to annual totals with NumPy. Where the bulk call is
+# not available for a branch or variable, or its unit cannot be converted to the requested unit, the
+# values are fetched year by year with weap.ResultValue(); once the bulk call fails or the unit cannot be
+# converted for a variable, the variable is fetched year by year for all branches, with a warning.
+#==================================================================================================#
+
+# Units of WEAP result variables (upper case, as returned by Variable.Unit or used in ResultValue() calls), as
+# [quantity, size in the reference unit of the quantity]
+UNIT_SCALES = {
+    'GJ': ['energy', 1.0],
+    'GIGAJOULE': ['energy', 1.0],
+    'MWH': ['energy', 3.6],
+    'GWH': ['energy', 3600.0],
+    'M3': ['volume', 1.0],
+    'M^3': ['volume', 1.0],
+    'CUBIC METER': ['volume', 1.0],
+    'THOUSAND M^3': ['volume', 1e3],
+    'MILLION M^3': ['volume', 1e6],
+    'BILLION M^3': ['volume', 1e9],
+}
+
+def unit_conversion_factor(from_unit, to_unit):
+    """Return the factor converting values in from_unit to to_unit, or None if either unit is unknown or they measure different quantities"""
+    from_unit = from_unit.strip().upper()
+    to_unit = to_unit.strip().upper()
+    if from_unit == to_unit:
+        return 1.0
+    if from_unit not in UNIT_SCALES or to_unit not in UNIT_SCALES or UNIT_SCALES[from_unit][0] != UNIT_SCALES[to_unit][0]:
+        return None
+    return UNIT_SCALES[from_unit][1] / UNIT_SCALES[to_unit][1]
+
+class WeapResultsFetcher:
+    """Fetch annual totals of WEAP results for the years start_year to end_year
+
+    Input arguments:
+        weap: WEAP application object
+        start_year, end_year: first and last years to return
+    Notes:
+        Results are kept for the lifetime of the object, so create a new one after each WEAP calculation.
+    """
+    def __init__(self, weap, start_year, end_year):
+        self.weap = weap
+        self.start_year = start_year
+        self.end_year = end_year
+        self.years = list(range(start_year, end_year + 1))
+        self.results = {}
+        self.unsupported = set() # (variable, unit) combinations for which the bulk call failed or the unit could not be converted
+        self.bulk_calls = 0
+        self.single_calls = 0
+
+    def _bulk(self, branch_path, variable, unit, scenario):
+        branch = self.weap.Branches(branch_path)
+        if branch is None:
+            return None
+        weap_var = branch.Variables(variable)
+        if weap_var is None:
+            return None
+        factor = unit_conversion_factor(weap_var.Unit, unit)
+        if factor is None:
+            logging.warning(_('Cannot convert "{v}" from {f} to {t}; retrieving it year by year').format(v = variable, f = weap_var.Unit, t = unit))
+            self.unsupported.add((variable, unit))
+            return None
+        # Remove first item, as for hydropower generation in main_integration()
+        monthly = np.array(weap_var.ResultValues(self.start_year, self.end_year, scenario)[1:], dtype=np.float64)
+        self.bulk_calls += 1
+        if len(monthly) != 12 * len(self.years):
+            return None
+        return factor * monthly.reshape(len(self.years), 12).sum(axis=1)
+
+    def _by_year(self, branch_path, variable, unit, scenario):
+        pathvar = "".join([branch_path, ":", variable, "[", unit, "]"])
+        vals = []
+        for y in self.years:
+            val = self.weap.ResultValue(pathvar, y, 1, scenario, y, 12, 'Total')
+            self.single_calls += 1
+            vals.append(np.nan if val is None else val)
+        return np.array(vals, dtype=np.float64)
+
+    def annual(self, branch_path, variable, unit, scenario):
+        """Return a NumPy array of annual totals of variable [unit] for branch_path in scenario, one entry per year"""
+        key = (branch_path, variable, unit, scenario)
+        if key not in self.results:
+            vals = None
+            if (variable, unit) not in self.unsupported:
+                try:
+                    vals = self._bulk(branch_path, variable, unit, scenario)
+                except Exception as e:
+                    logging.warning(_('Could not retrieve "{v}" for all years at once; retrieving year by year: {e}').format(v = variable, e = str(e)))
+                    self.unsupported.add((variable, unit))
+            if vals is None:
+                vals = self._by_year(branch_path, variable, unit, scenario)
+            self.results[key] = vals
+        return self.results[key]
+
+    def log_stats(self):
+        logging.info(_('WEAP results: {b} full-horizon and {s} single-year ResultValue(s) calls').format(b = self.bulk_calls, s = self.single_calls))
@@ -0,0 +1,52 @@
+import re
+import logging
+
+#==================================================================================================#
+# Index of tagged WEAP catchments and demand sites used for the water pumping transfer
+#
+# The pumping transfer sums WEAP results over catchments and demand sites selected by a sector tag, a
+# basin tag, and a region string in the full branch name. Filtering by tag and matching names are COM
+# calls, so the selection is made once per area open rather than once per year.
+#==================================================================================================#
+
+class WeapTagIndex:
+    """Map (sector tag, WEAP basin, WEAP region) to the full names of matching WEAP branches
+
+    Input arguments:
+        weap: WEAP application object; if it is a CachedApp, the index is rebuilt after the area is reopened
+        config_params: the configuration data structure for the integration program
+    Notes:
+        Catchments are selected for the "Agriculture" tag and demand sites for the "Industrial" and "Domestic" tags.
+        The index is built on first use.
+    """
+    CATCHMENT_TAGS = ["Agriculture"]
+    DEMAND_SITE_TAGS = ["Industrial", "Domestic"]
+
+    def __init__(self, weap, config_params):
+        self.weap = weap
+        self.basins = list(config_params['WEAP']['Water pumping']['basin_map'].keys())
+        self.regions = list(config_params['WEAP']['Water pumping']['region_map'].keys())
+        self.index = None
+        if hasattr(weap, 'on_area_change'):
+            weap.on_area_change(self.invalidate)
+
+    def invalidate(self):
+        self.index = None
+
+    def build(self):
+        self.index = {}
+        for weap_basin in self.basins:
+            for tag in self.CATCHMENT_TAGS + self.DEMAND_SITE_TAGS:
+                if tag in self.CATCHMENT_TAGS:
+                    full_names = [wb.FullName for wb in self.weap.Catchments.FilterByTag(tag).FilterByTag(weap_basin)]
+                else:
+                    full_names = [wb.FullName for wb in self.weap.DemandSites.FilterByTag(tag).FilterByTag(weap_basin)]
+                for wr in self.regions:
+                    self.index[(tag, weap_basin, wr)] = [n for n in full_names if re.search(wr, n) is not None]
+        logging.info(_('Indexed tagged WEAP catchments and demand sites for {n} basin(s)').format(n = len(self.basins)))
+
+    def full_names(self, tag, weap_basin, wr):
+        """Return the list of full names of WEAP branches with tags tag and weap_basin whose names contain wr"""
+        if self.index is None:
+            self.build()
+        return self.index[(tag, weap_basin, wr)]